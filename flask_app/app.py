@@ -1,16 +1,23 @@
+import multiprocessing
 from flask import Flask, request, jsonify
 from auth.routes import auth_bp
 from profile.routes import profile_bp
 from transactions.routes import transactions_bp
 from products.routes import products_bp
 from orders.routes import orders_bp
+from reports.routes import reports_bp
 from flask_cors import CORS
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from config import Config
+from database.indexes import indexes_cli, start_index_check
+from products.lowstock import stock_cli, start_reorder_reports
+from orders.reservations import orders_cli, start_reservation_sweeper
+from reports.rollups import reports_cli
+from database.migrations import migrations_cli
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'Idempotent-Replayed'])
 app.config.from_object('config.Config')
 
 # Initialize MongoDB client
@@ -41,6 +48,38 @@ app.register_blueprint(profile_bp, url_prefix='/api')
 app.register_blueprint(transactions_bp, url_prefix='/api')
 app.register_blueprint(products_bp, url_prefix='/api')
 app.register_blueprint(orders_bp, url_prefix='/api')
+app.register_blueprint(reports_bp, url_prefix='/api')
+
+# `flask indexes apply|verify|explain`
+app.cli.add_command(indexes_cli)
+# `flask stock backfill-available|reorder-report`
+app.cli.add_command(stock_cli)
+# `flask orders sweep-reservations|reconcile-reservations`
+app.cli.add_command(orders_cli)
+# `flask reports rebuild`
+app.cli.add_command(reports_cli)
+# `flask migrate backfill-timestamps`
+app.cli.add_command(migrations_cli)
+
+# Background jobs belong to the serving process only
+def start_background_jobs():
+    # Check (or build) indexes in the background; startup never waits on Mongo for this
+    if Config.INDEX_STARTUP_CHECK in ('verify', 'apply'):
+        start_index_check(apply=Config.INDEX_STARTUP_CHECK == 'apply')
+
+    # Optional periodic reorder reports; enable in one worker only
+    if Config.REORDER_REPORT_INTERVAL > 0:
+        start_reorder_reports(Config.REORDER_REPORT_INTERVAL)
+
+    # Release stock held by abandoned In Progress orders
+    if Config.RESERVATION_SWEEP_INTERVAL > 0:
+        start_reservation_sweeper(Config.RESERVATION_SWEEP_INTERVAL)
+
+# The password hashing and image rendering pools use 'spawn', whose processes
+# re-import this module (as __mp_main__ under `python app.py`). They have a
+# parent process; the server does not, so only it starts the jobs.
+if multiprocessing.parent_process() is None:
+    start_background_jobs()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+from config import Config
+
+
+class PasswordHasher:
+    """Runs werkzeug's password KDF in a dedicated process pool.
+
+    Hashing is deliberately slow and holds the GIL, so doing it in a request
+    thread stalls every other request in the worker. Request threads only
+    wait on a future here. With ``workers=0`` hashing runs inline instead.
+    ``method`` is the werkzeug method string, e.g. ``'scrypt:32768:8:1'``;
+    hashes made with any other method are reported by ``needs_rehash``.
+    """
+
+    def __init__(self, method, workers=2, timeout=30.0):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = {"pending": 0, "completed": 0, "failed": 0}
+
+    def _get_executor(self):
+        # One pool per process: a pre-forked worker must not share its parent's pool.
+        # 'spawn' starts clean interpreters that inherit no threads or sockets;
+        # app.py skips its background jobs in them.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            self._executor = None
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        self._count("pending")
+        try:
+            try:
+                result = self._get_executor().submit(fn, *args).result(timeout=self.timeout)
+            except BrokenProcessPool:
+                # A pool worker died; start a fresh pool for the next caller
+                self._reset_executor()
+                result = self._get_executor().submit(fn, *args).result(timeout=self.timeout)
+            self._count("completed")
+            return result
+        except Exception:
+            self._count("failed")
+            raise
+        finally:
+            self._count("pending", -1)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    # True when a stored hash was made with other parameters than the configured ones
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["workers"] = self.workers
+        stats["method"] = self.method
+        return stats
+
+
+password_hasher = PasswordHasher(
+    Config.PASSWORD_HASH_METHOD,
+    workers=Config.PASSWORD_HASH_WORKERS,
+    timeout=Config.PASSWORD_HASH_TIMEOUT,
+)
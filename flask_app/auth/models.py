@@ -1,20 +1,20 @@
-from werkzeug.security import generate_password_hash, check_password_hash
 from pymongo import MongoClient
 import random
 import string
 import uuid
 import datetime
+import hashlib
+import secrets
 from config import Config
-from database.db import users_db, logs_db
-
-# Buffer for batch logging
-log_buffer = []
+from database.db import users_db, password_resets_db
+from database.audit import log_action
+from auth.hashing import password_hasher
 
 class User:
     def __init__(self, username, password, role, business_id=None):
         self.user_id = str(uuid.uuid4())  # Generate a unique user ID
         self.username = username
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
         self.role = role
         self.business_id = business_id  # Associate with a business if applicable
         self.permissions = self.assign_permissions(role)
@@ -58,33 +58,57 @@ class User:
 
     @staticmethod
     def verify_password(stored_password_hash, password):
-        verified = check_password_hash(stored_password_hash, password)
+        verified = password_hasher.verify(stored_password_hash, password)
         if not verified:
             log_action(None, 'failed_verify_password', 'Failed password verification attempt.')
         return verified
 
+    # Store a fresh hash when the stored one was made with other hashing parameters
+    @staticmethod
+    def rehash_password_if_needed(user_data, password):
+        if not password_hasher.needs_rehash(user_data['password_hash']):
+            return False
+        users_db.update_one(
+            {'user_id': user_data['user_id'], 'password_hash': user_data['password_hash']},
+            {'$set': {'password_hash': password_hasher.hash(password)}}
+        )
+        log_action(user_data['user_id'], 'rehash_password', 'Password hash upgraded to current parameters.')
+        return True
+
+    # Issue a single-use reset token. Only its digest is stored, and any earlier
+    # token for the user stops working. The password itself is not touched.
+    @staticmethod
+    def create_password_reset(user_id):
+        token = secrets.token_urlsafe(32)
+        now = datetime.datetime.utcnow()
+        password_resets_db.delete_many({'user_id': user_id})
+        password_resets_db.insert_one({
+            '_id': hashlib.sha256(token.encode('utf-8')).hexdigest(),
+            'user_id': user_id,
+            'created_at': now,
+            'expires_at': now + datetime.timedelta(seconds=Config.PASSWORD_RESET_TTL)
+        })
+        log_action(user_id, 'create_password_reset', 'Password reset token issued.')
+        return token
+
+    # Redeem a reset token and set the new password. Deleting the token is the
+    # claim, so it works once. Returns the user_id, or None for an unknown or
+    # expired token.
+    @staticmethod
+    def redeem_password_reset(token, new_password):
+        reset = password_resets_db.find_one_and_delete({
+            '_id': hashlib.sha256(token.encode('utf-8')).hexdigest(),
+            'expires_at': {'$gt': datetime.datetime.utcnow()}
+        })
+        if not reset:
+            return None
+        users_db.update_one({'user_id': reset['user_id']}, {'$set': {'password_hash': password_hasher.hash(new_password)}})
+        log_action(reset['user_id'], 'redeem_password_reset', 'Password reset with a reset token.')
+        return reset['user_id']
+
     @staticmethod
     def generate_temp_password(length=10):
         characters = string.ascii_letters + string.digits + string.punctuation
         temp_password = ''.join(random.choice(characters) for _ in range(length))
         log_action(None, 'generate_temp_password', 'Temporary password generated.')
         return temp_password
-
-def log_action(user_id, action, details):
-    log_entry = {
-        'user_id': user_id,
-        'action': action,
-        'details': details,
-        'timestamp': datetime.datetime.utcnow()
-    }
-    log_buffer.append(log_entry)
-    if len(log_buffer) >= 100:
-        flush_log_buffer()
-
-def flush_log_buffer():
-    if log_buffer:
-        logs_db.insert_many(log_buffer)
-        log_buffer.clear()
-
-import atexit
-atexit.register(flush_log_buffer)
@@ -0,0 +1,142 @@
+import datetime
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify
+from pymongo import ReturnDocument
+from config import Config
+
+
+class MemoryBucketStore:
+    """Token buckets held in this process, bounded to ``max_entries`` keys.
+
+    The least recently used bucket is evicted first. A bucket evicted while
+    partly drained comes back full, so the bound trades a little accuracy for
+    memory that an attacker cycling usernames cannot grow.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    # Take one token; returns (allowed, seconds until a token is available)
+    def take(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class MongoBucketStore:
+    """Token buckets shared by every worker, one document per key.
+
+    Refill and take happen in a single pipeline update so concurrent workers
+    cannot both spend the last token. Idle buckets are removed by a TTL index
+    on ``expires_at``.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def take(self, key, capacity, rate, now):
+        refill_seconds = capacity / rate
+        bucket = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": {"$min": [capacity, {"$add": [
+                    {"$ifNull": ["$tokens", capacity]},
+                    {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}]}, rate]}
+                ]}]}}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "updated_at": now,
+                    "expires_at": datetime.datetime.utcfromtimestamp(now + refill_seconds),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (1 - bucket["tokens"]) / rate
+
+
+class RateLimiter:
+    """Applies named limits (burst capacity, tokens per second) to bucket keys.
+
+    The shared store is optional; when it fails the limiter falls back to the
+    in-process store rather than letting requests through unthrottled.
+    """
+
+    def __init__(self, store, fallback=None):
+        self.store = store
+        self.fallback = fallback
+        self._limits = {}
+
+    def set_limit(self, name, capacity, per_minute):
+        self._limits[name] = (capacity, per_minute / 60.0)
+
+    # Take a token from each (limit name, key) pair; returns the seconds to wait, 0 when allowed
+    def hit(self, *buckets):
+        now = time.time()
+        retry_after = 0.0
+        for name, key in buckets:
+            capacity, rate = self._limits[name]
+            bucket_key = f"{name}:{key}"
+            try:
+                allowed, wait = self.store.take(bucket_key, capacity, rate, now)
+            except Exception as e:
+                if self.fallback is None:
+                    raise
+                print(f"Rate limit store unavailable, using local buckets: {str(e)}")  # Debug statement
+                allowed, wait = self.fallback.take(bucket_key, capacity, rate, now)
+            if not allowed:
+                retry_after = max(retry_after, wait)
+        return retry_after
+
+
+def _build_limiter():
+    local = MemoryBucketStore(Config.RATE_LIMIT_MAX_KEYS)
+    if Config.RATE_LIMIT_BACKEND == 'mongo':
+        from database.db import rate_limits_db
+        limiter = RateLimiter(MongoBucketStore(rate_limits_db), fallback=local)
+    else:
+        limiter = RateLimiter(local)
+    limiter.set_limit('username', Config.LOGIN_RATE_LIMIT_USER_BURST, Config.LOGIN_RATE_LIMIT_USER_PER_MINUTE)
+    limiter.set_limit('ip', Config.LOGIN_RATE_LIMIT_IP_BURST, Config.LOGIN_RATE_LIMIT_IP_PER_MINUTE)
+    return limiter
+
+login_limiter = _build_limiter()
+
+
+# Decorator throttling credential endpoints by the submitted username and the
+# client address. It runs before the view, so a refused attempt never reaches
+# the password hash.
+def throttled(scope):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            data = request.get_json(silent=True) or {}
+            buckets = [('ip', f"{scope}:{request.remote_addr}")]
+            username = data.get('username')
+            if isinstance(username, str) and username:
+                buckets.append(('username', f"{scope}:{username.lower()}"))
+            retry_after = login_limiter.hit(*buckets)
+            if retry_after:
+                print(f"Rate limited {scope} attempt from {request.remote_addr}")  # Debug statement
+                response = jsonify({"message": "Too many attempts, please try again later"})
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response, 429
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
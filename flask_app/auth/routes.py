@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify
+from pymongo.errors import DuplicateKeyError
 from auth.models import User
-from auth.utils import authenticate, create_jwt, verify_jwt, login_required
+from auth.utils import authenticate, create_jwt, verify_jwt, login_required, revoke_token
+from auth.hashing import password_hasher
+from auth.ratelimit import throttled
+from database.db import users_db
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -11,15 +15,16 @@ def register():
     password = data.get('password')
     role = data.get('role', 'user')  # Default role is 'user'
     business_id = data.get('business_id')  # Optional, only needed for Business Owner or Moderator
-    print(User,'getting it right ? ')
-    if User.find_by_username(username):
-        return jsonify({"message": "User already exists"}), 400
-    print(User,'getting it right ? ')
+    # The unique index on users.username decides, so concurrent registrations cannot both win
     user = User(username, password, role, business_id)
-    user.save()
+    try:
+        user.save()
+    except DuplicateKeyError:
+        return jsonify({"message": "User already exists"}), 400
     return jsonify({"message": "User registered successfully", "user_id": user.user_id}), 201  # Return user_id
 
 @auth_bp.route('/login', methods=['POST'])
+@throttled('login')
 def login():
     # Get the JSON data from the request
     auth = request.json
@@ -32,19 +37,32 @@ def login():
     if not username or not password:
         return jsonify({"message": "Missing credentials"}), 400
     
-    # Authenticate the user
-    if not authenticate(username, password):
+    # Authenticate the user; the user document it returns is all the token needs
+    user_data = authenticate(username, password)
+    if not user_data:
         return jsonify({"message": "Invalid credentials"}), 401
     
-    # If authentication is successful, retrieve user data
-    user_data = User.find_by_username(username)
-    
     # Generate a JWT token for the authenticated user
     token = create_jwt(user_data)
     
     # Return the response with the token and user_id
     return jsonify({"message": "Login successful", "token": token, "user_id": user_data['user_id']}), 200
 
+@auth_bp.route('/logout', methods=['POST'])
+@login_required
+def logout(user_data):
+    # Revoke the presented token so it stops working before it expires
+    auth_header = request.headers.get('Authorization')
+    token = auth_header.split(" ")[1] if " " in auth_header else auth_header
+    revoke_token(token)
+    return jsonify({"message": "Logged out"}), 200
+
+# Queue depth and counters of the password hashing pool
+@auth_bp.route('/password-hashing/stats', methods=['GET'])
+@login_required
+def get_password_hashing_stats(user_data):
+    return jsonify(password_hasher.stats()), 200
+
 @auth_bp.route('/change-password', methods=['POST'])
 @login_required
 def change_password(user_data):  # Note that user_data is now passed as an argument
@@ -57,7 +75,7 @@ def change_password(user_data):  # Note that user_data is now passed as an argum
         return jsonify({"message": "New password is required"}), 400
     
     # Hash the new password
-    new_password_hash = generate_password_hash(new_password)
+    new_password_hash = password_hasher.hash(new_password)
     
     # Update the user's password in the database
     users_db.update_one({'username': user_data['username']}, {'$set': {'password_hash': new_password_hash}})
@@ -65,6 +83,7 @@ def change_password(user_data):  # Note that user_data is now passed as an argum
     return jsonify({"message": "Password changed successfully"}), 200
 
 @auth_bp.route('/forgot-password', methods=['POST'])
+@throttled('forgot_password')
 def forgot_password():
     data = request.json
     username = data.get('username')
@@ -73,16 +92,26 @@ def forgot_password():
     if not user_data:
         return jsonify({"message": "User not found"}), 404
     
-    # Generate a random temporary password
-    temp_password = User.generate_temp_password()
+    # The stored password stays valid until the user redeems the token
+    reset_token = User.create_password_reset(user_data['user_id'])
 
-    # TODO: impliment method to send the password
-    # Send the temporary password via email (you need to implement email functionality)
+    # TODO: impliment method to send the reset token
+    # Send the reset token via email (you need to implement email functionality)
     
-    user = User(user_data['username'], temp_password, user_data['role'], user_data['business_id'])
-    user.save()
-    
-    return jsonify({"message": "Temporary password sent to your email"}), 200
+    return jsonify({"message": "Password reset instructions sent to your email"}), 200
+
+@auth_bp.route('/reset-password', methods=['POST'])
+@throttled('reset_password')
+def reset_password():
+    data = request.json
+    token = data.get('token')
+    new_password = data.get('new_password')
+    if not token or not new_password:
+        return jsonify({"message": "token and new_password are required"}), 400
+
+    if not User.redeem_password_reset(token, new_password):
+        return jsonify({"message": "Invalid or expired reset token"}), 400
+    return jsonify({"message": "Password reset successfully"}), 200
 
 @auth_bp.route('/user/<user_id>', methods=['GET'])
 def get_user(user_id):
@@ -1,7 +1,12 @@
 import jwt
 import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from config import Config
 from auth.models import User
-from werkzeug.security import generate_password_hash, check_password_hash
 from tinydb import Query
 from functools import wraps
 from flask import request, jsonify
@@ -18,22 +23,147 @@ def create_jwt(user_data):
     }
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
+class Principal(Mapping):
+    """Read-only view of a verified token's claims handed to protected views.
+
+    It behaves like the claims dict views already use (``user_data.get('user_id')``)
+    and adds ``has_permission`` backed by a frozenset.
+    """
+
+    __slots__ = ('_claims', '_permissions')
+
+    def __init__(self, claims):
+        object.__setattr__(self, '_claims', dict(claims))
+        object.__setattr__(self, '_permissions', frozenset(claims.get('permissions') or ()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Principal is immutable")
+
+    def __getitem__(self, key):
+        return self._claims[key]
+
+    def __iter__(self):
+        return iter(self._claims)
+
+    def __len__(self):
+        return len(self._claims)
+
+    @property
+    def user_id(self):
+        return self._claims.get('user_id')
+
+    @property
+    def role(self):
+        return self._claims.get('role')
+
+    def has_permission(self, permission):
+        return permission in self._permissions
+
+
+class TokenCache:
+    """Bounded LRU of verified tokens keyed by a SHA-256 digest of the token.
+
+    An entry never outlives the token's ``exp`` claim, nor ``ttl`` seconds, so
+    a revocation made in another worker is picked up within ``ttl``.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return entry[1]
+
+    def put(self, digest, expires_at, principal):
+        with self._lock:
+            self._entries[digest] = (min(expires_at, time.time() + self.ttl), principal)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+
+token_cache = TokenCache(max_entries=Config.JWT_CACHE_SIZE, ttl=Config.JWT_CACHE_TTL)
+
+# Callbacks run as fn(token_digest, payload) when a token is first verified;
+# returning True rejects the token. Use them to consult a shared revocation list.
+revocation_checks = []
+
+# Tokens revoked in this worker, digest -> exp, pruned as they expire
+_revoked = {}
+_revoked_lock = threading.Lock()
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+# Register a revocation callback
+def add_revocation_check(check):
+    revocation_checks.append(check)
+    return check
+
+# Revoke a token in this worker immediately
+def revoke_token(token):
+    digest = token_digest(token)
+    try:
+        expires_at = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])['exp']
+    except jwt.InvalidTokenError:
+        expires_at = time.time() + token_cache.ttl
+    with _revoked_lock:
+        now = time.time()
+        for stale in [key for key, exp in _revoked.items() if exp <= now]:
+            del _revoked[stale]
+        _revoked[digest] = expires_at
+    token_cache.discard(digest)
+
+def _is_revoked(digest, payload):
+    with _revoked_lock:
+        if digest in _revoked:
+            return True
+    return any(check(digest, payload) for check in revocation_checks)
+
 def verify_jwt(token):
+    digest = token_digest(token)
+    principal = token_cache.get(digest)
+    if principal is not None:
+        return principal
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'], options={"require": ["exp"]})
     except jwt.ExpiredSignatureError:
         return None  # Token expired
     except jwt.InvalidTokenError:
         return None  # Invalid token
+    if _is_revoked(digest, payload):
+        return None
+    principal = Principal(payload)
+    token_cache.put(digest, payload['exp'], principal)
+    return principal
 
+# Check a username and password with a single user lookup. Returns the user
+# document (ready for create_jwt) on success, None otherwise.
 def authenticate(username, password):
     user_data = User.find_by_username(username)
-    #password = generate_password_hash(password) # comment this once we implimwnt correctly  and hash at froent end only 
-    print(password)
     if user_data and User.verify_password(user_data['password_hash'], password):
-        return True
-    return False
+        # The password is known here, so this is the one chance to move it to new hashing parameters
+        try:
+            User.rehash_password_if_needed(user_data, password)
+        except Exception as e:
+            print('Error rehashing password:', str(e))  # Debug statement
+        return user_data
+    return None
 
 def login_required(f):
     @wraps(f)
@@ -0,0 +1,156 @@
+import atexit
+import copy
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from config import Config
+from database.db import logs_db
+
+# Queue sentinel asking the writer thread to drain and exit
+_STOP = object()
+
+
+class AuditLogWriter:
+    """Buffers audit log entries in a bounded queue and writes them to MongoDB
+    from a background thread with ``insert_many``.
+
+    A batch is flushed when it reaches ``batch_size`` entries or when its oldest
+    entry is ``flush_interval`` seconds old. When the queue is full the
+    ``full_policy`` decides what happens: ``'drop'`` discards the new entry,
+    ``'block'`` waits up to ``block_timeout`` seconds for room and then drops it.
+    """
+
+    def __init__(self, collection, max_queue_size=10000, batch_size=100,
+                 flush_interval=1.0, full_policy='drop', block_timeout=0.05):
+        if full_policy not in ('drop', 'block'):
+            raise ValueError(f"Unknown audit log full_policy: {full_policy}")
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._counters = {"queued": 0, "written": 0, "dropped": 0, "failed": 0}
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._counters[name] += amount
+
+    def _ensure_started(self):
+        # The writer thread is started lazily and restarted after a fork so
+        # that every pre-forked WSGI worker gets its own writer.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, entry):
+        self._ensure_started()
+        try:
+            if self.full_policy == 'block':
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("queued")
+        return True
+
+    def _write(self, batch):
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            self._count("written", len(batch))
+        except Exception as e:
+            print(f"Error writing audit log batch of {len(batch)}: {str(e)}")  # Debug statement
+            self._count("failed", len(batch))
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+            if entry is _STOP:
+                if batch:
+                    self._write(batch)
+                self.flush()
+                return
+            if entry is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(entry)
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+    def flush(self):
+        # Synchronously write whatever is still queued; used at shutdown.
+        batch = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                continue
+            batch.append(entry)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def stop(self, timeout=5.0):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._counters)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+
+audit_log = AuditLogWriter(
+    logs_db,
+    max_queue_size=Config.AUDIT_LOG_QUEUE_SIZE,
+    batch_size=Config.AUDIT_LOG_BATCH_SIZE,
+    flush_interval=Config.AUDIT_LOG_FLUSH_INTERVAL,
+    full_policy=Config.AUDIT_LOG_FULL_POLICY,
+)
+atexit.register(audit_log.stop)
+
+# Utility function to log actions without a database round trip. The details
+# are copied now: callers go on changing the dicts they logged, and the writer
+# thread only encodes them later.
+def log_action(user_id, action, details):
+    audit_log.enqueue({
+        "user_id": user_id,
+        "action": action,
+        "details": copy.deepcopy(details),
+        "timestamp": datetime.utcnow()
+    })
+
+# Counters for queued, written, dropped and failed audit entries
+def get_audit_stats():
+    return audit_log.stats()
@@ -0,0 +1,59 @@
+import datetime
+
+
+class DateParseError(ValueError):
+    pass
+
+
+# Utility function to parse an ISO 8601 date or datetime from a query string
+# into a naive UTC datetime, the form pymongo stores and returns. Dates without
+# a time are midnight; offsets such as +02:00 or Z are converted to UTC.
+def parse_iso(value, name='date'):
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    else:
+        text = (value or '').strip()
+        if text.endswith('Z') or text.endswith('z'):
+            text = text[:-1] + '+00:00'
+        try:
+            parsed = datetime.datetime.fromisoformat(text)
+        except ValueError:
+            raise DateParseError(f"{name} must be an ISO 8601 date or datetime")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+# Utility function to tell whether a query value named only a day (so an upper bound includes that whole day)
+def is_date_only(value):
+    return isinstance(value, str) and len(value.strip()) == 10
+
+# Utility function for the server timestamps stored with a transaction or order:
+#   created_at   when the server accepted it
+#   date_ts      the client's `date` as a BSON datetime, or created_at when it does not parse
+def timestamp_fields(doc, now=None):
+    now = now or datetime.datetime.utcnow()
+    return {"created_at": now, "date_ts": date_timestamp(doc.get('date'), now)}
+
+# Utility function to parse a client `date`, with a fallback when it is missing or malformed
+def date_timestamp(value, default=None):
+    if not value:
+        return default
+    try:
+        return parse_iso(value)
+    except (DateParseError, TypeError):
+        return default
+
+# Utility function to build a date_ts range condition from two query parameters.
+# A date-only upper bound covers the whole of that day. Returns None when
+# neither is given; raises DateParseError for malformed values.
+def date_range(args, start_name='startDate', end_name='endDate'):
+    condition = {}
+    if args.get(start_name):
+        condition["$gte"] = parse_iso(args[start_name], start_name)
+    if args.get(end_name):
+        end = parse_iso(args[end_name], end_name)
+        if is_date_only(args[end_name]):
+            condition["$lt"] = end + datetime.timedelta(days=1)
+        else:
+            condition["$lte"] = end
+    return condition or None
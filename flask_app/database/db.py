@@ -1,4 +1,4 @@
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, ReadPreference
 from config import Config
 
 # Initialize MongoDB client with optimized settings
@@ -24,15 +24,19 @@ pending_transactions_db = db.get_collection('pending_transactions')
 logs_db = db.get_collection('logs')
 payment_db = db.get_collection('payment')
 sessions_db = db.get_collection('sesaions')
+versions_db = db.get_collection('data_versions')
+product_tombstones_db = db.get_collection('product_tombstones')
+rate_limits_db = db.get_collection('rate_limits')
+password_resets_db = db.get_collection('password_resets')
+image_jobs_db = db.get_collection('image_jobs')
+reorder_reports_db = db.get_collection('reorder_reports')
+order_events_db = db.get_collection('order_events')
+idempotency_keys_db = db.get_collection('idempotency_keys')
+sales_rollups_db = db.get_collection('sales_rollups')
+migrations_db = db.get_collection('migrations')
 
-# Define TTL in seconds (e.g., 30 days)
-LOG_RETENTION_SECONDS = 30 * 24 * 60 * 60  # 30 days in seconds
+# Read-modify-write paths must not read from a lagging secondary
+def primary(collection):
+    return collection.with_options(read_preference=ReadPreference.PRIMARY)
 
-# Create a TTL index on the timestamp field of the logs collection
-logs_db.create_index([('timestamp', ASCENDING)], expireAfterSeconds=LOG_RETENTION_SECONDS)
-
-# Create additional indexes to improve query performance (optional)
-profile_db.create_index([('user_id', ASCENDING)])
-transactions_db.create_index([('user_id', ASCENDING)])
-products_db.create_index([('id', ASCENDING)])
-orders_db.create_index([('user_id', ASCENDING), ('invoiceNumber', ASCENDING)])
+# Indexes are declared in database/indexes.py and built with `flask indexes apply`
@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+import datetime
+import zlib
+from itertools import islice
+from bson.objectid import ObjectId
+from flask import request, Response, stream_with_context
+from config import Config
+
+# Export formats: mimetype and file extension
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# Prefix of the columns holding a flattened cart line's own fields
+LINE_PREFIX = 'line_'
+
+
+class ExportError(ValueError):
+    pass
+
+
+# Utility function to read the export parameters:
+#   format=csv|ndjson   output format (csv by default)
+#   lines=1             one row per cart line, the document's fields repeated on each
+#   gzip=1              gzip the body and name the file .gz
+#   fields=a,b,c        only these columns, in this order (line columns as line_<field>)
+def export_params(args):
+    params = {
+        "format": args.get('format', 'csv'),
+        "lines": args.get('lines') in ('1', 'true'),
+        "gzip": args.get('gzip') in ('1', 'true'),
+        "fields": None,
+    }
+    if params["format"] not in EXPORT_FORMATS:
+        raise ExportError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if args.get('fields'):
+        params["fields"] = [field.strip() for field in args['fields'].split(',') if field.strip()]
+    return params
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+def _dumps(value):
+    return json.dumps(value, default=_json_default, separators=(',', ':'))
+
+def _cell(value):
+    # Nested values stay readable in a spreadsheet as JSON
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return _dumps(value)
+    if isinstance(value, (ObjectId, datetime.datetime, datetime.date)):
+        return _json_default(value)
+    return value
+
+# Utility function to turn documents into export rows, one per cart line when asked
+def _rows(cursor, line_field, lines):
+    for doc in cursor:
+        if '_id' in doc:
+            doc['_id'] = str(doc['_id'])
+        if not lines:
+            yield doc
+            continue
+        items = doc.pop(line_field, None) or []
+        if not items:
+            yield doc
+        for item in items:
+            row = dict(doc)
+            row.update({LINE_PREFIX + key: value for key, value in item.items()} if isinstance(item, dict) else {LINE_PREFIX + 'value': item})
+            yield row
+
+def _csv_chunks(rows, fields, batch_size):
+    # Without fields= the columns are those seen in the first batch; the header
+    # has to be written before anything else, so only that batch is held back.
+    first = list(islice(rows, batch_size))
+    if fields is None:
+        fields = list(dict.fromkeys(key for row in first for key in row))
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    if fields:
+        writer.writeheader()
+    batch = first
+    while batch:
+        writer.writerows({key: _cell(row.get(key)) for key in fields} for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        batch = list(islice(rows, batch_size))
+    if not first:
+        yield buffer.getvalue()
+
+def _ndjson_chunks(rows, fields, batch_size):
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        if fields is not None:
+            batch = [{key: row.get(key) for key in fields} for row in batch]
+        yield ''.join(_dumps(row) + '\n' for row in batch)
+
+def _gzip(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(Config.EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+# Stream every document matching a query as a CSV or NDJSON download. The
+# cursor is read batch by batch and each batch is written out before the next
+# is fetched, so memory stays bounded however many documents match.
+def export_documents(collection, query, name, line_field='cart', args=None):
+    params = export_params(request.args if args is None else args)
+    mimetype, extension = EXPORT_FORMATS[params["format"]]
+    batch_size = Config.EXPORT_BATCH_SIZE
+    cursor = collection.find(query).batch_size(batch_size)
+    rows = _rows(cursor, line_field, params["lines"])
+    if params["format"] == 'csv':
+        chunks = _csv_chunks(rows, params["fields"], batch_size)
+    else:
+        chunks = _ndjson_chunks(rows, params["fields"], batch_size)
+
+    filename = f"{name}.{extension}"
+    if params["gzip"]:
+        chunks = _gzip(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the download
+    return response
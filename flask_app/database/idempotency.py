@@ -0,0 +1,147 @@
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import wraps
+from flask import request, jsonify, current_app, Response
+from pymongo.errors import DuplicateKeyError
+from config import Config
+from database.db import idempotency_keys_db, primary
+
+_keys = primary(idempotency_keys_db)
+
+# Record states
+PROCESSING = 'processing'
+DONE = 'done'
+
+
+class ResponseCache:
+    """Small LRU of finished responses in front of the idempotency collection,
+    so a burst of retries for the same key is answered from memory."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, expires_at, record):
+        with self._lock:
+            self._entries[key] = (expires_at, record)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache(Config.IDEMPOTENCY_CACHE_SIZE)
+
+
+def _tenant(args, kwargs):
+    # Protected views get the token's claims first; public ones name the tenant in the URL
+    if args and isinstance(args[0], Mapping):
+        return args[0].get('user_id')
+    return kwargs.get('user_id')
+
+def _fingerprint():
+    return hashlib.sha256(request.get_data()).hexdigest()
+
+def _epoch(expires_at):
+    # Mongo returns naive UTC datetimes
+    return expires_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def _replay(record):
+    response = Response(record["body"], status=record["status"], mimetype=record["mimetype"])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _claim(key, fingerprint, now):
+    # Returns None when this request now owns the key, else the existing record
+    try:
+        _keys.insert_one({
+            "_id": key,
+            "state": PROCESSING,
+            "fingerprint": fingerprint,
+            "created_at": now,
+            "expires_at": now + datetime.timedelta(seconds=Config.IDEMPOTENCY_TTL),
+        })
+        return None
+    except DuplicateKeyError:
+        record = _keys.find_one({"_id": key})
+    if record is None:
+        return _claim(key, fingerprint, now)  # Expired between the insert and the read
+    stale = now - datetime.timedelta(seconds=Config.IDEMPOTENCY_LOCK_TIMEOUT)
+    if record["state"] == PROCESSING and record["created_at"] < stale and record["fingerprint"] == fingerprint:
+        # The request holding the key died; take it over
+        taken = _keys.update_one({"_id": key, "state": PROCESSING, "created_at": record["created_at"]}, {"$set": {"created_at": now}})
+        if taken.modified_count:
+            return None
+    return record
+
+# Decorator making a POST safe to retry. A request carrying an Idempotency-Key
+# header runs once per key (per scope and tenant); a retry gets the stored
+# response back, marked with Idempotent-Replayed, without running the view.
+#   409  the first request with this key is still running
+#   422  the key was already used with a different body
+# 409 and 5xx responses and exceptions are not stored, so those requests can be
+# retried with the same key (409 here means "lost a race, try again").
+def idempotent(scope):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            header = request.headers.get('Idempotency-Key')
+            if not header:
+                return f(*args, **kwargs)
+            if len(header) > 255:
+                return jsonify({"message": "Idempotency-Key is too long"}), 400
+
+            key = f"{scope}:{_tenant(args, kwargs)}:{header}"
+            fingerprint = _fingerprint()
+            record = response_cache.get(key)
+            if record is None:
+                record = _claim(key, fingerprint, datetime.datetime.utcnow())
+            if record is not None:
+                if record["fingerprint"] != fingerprint:
+                    return jsonify({"message": "Idempotency-Key was already used for a different request"}), 422
+                if record["state"] == PROCESSING:
+                    response = jsonify({"message": "A request with this Idempotency-Key is still being processed"})
+                    response.headers['Retry-After'] = '1'
+                    return response, 409
+                response_cache.put(key, _epoch(record["expires_at"]), record)
+                print(f"Replaying response for idempotency key {key}")  # Debug statement
+                return _replay(record)
+
+            try:
+                response = current_app.make_response(f(*args, **kwargs))
+            except Exception:
+                _keys.delete_one({"_id": key, "state": PROCESSING})
+                raise
+            if response.status_code == 409 or response.status_code >= 500 or response.is_streamed:
+                _keys.delete_one({"_id": key, "state": PROCESSING})
+                return response
+
+            record = {
+                "state": DONE,
+                "fingerprint": fingerprint,
+                "status": response.status_code,
+                "mimetype": response.mimetype,
+                "body": response.get_data(as_text=True),
+            }
+            stored = _keys.find_one_and_update({"_id": key}, {"$set": record}, projection={"expires_at": 1})
+            if stored:
+                record["expires_at"] = stored["expires_at"]
+                response_cache.put(key, _epoch(stored["expires_at"]), record)
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,246 @@
+import threading
+import click
+from flask.cli import AppGroup
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+from config import Config
+from database.db import db
+
+# Define TTL in seconds (e.g., 30 days)
+LOG_RETENTION_SECONDS = 30 * 24 * 60 * 60  # 30 days in seconds
+
+# Index options compared when checking for drift
+_COMPARED_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression')
+
+
+class IndexSpec:
+    """One index the application relies on, declared by collection and keys."""
+
+    def __init__(self, collection, keys, reason, **options):
+        self.collection = collection
+        self.keys = [(key, direction) for key, direction in keys]
+        self.reason = reason
+        self.options = options
+        # Same naming scheme as pymongo's default, so existing indexes are recognised
+        self.name = options.pop('name', None) or '_'.join(f"{key}_{direction}" for key, direction in self.keys)
+
+    def differences(self, info):
+        # Options of an existing index (from index_information()) that differ from the spec
+        found = {}
+        if [(key, int(direction)) for key, direction in info.get('key', [])] != [(key, int(direction)) for key, direction in self.keys]:
+            found['key'] = info.get('key')
+        for option in _COMPARED_OPTIONS:
+            if info.get(option) != self.options.get(option):
+                found[option] = info.get(option)
+        return found
+
+    def describe(self):
+        return {"collection": self.collection, "name": self.name, "keys": self.keys, "options": self.options, "reason": self.reason}
+
+
+# Every index the application needs. Add new ones here, never with
+# create_index at import time; they are built by `flask indexes apply`.
+INDEXES = [
+    IndexSpec('logs', [('timestamp', ASCENDING)], "expire audit log entries", expireAfterSeconds=LOG_RETENTION_SECONDS),
+    IndexSpec('users', [('username', ASCENDING)], "login lookup; registration relies on uniqueness", unique=True),
+    IndexSpec('users', [('user_id', ASCENDING)], "user lookup by id"),
+    IndexSpec('profiles', [('user_id', ASCENDING)], "profile per user"),
+    IndexSpec('settings', [('user_id', ASCENDING)], "settings per user"),
+    IndexSpec('products', [('id', ASCENDING)], "product lookup by id without a tenant"),
+    IndexSpec('products', [('user_id', ASCENDING), ('id', ASCENDING)], "product reads and stock writes within a tenant"),
+    IndexSpec('products', [('user_id', ASCENDING), ('change_seq', ASCENDING)], "delta sync"),
+    IndexSpec('products', [('user_id', ASCENDING), ('barcode', ASCENDING)], "barcode scans"),
+    IndexSpec('products', [('user_id', ASCENDING), ('sku', ASCENDING)], "SKU lookups"),
+    IndexSpec('products', [('user_id', ASCENDING), ('available', ASCENDING)], "low stock against the tenant threshold"),
+    IndexSpec('products', [('user_id', ASCENDING), ('reorder_gap', ASCENDING)], "low stock against per-product thresholds",
+              partialFilterExpression={'reorder_gap': {'$exists': True}}),
+    IndexSpec('reorder_reports', [('user_id', ASCENDING), ('generated_at', DESCENDING)], "latest reorder report per tenant"),
+    IndexSpec('product_tombstones', [('user_id', ASCENDING), ('change_seq', ASCENDING)], "delta sync deletions"),
+    IndexSpec('product_tombstones', [('deleted_at', ASCENDING)], "expire tombstones", expireAfterSeconds=Config.PRODUCT_TOMBSTONE_RETENTION_SECONDS),
+    IndexSpec('transactions', [('user_id', ASCENDING)], "transactions per user"),
+    IndexSpec('transactions', [('user_id', ASCENDING), ('date_ts', ASCENDING)], "transaction history and exports by date range"),
+    IndexSpec('transactions', [('user_id', ASCENDING), ('txn_type', ASCENDING), ('date_ts', ASCENDING)], "transaction history filtered by type and date range"),
+    IndexSpec('transactions', [('invoiceNumber', ASCENDING)], "transaction lookup by invoice"),
+    IndexSpec('transactions', [('user_id', ASCENDING), ('client_id', ASCENDING)], "offline batch uploads store each client transaction once",
+              unique=True, partialFilterExpression={'client_id': {'$exists': True}}),
+    IndexSpec('orders', [('user_id', ASCENDING), ('invoiceNumber', ASCENDING)], "orders per user"),
+    IndexSpec('orders', [('invoiceNumber', ASCENDING)], "order lookup by invoice"),
+    IndexSpec('orders', [('user_id', ASCENDING), ('date_ts', ASCENDING)], "order exports by date range"),
+    IndexSpec('orders', [('user_id', ASCENDING), ('status', ASCENDING), ('date_ts', ASCENDING)], "order exports filtered by status and date range"),
+    IndexSpec('orders', [('user_id', ASCENDING), ('customerPhone', ASCENDING)], "orders by customer phone"),
+    IndexSpec('orders', [('id', ASCENDING)], "order lookup by id"),
+    IndexSpec('orders', [('status', ASCENDING), ('reservation_expires_at', ASCENDING)], "expired reservation sweep"),
+    IndexSpec('orders', [('sweep_id', ASCENDING)], "orders claimed by a reservation sweep", sparse=True),
+    IndexSpec('order_events', [('user_id', ASCENDING), ('seq', ASCENDING)], "order stream resume", unique=True),
+    IndexSpec('order_events', [('at', ASCENDING)], "expire order events", expireAfterSeconds=Config.ORDER_EVENTS_RETENTION),
+    IndexSpec('sesaions', [('user_id', ASCENDING), ('status', ASCENDING)], "active session per user"),
+    IndexSpec('pending_transactions', [('user_id', ASCENDING)], "pending transactions per user"),
+    IndexSpec('sales_rollups', [('user_id', ASCENDING), ('kind', ASCENDING), ('bucket', ASCENDING)], "sales report bucket ranges"),
+    IndexSpec('password_resets', [('expires_at', ASCENDING)], "expire unused password reset tokens", expireAfterSeconds=0),
+    IndexSpec('password_resets', [('user_id', ASCENDING)], "replace a user's earlier reset tokens"),
+    IndexSpec('rate_limits', [('expires_at', ASCENDING)], "expire idle login rate limit buckets", expireAfterSeconds=0),
+    IndexSpec('idempotency_keys', [('expires_at', ASCENDING)], "expire idempotency records", expireAfterSeconds=0),
+    IndexSpec('fs.files', [('metadata.content_hash', ASCENDING)], "image blob dedupe"),
+]
+
+# The query shape behind each hot route, with placeholder values, for the
+# explain report: (route, collection, filter, sort)
+QUERY_SHAPES = [
+    ("POST /auth/login", 'users', {"username": "x"}, None),
+    ("GET /auth/user/<id>", 'users', {"user_id": "x"}, None),
+    ("GET /profile", 'profiles', {"user_id": "x"}, None),
+    ("GET /settings", 'settings', {"user_id": "x"}, None),
+    ("GET /products", 'products', {"user_id": "x"}, None),
+    ("PUT /products/<id>", 'products', {"id": 1, "user_id": "x"}, None),
+    ("GET /products/changes", 'products', {"user_id": "x", "change_seq": {"$gt": 0}}, [('change_seq', ASCENDING)]),
+    ("GET /products/search?code=", 'products', {"user_id": "x", "$or": [{"barcode": {"$in": ["x"]}}, {"sku": {"$in": ["x"]}}]}, None),
+    ("GET /products/low-stock", 'products', {"user_id": "x", "available": {"$lte": 5}, "reorder_threshold": {"$exists": False}}, [('available', ASCENDING)]),
+    ("GET /products/low-stock (own threshold)", 'products', {"user_id": "x", "reorder_gap": {"$lte": 0}}, [('available', ASCENDING)]),
+    ("GET /transactions", 'transactions', {"user_id": "x", "date_ts": {"$gte": 0, "$lt": 1}}, None),
+    ("GET /transactions?type=", 'transactions', {"user_id": "x", "date_ts": {"$gte": 0, "$lt": 1}, "txn_type": "sale"}, None),
+    ("DELETE /transactions/<invoice>", 'transactions', {"invoiceNumber": "x", "user_id": "x"}, None),
+    ("PUT /transactions/<invoice>", 'transactions', {"invoiceNumber": "x"}, None),
+    ("GET /orders", 'orders', {"user_id": "x"}, None),
+    ("GET /orders/export", 'orders', {"user_id": "x", "status": "Pending", "date_ts": {"$gte": 0}}, None),
+    ("PATCH /orders/<invoice>/status", 'orders', {"invoiceNumber": "x"}, None),
+    ("GET /orders/byPhone", 'orders', {"customerPhone": "x", "user_id": "x"}, [('_id', DESCENDING)]),
+    ("DELETE /orders/<id>", 'orders', {"id": "x"}, None),
+    ("reservation sweeper", 'orders', {"status": "In Progress", "reservation_expires_at": {"$lte": 0}}, [('reservation_expires_at', ASCENDING)]),
+    ("GET /session/current", 'sesaions', {"user_id": "x", "status": "active"}, None),
+    ("GET /pendingTransactions", 'pending_transactions', {"user_id": "x"}, None),
+]
+
+
+# Compare the declared indexes with the database. Returns
+# {"missing": [...], "changed": [...], "extra": [...]}; extra indexes are only
+# reported, never dropped.
+def verify_indexes(database=db, specs=INDEXES):
+    report = {"missing": [], "changed": [], "extra": []}
+    by_collection = {}
+    for spec in specs:
+        by_collection.setdefault(spec.collection, []).append(spec)
+    for collection, collection_specs in by_collection.items():
+        existing = database[collection].index_information()
+        for spec in collection_specs:
+            info = existing.get(spec.name)
+            if info is None:
+                report["missing"].append(spec.describe())
+                continue
+            differences = spec.differences(info)
+            if differences:
+                report["changed"].append(dict(spec.describe(), found=differences))
+        declared = {spec.name for spec in collection_specs}
+        for name, info in existing.items():
+            if name != '_id_' and name not in declared:
+                report["extra"].append({"collection": collection, "name": name, "keys": info.get('key')})
+    return report
+
+# Build the declared indexes that are missing. Each is created on its own so
+# one failure (e.g. duplicates blocking a unique index) does not stop the
+# rest. Returns {"created": [...], "failed": [...]}.
+def apply_indexes(database=db, specs=INDEXES):
+    report = {"created": [], "failed": []}
+    missing = {(spec["collection"], spec["name"]) for spec in verify_indexes(database, specs)["missing"]}
+    for spec in specs:
+        if (spec.collection, spec.name) not in missing:
+            continue
+        try:
+            database[spec.collection].create_index(spec.keys, name=spec.name, **spec.options)
+            report["created"].append(spec.describe())
+        except PyMongoError as e:
+            report["failed"].append(dict(spec.describe(), error=str(e)))
+    return report
+
+def _stages(plan):
+    # Every stage name in an explain plan tree
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+# Explain each route's query shape and flag the ones answered by a collection scan
+def explain_query_shapes(database=db, shapes=QUERY_SHAPES):
+    results = []
+    for route, collection, query, sort in shapes:
+        cursor = database[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            winning_plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+        except PyMongoError as e:
+            results.append({"route": route, "collection": collection, "error": str(e)})
+            continue
+        stages = list(_stages(winning_plan))
+        results.append({"route": route, "collection": collection, "stages": stages, "collscan": 'COLLSCAN' in stages})
+    return results
+
+def _print_drift(report):
+    for spec in report["missing"]:
+        print(f"Missing index {spec['collection']}.{spec['name']} ({spec['reason']})")  # Debug statement
+    for spec in report["changed"]:
+        print(f"Index {spec['collection']}.{spec['name']} differs from its declaration: {spec['found']}")  # Debug statement
+    for spec in report["extra"]:
+        print(f"Undeclared index {spec['collection']}.{spec['name']}")  # Debug statement
+
+# Check indexes off the request path when a worker starts. With apply set the
+# missing ones are built too; otherwise drift is only reported.
+def start_index_check(apply=False):
+    def run():
+        try:
+            if apply:
+                result = apply_indexes()
+                for spec in result["failed"]:
+                    print(f"Could not create index {spec['collection']}.{spec['name']}: {spec['error']}")  # Debug statement
+            _print_drift(verify_indexes())
+        except Exception as e:
+            print(f"Index check failed: {str(e)}")  # Debug statement
+    thread = threading.Thread(target=run, name='index-check', daemon=True)
+    thread.start()
+    return thread
+
+
+indexes_cli = AppGroup('indexes', help="Manage the MongoDB indexes declared in database/indexes.py.")
+
+@indexes_cli.command('apply')
+def apply_command():
+    """Build declared indexes that are missing."""
+    result = apply_indexes()
+    for spec in result["created"]:
+        click.echo(f"created  {spec['collection']}.{spec['name']}")
+    for spec in result["failed"]:
+        click.echo(f"FAILED   {spec['collection']}.{spec['name']}: {spec['error']}")
+    if not result["created"] and not result["failed"]:
+        click.echo("All declared indexes exist.")
+    if result["failed"]:
+        raise SystemExit(1)
+
+@indexes_cli.command('verify')
+def verify_command():
+    """Report missing, changed and undeclared indexes."""
+    report = verify_indexes()
+    for spec in report["missing"]:
+        click.echo(f"missing  {spec['collection']}.{spec['name']}  ({spec['reason']})")
+    for spec in report["changed"]:
+        click.echo(f"changed  {spec['collection']}.{spec['name']}  found {spec['found']}")
+    for spec in report["extra"]:
+        click.echo(f"extra    {spec['collection']}.{spec['name']}")
+    if report["missing"] or report["changed"]:
+        raise SystemExit(1)
+    click.echo("Indexes match their declarations.")
+
+@indexes_cli.command('explain')
+def explain_command():
+    """Explain each route's query shape and flag collection scans."""
+    results = explain_query_shapes()
+    for result in results:
+        if 'error' in result:
+            click.echo(f"ERROR     {result['route']}: {result['error']}")
+        else:
+            flag = 'COLLSCAN' if result['collscan'] else 'ok'
+            click.echo(f"{flag:<9} {result['route']}  [{result['collection']}: {' > '.join(result['stages'])}]")
+    if any(result.get('collscan') for result in results):
+        raise SystemExit(1)
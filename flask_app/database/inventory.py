@@ -0,0 +1,349 @@
+import uuid
+from pymongo import UpdateOne, ReturnDocument
+from database.db import products_db, primary
+from database.versions import next_change_seq
+
+# Stock writes and the reads that check them must hit the primary; the shared
+# client prefers secondaries for ordinary reads.
+_products = primary(products_db)
+
+# How many recent operation ids each product remembers. A cart write tags every
+# product it touches so a partially applied cart can be found and undone.
+INVENTORY_OP_HISTORY = 20
+
+# Checks a stock change can require before it is applied
+CHECK_STOCK = 'stock'          # quantity may not go below zero
+CHECK_AVAILABLE = 'available'  # quantity - reserved_quantity may not go below zero
+
+_CHECK_STRENGTH = {None: 0, CHECK_STOCK: 1, CHECK_AVAILABLE: 2}
+
+# Aggregation expression reading a stock field as a number. Products saved from
+# forms can hold strings such as "10"; those count as their value, anything
+# else that is not a number as 0.
+def _numeric(field):
+    return {"$cond": [
+        {"$isNumber": field},
+        field,
+        {"$convert": {"input": field, "to": "double", "onError": 0, "onNull": 0}}
+    ]}
+
+# Pipeline stages keeping the derived stock fields in step with quantity and
+# reserved_quantity. Every write that touches either must end with them:
+#   available     quantity - reserved_quantity, indexed for low-stock queries
+#   reorder_gap   available - reorder_threshold, only on products with a numeric threshold of their own
+AVAILABLE_STAGES = [
+    {"$set": {"available": {"$subtract": [_numeric("$quantity"), _numeric("$reserved_quantity")]}}},
+    {"$set": {"reorder_gap": {"$cond": [
+        {"$isNumber": "$reorder_threshold"},
+        {"$subtract": ["$available", "$reorder_threshold"]},
+        "$$REMOVE"
+    ]}}},
+]
+
+# Fields whose change means the derived stock fields must be recomputed
+STOCK_SOURCE_FIELDS = ('quantity', 'reserved_quantity', 'reorder_threshold')
+
+# Callbacks run as fn(user_id, product_ids) after stock is written, so caches
+# of product data can be invalidated.
+_stock_listeners = []
+
+
+# Register a callback for stock writes
+def on_stock_change(listener):
+    _stock_listeners.append(listener)
+    return listener
+
+def _notify(user_id, product_ids):
+    for listener in _stock_listeners:
+        try:
+            listener(user_id, product_ids)
+        except Exception as e:
+            print(f"Error in stock change listener: {str(e)}")  # Debug statement
+
+
+# Describe a change to one product's quantity and reserved_quantity
+def stock_change(product_id, quantity=0, reserved=0, check=None):
+    if check not in _CHECK_STRENGTH:
+        raise ValueError(f"Unknown stock check: {check}")
+    return {"id": int(product_id), "quantity": quantity, "reserved": reserved, "check": check}
+
+# The change that undoes a previously applied one
+def inverse_change(change):
+    return stock_change(change["id"], -change["quantity"], -change["reserved"])
+
+# Combine changes to the same product so a cart listing it twice is one write
+def merge_changes(changes):
+    merged = {}
+    for change in changes:
+        current = merged.get(change["id"])
+        if current is None:
+            merged[change["id"]] = dict(change)
+            continue
+        current["quantity"] += change["quantity"]
+        current["reserved"] += change["reserved"]
+        if _CHECK_STRENGTH[change["check"]] > _CHECK_STRENGTH[current["check"]]:
+            current["check"] = change["check"]
+    return list(merged.values())
+
+def _filter(user_id, change):
+    query = {"id": change["id"]}
+    if user_id:
+        query["user_id"] = user_id
+    if change["check"] == CHECK_STOCK and change["quantity"] < 0:
+        query["$expr"] = {"$gte": [_numeric("$quantity"), -change["quantity"]]}
+    elif change["check"] == CHECK_AVAILABLE:
+        # (quantity + dq) - (reserved + dr) >= 0  <=>  quantity - reserved >= dr - dq
+        needed = change["reserved"] - change["quantity"]
+        if needed > 0:
+            query["$expr"] = {"$gte": [{"$subtract": [_numeric("$quantity"), _numeric("$reserved_quantity")]}, needed]}
+    return query
+
+def _update(change, op_id=None, change_seq=None):
+    # Pipeline update: the increments are applied atomically on the server and
+    # reserved_quantity is clamped at zero so releases can never drive it negative.
+    fields = {}
+    if change["quantity"]:
+        fields["quantity"] = {"$add": [_numeric("$quantity"), change["quantity"]]}
+    if change["reserved"]:
+        fields["reserved_quantity"] = {"$max": [0, {"$add": [_numeric("$reserved_quantity"), change["reserved"]]}]}
+    if change_seq is not None:
+        fields["change_seq"] = change_seq
+    if op_id:
+        fields["inventory_ops"] = {"$slice": [
+            {"$concatArrays": [{"$ifNull": ["$inventory_ops", []]}, [op_id]]},
+            -INVENTORY_OP_HISTORY
+        ]}
+    return [{"$set": fields}] + AVAILABLE_STAGES
+
+# Derived stock fields for a product document about to be inserted
+def stock_fields(product):
+    quantity = product.get("quantity") or 0
+    reserved = product.get("reserved_quantity") or 0
+    if not isinstance(quantity, (int, float)) or not isinstance(reserved, (int, float)):
+        return {}
+    fields = {"available": quantity - reserved}
+    if isinstance(product.get("reorder_threshold"), (int, float)):
+        fields["reorder_gap"] = fields["available"] - product["reorder_threshold"]
+    return fields
+
+# Set product fields with an ordinary $set, which takes any field names a
+# client may send (dotted paths included), then recompute the derived stock
+# fields when one of their sources changed. The recompute reads the stored
+# values, so a concurrent stock change cannot leave them stale.
+def set_product_fields(query, fields):
+    result = _products.update_one(query, {"$set": fields})
+    if result.matched_count and any(key.split('.')[0] in STOCK_SOURCE_FIELDS for key in fields):
+        _products.update_one(query, AVAILABLE_STAGES)
+    return result
+
+# Apply one stock change in a single round trip. Returns the updated product,
+# or None when the product does not exist for this user or the check failed.
+def apply_change(user_id, change, projection=None):
+    product = _products.find_one_and_update(
+        _filter(user_id, change),
+        _update(change, change_seq=next_change_seq(user_id)),
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if product:
+        _notify(user_id, [change["id"]])
+    return product
+
+# Apply a whole cart's stock changes with one bulk_write. Either every change is
+# applied or none is: when some checks fail, the changes that did land are
+# undone. Returns (ok, failed_product_ids).
+def apply_cart(user_id, changes):
+    changes = merge_changes(changes)
+    if not changes:
+        return True, []
+    if len(changes) == 1:
+        product = apply_change(user_id, changes[0], projection={"id": 1})
+        return (True, []) if product else (False, [changes[0]["id"]])
+
+    op_id = uuid.uuid4().hex
+    change_seq = next_change_seq(user_id)
+    result = _products.bulk_write(
+        [UpdateOne(_filter(user_id, change), _update(change, op_id, change_seq)) for change in changes],
+        ordered=False
+    )
+    if result.matched_count == len(changes):
+        _notify(user_id, [change["id"] for change in changes])
+        return True, []
+
+    query = {"id": {"$in": [change["id"] for change in changes]}, "inventory_ops": op_id}
+    if user_id:
+        query["user_id"] = user_id
+    applied = {product["id"] for product in _products.find(query, {"id": 1})}
+    undo = [inverse_change(change) for change in changes if change["id"] in applied]
+    if undo:
+        undo_seq = next_change_seq(user_id)
+        _products.bulk_write([UpdateOne(_filter(user_id, change), _update(change, change_seq=undo_seq)) for change in undo], ordered=False)
+        _notify(user_id, [change["id"] for change in undo])
+    return False, [change["id"] for change in changes if change["id"] not in applied]
+
+# Apply stock changes that have no check (restocks, releases, undos) with one
+# unordered bulk_write. Each line stands alone: a line whose product no longer
+# exists is skipped and the others still land. Returns (applied_ids, missing_ids).
+def apply_unchecked(user_id, changes):
+    changes = [dict(change, check=None) for change in merge_changes(changes)]
+    if not changes:
+        return [], []
+    op_id = uuid.uuid4().hex
+    change_seq = next_change_seq(user_id)
+    result = _products.bulk_write(
+        [UpdateOne(_filter(user_id, change), _update(change, op_id, change_seq)) for change in changes],
+        ordered=False
+    )
+    ids = [change["id"] for change in changes]
+    if result.matched_count == len(changes):
+        applied = set(ids)
+    else:
+        query = {"id": {"$in": ids}, "inventory_ops": op_id}
+        if user_id:
+            query["user_id"] = user_id
+        applied = {product["id"] for product in _products.find(query, {"id": 1})}
+    if applied:
+        _notify(user_id, [product_id for product_id in ids if product_id in applied])
+    return [product_id for product_id in ids if product_id in applied], [product_id for product_id in ids if product_id not in applied]
+
+# Overwrite reserved_quantity for some of a tenant's products with recomputed
+# values ({product_id: reserved}). Used by reservation reconciliation.
+def set_reserved(user_id, reserved_by_id):
+    if not reserved_by_id:
+        return 0
+    change_seq = next_change_seq(user_id)
+    result = _products.bulk_write([
+        UpdateOne(
+            {"id": product_id, "user_id": user_id},
+            [{"$set": {"reserved_quantity": reserved, "change_seq": change_seq}}] + AVAILABLE_STAGES
+        )
+        for product_id, reserved in reserved_by_id.items()
+    ], ordered=False)
+    _notify(user_id, list(reserved_by_id))
+    return result.modified_count
+
+# Fields cart validation needs from each product
+CART_PRODUCT_FIELDS = {"_id": 0, "id": 1, "name": 1, "quantity": 1, "reserved_quantity": 1}
+
+# Load every product a cart refers to with one $in query, keyed by product id
+def load_products(user_id, product_ids, projection=CART_PRODUCT_FIELDS):
+    query = {"id": {"$in": list({int(product_id) for product_id in product_ids})}}
+    if user_id:
+        query["user_id"] = user_id
+    return {product["id"]: product for product in _products.find(query, projection)}
+
+def _as_number(value):
+    # Python side of _numeric
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+def _requirement(product, change):
+    # (available, requested) for the check a merged change asks for
+    quantity = _as_number(product.get("quantity"))
+    reserved = _as_number(product.get("reserved_quantity"))
+    if change["check"] == CHECK_STOCK:
+        return quantity, -change["quantity"]
+    if change["check"] == CHECK_AVAILABLE:
+        return quantity - reserved, change["reserved"] - change["quantity"]
+    return None, 0
+
+# Check a cart's changes in memory against one batched read. Every failing
+# line is reported, each as {"line", "product_id", "message"}.
+def validate_changes(user_id, changes):
+    checked = [change for change in changes if change["check"]]
+    if not checked:
+        return []
+    products = load_products(user_id, [change["id"] for change in checked])
+    merged = {change["id"]: change for change in merge_changes(checked)}
+    errors = []
+    for line, change in enumerate(changes):
+        if not change["check"]:
+            continue
+        product = products.get(change["id"])
+        if product is None:
+            errors.append({"line": line, "product_id": change["id"], "message": "Product not found"})
+            continue
+        available, requested = _requirement(product, merged[change["id"]])
+        if requested > available:
+            name = product.get("name", change["id"])
+            errors.append({
+                "line": line,
+                "product_id": change["id"],
+                "message": f"Not enough stock for {name}. Available: {available}, Requested: {requested}"
+            })
+    return errors
+
+# Check several carts in order against one batched read, as if each cart were
+# applied before the next is checked. Returns one error list per cart (same
+# shape as validate_changes); a cart with errors takes no stock from later ones.
+# Every product must exist, checked or not, since apply_cart needs them all.
+def allocate_carts(user_id, carts):
+    products = load_products(user_id, [change["id"] for changes in carts for change in changes])
+    results = []
+    for changes in carts:
+        merged = {change["id"]: change for change in merge_changes(changes)}
+        errors = []
+        for line, change in enumerate(changes):
+            product = products.get(change["id"])
+            if product is None:
+                errors.append({"line": line, "product_id": change["id"], "message": "Product not found"})
+                continue
+            if not merged[change["id"]]["check"]:
+                continue
+            available, requested = _requirement(product, merged[change["id"]])
+            if requested > available:
+                name = product.get("name", change["id"])
+                errors.append({
+                    "line": line,
+                    "product_id": change["id"],
+                    "message": f"Not enough stock for {name}. Available: {available}, Requested: {requested}"
+                })
+        if not errors:
+            for change in merged.values():
+                product = products[change["id"]]
+                product["quantity"] = _as_number(product.get("quantity")) + change["quantity"]
+                product["reserved_quantity"] = max(0, _as_number(product.get("reserved_quantity")) + change["reserved"])
+        results.append(errors)
+    return results
+
+# Validate a cart in memory, then apply it with one bulk write.
+# Returns (ok, errors) where errors lists every failing line; lines that lost
+# a race with another till are marked "conflict" and are worth retrying.
+def apply_cart_checked(user_id, changes):
+    errors = validate_changes(user_id, changes)
+    if errors:
+        return False, errors
+    ok, failed_ids = apply_cart(user_id, changes)
+    if not ok:
+        # Another till changed the stock between the read and the write
+        failed = set(failed_ids)
+        errors = [
+            {"line": line, "product_id": change["id"], "message": f"Stock for product {change['id']} changed, please retry", "conflict": True}
+            for line, change in enumerate(changes) if change["id"] in failed
+        ]
+    return ok, errors
+
+# Utility function to turn cart errors into a response body
+def cart_errors_response(errors):
+    return {"message": "; ".join(error["message"] for error in errors), "errors": errors}
+
+# Utility function to pick the status for cart errors: 409 when the cart only
+# lost a race and can be retried as is, 400 when it can never succeed
+def cart_errors_status(errors):
+    return 409 if any(error.get("conflict") for error in errors) else 400
+
+# Add (or with a negative delta, remove) stock; removals may not oversell
+def adjust_quantity(user_id, product_id, delta):
+    return apply_change(user_id, stock_change(product_id, quantity=delta, check=CHECK_STOCK))
+
+# Hold stock for an order; fails unless that much is still available
+def reserve_quantity(user_id, product_id, quantity):
+    return apply_change(user_id, stock_change(product_id, reserved=quantity, check=CHECK_AVAILABLE))
+
+# Give back held stock
+def release_quantity(user_id, product_id, quantity):
+    return apply_change(user_id, stock_change(product_id, reserved=-quantity))
@@ -0,0 +1,49 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from config import Config
+
+
+class StripedLock:
+    """A fixed set of locks shared out by key.
+
+    Work on the same key (an invoice, a product, a session) is serialized,
+    while work on different keys usually lands on different stripes and runs
+    in parallel. Several keys can be held at once; stripes are always taken
+    in index order so two callers can never deadlock each other.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def _indexes(self, keys):
+        return sorted({hash(key) % len(self._locks) for key in keys})
+
+    @contextmanager
+    def hold(self, *keys):
+        indexes = self._indexes(keys)
+        for index in indexes:
+            self._locks[index].acquire()
+        try:
+            yield
+        finally:
+            for index in reversed(indexes):
+                self._locks[index].release()
+
+
+resource_locks = StripedLock(Config.RESOURCE_LOCK_STRIPES)
+
+# Serialize work on one or more resources of the same kind, e.g.
+# ``with resource_lock('order', invoice_number):``
+def resource_lock(kind, *resource_ids):
+    return resource_locks.hold(*((kind, resource_id) for resource_id in resource_ids))
+
+# Decorator serializing a view on the resource named by one of its URL arguments
+def locked_by(kind, arg_name):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with resource_lock(kind, kwargs[arg_name]):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
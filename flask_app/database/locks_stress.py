@@ -0,0 +1,68 @@
+"""Stress check for the striped resource locks.
+
+Runs a view-like unit of work (a fixed sleep standing in for Mongo round trips)
+under ``locked_by`` from a growing number of threads, once with every request
+on a different invoice and once with all of them on the same invoice. Distinct
+invoices should scale with the thread count; a single invoice should stay
+serialized. Exits non-zero when either expectation fails.
+
+    cd flask_app && python -m database.locks_stress [--requests 400] [--work-ms 10] [--threads 1,4,16]
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database.locks import locked_by
+
+
+def _view(work_seconds):
+    @locked_by('order', 'invoice_number')
+    def view(invoice_number):
+        time.sleep(work_seconds)
+    return view
+
+# Requests per second for `requests` calls spread over `threads` threads
+def measure(threads, requests, work_seconds, same_key):
+    view = _view(work_seconds)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(view, invoice_number='INV-1' if same_key else f'INV-{n}') for n in range(requests)]:
+            future.result()
+    return requests / (time.perf_counter() - started)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that per-resource locking scales with worker threads.")
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--work-ms', type=float, default=10.0)
+    parser.add_argument('--threads', default='1,4,16')
+    args = parser.parse_args(argv)
+    thread_counts = [int(count) for count in args.threads.split(',')]
+    work_seconds = args.work_ms / 1000.0
+
+    results = {}
+    for same_key in (False, True):
+        for threads in thread_counts:
+            # Keep the single-invoice runs short; they are serialized by design
+            requests = args.requests if not same_key else max(thread_counts) * 4
+            rate = measure(threads, requests, work_seconds, same_key)
+            results[(same_key, threads)] = rate
+            print(f"{'same invoice' if same_key else 'distinct invoices':<18} {threads:>3} threads  {rate:8.1f} req/s")
+
+    low, high = min(thread_counts), max(thread_counts)
+    serial_rate = 1.0 / work_seconds
+    failures = []
+    # Distinct invoices: at least half of ideal linear scaling (stripe collisions cost some)
+    if results[(False, high)] < results[(False, low)] * (high / low) * 0.5:
+        failures.append("distinct invoices did not scale with threads")
+    # Same invoice: never meaningfully faster than one request at a time
+    if results[(True, high)] > serial_rate * 1.2:
+        failures.append("requests on the same invoice were not serialized")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import time
+import datetime
+import click
+from flask.cli import AppGroup
+from pymongo import UpdateOne
+from config import Config
+from database.db import db, migrations_db
+from database.dates import date_timestamp
+from reports.rollups import rebuild_all_rollups
+
+# Collections whose documents carry created_at and date_ts
+TIMESTAMPED_COLLECTIONS = ('transactions', 'orders')
+
+
+# Checkpoints record the last _id a migration finished, so an interrupted run
+# picks up where it stopped instead of rescanning the collection.
+def load_checkpoint(name):
+    checkpoint = migrations_db.find_one({"_id": name})
+    return checkpoint.get('last_id') if checkpoint else None
+
+def save_checkpoint(name, last_id, processed, done=False):
+    migrations_db.update_one(
+        {"_id": name},
+        {"$set": {"last_id": last_id, "updated_at": datetime.datetime.utcnow(), "done": done}, "$inc": {"processed": processed}},
+        upsert=True
+    )
+
+def _timestamp_update(doc):
+    # created_at is unknown for old documents; the ObjectId's creation time is
+    # when the insert happened, which is what created_at means.
+    created_at = doc['_id'].generation_time.replace(tzinfo=None)
+    return UpdateOne(
+        {"_id": doc['_id'], "date_ts": {"$exists": False}},
+        {"$set": {"created_at": doc.get('created_at') or created_at, "date_ts": date_timestamp(doc.get('date'), created_at)}}
+    )
+
+# Give existing documents created_at and date_ts, one _id-ordered batch at a
+# time. Each batch is a short unordered bulk write and the run can pause
+# between batches, so the collection stays available to the application.
+# Documents written since the migration started already have the fields and
+# are left alone. Returns the number of documents updated.
+def backfill_timestamps(collection_name, batch_size=None, pause=0, restart=False, limit=None):
+    batch_size = batch_size or Config.MIGRATION_BATCH_SIZE
+    name = f"backfill_timestamps:{collection_name}"
+    collection = db.get_collection(collection_name)
+    last_id = None if restart else load_checkpoint(name)
+    updated = 0
+    scanned = 0
+    while limit is None or scanned < limit:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(collection.find(query, {"_id": 1, "date": 1, "created_at": 1, "date_ts": 1}).sort('_id', 1).limit(batch_size if limit is None else min(batch_size, limit - scanned)))
+        if not batch:
+            save_checkpoint(name, last_id, 0, done=True)
+            break
+        updates = [_timestamp_update(doc) for doc in batch if 'date_ts' not in doc]
+        if updates:
+            updated += collection.bulk_write(updates, ordered=False).modified_count
+        last_id = batch[-1]['_id']
+        scanned += len(batch)
+        save_checkpoint(name, last_id, len(batch))
+        if pause:
+            time.sleep(pause)
+    return updated
+
+
+migrations_cli = AppGroup('migrate', help="Resumable data migrations.")
+
+@migrations_cli.command('backfill-timestamps')
+@click.option('--collection', 'collections', multiple=True, type=click.Choice(TIMESTAMPED_COLLECTIONS), help="Only this collection (repeatable).")
+@click.option('--batch-size', type=int, default=None, help="Documents per batch.")
+@click.option('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+@click.option('--restart', is_flag=True, help="Ignore the saved checkpoint and start from the beginning.")
+@click.option('--limit', type=int, default=None, help="Stop after scanning this many documents.")
+@click.option('--rebuild-rollups/--no-rebuild-rollups', default=True, help="Rebuild sales rollups once transactions are done.")
+def backfill_timestamps_command(collections, batch_size, pause, restart, limit, rebuild_rollups):
+    """Add created_at and date_ts to transactions and orders written before they existed."""
+    for collection_name in collections or TIMESTAMPED_COLLECTIONS:
+        updated = backfill_timestamps(collection_name, batch_size, pause, restart, limit)
+        click.echo(f"{collection_name}: updated {updated} documents")
+    # Rollups bucket transactions by date_ts once it exists. Buckets written
+    # before the backfill used the raw date (or the time of the write when it
+    # did not parse), so later edits and deletes would decrement a different
+    # bucket. Rebuild them from the backfilled transactions.
+    checkpoint = migrations_db.find_one({"_id": "backfill_timestamps:transactions"}) or {}
+    if rebuild_rollups and checkpoint.get('done') and 'transactions' in (collections or TIMESTAMPED_COLLECTIONS):
+        click.echo(f"Rebuilt sales rollups from {rebuild_all_rollups()} transactions.")
+    elif rebuild_rollups:
+        click.echo("Transactions not fully backfilled yet; run `flask reports rebuild` once they are.")
@@ -0,0 +1,109 @@
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from flask import request, jsonify, current_app, Response, stream_with_context
+from pymongo import ASCENDING, DESCENDING
+from config import Config
+
+
+# Query parameters that change what a list endpoint returns
+LISTING_PARAMS = ('limit', 'after', 'fields', 'stream')
+
+
+class ListingError(ValueError):
+    pass
+
+
+# Utility function telling whether a request asks for anything but the full list
+def has_listing_params(args):
+    return any(args.get(name) for name in LISTING_PARAMS)
+
+
+# Utility function to read the listing parameters shared by every list endpoint:
+#   limit=<n>        return at most n documents, plus X-Next-Cursor when more remain
+#   after=<cursor>   continue after the document whose _id is the cursor
+#   fields=a,b,c     only return these fields (and _id)
+#   stream=1         write documents to the response as the cursor yields them
+def listing_params(args):
+    params = {"limit": None, "after": None, "fields": None, "stream": args.get('stream') in ('1', 'true')}
+    if args.get('limit'):
+        try:
+            params["limit"] = int(args['limit'])
+        except ValueError:
+            raise ListingError("limit must be an integer")
+        if params["limit"] < 1:
+            raise ListingError("limit must be positive")
+        params["limit"] = min(params["limit"], Config.LIST_MAX_LIMIT)
+    if args.get('after'):
+        try:
+            params["after"] = ObjectId(args['after'])
+        except (InvalidId, TypeError):
+            raise ListingError("after is not a valid cursor")
+    if args.get('fields'):
+        params["fields"] = [field.strip() for field in args['fields'].split(',') if field.strip()]
+    return params
+
+def _projection(params, exclude):
+    if params["fields"]:
+        return {field: 1 for field in params["fields"]}
+    if exclude:
+        return {field: 0 for field in exclude}
+    return None
+
+def _serialize(doc):
+    if '_id' in doc:
+        doc['_id'] = str(doc['_id'])
+    return doc
+
+def _stream(cursor):
+    # Emit a JSON array one document at a time; the encoder is the app's own so
+    # the output matches what jsonify would have produced.
+    dumps = current_app.json.dumps
+    yield '['
+    first = True
+    for doc in cursor:
+        yield ('' if first else ',') + dumps(_serialize(doc))
+        first = False
+    yield ']'
+
+# List documents matching a query as a JSON array, honouring the listing
+# parameters of the current request. Without any of them the behaviour is the
+# same as the old list-and-jsonify code. Returns (response, count); count is
+# None for streamed responses because it is only known once the body is sent.
+def list_documents(collection, query, descending=False, exclude=None, args=None):
+    try:
+        params = listing_params(request.args if args is None else args)
+    except ListingError as e:
+        return (jsonify({"message": str(e)}), 400), 0
+
+    projection = _projection(params, exclude)
+    paginated = params["limit"] is not None or params["after"] is not None
+
+    if paginated:
+        query = dict(query)
+        if params["after"] is not None:
+            query["_id"] = {"$lt" if descending else "$gt": params["after"]}
+        cursor = collection.find(query, projection).sort('_id', DESCENDING if descending else ASCENDING)
+    else:
+        cursor = collection.find(query, projection)
+        if descending:
+            cursor = cursor.sort('_id', DESCENDING)
+
+    if params["stream"]:
+        if params["limit"] is not None:
+            cursor = cursor.limit(params["limit"])
+        cursor = cursor.batch_size(Config.LIST_STREAM_BATCH_SIZE)
+        return (Response(stream_with_context(_stream(cursor)), mimetype='application/json'), 200), None
+
+    if params["limit"] is not None:
+        # Fetch one extra document to know whether another page follows
+        docs = [_serialize(doc) for doc in cursor.limit(params["limit"] + 1)]
+        more = len(docs) > params["limit"]
+        docs = docs[:params["limit"]]
+    else:
+        docs = [_serialize(doc) for doc in cursor]
+        more = False
+
+    response = jsonify(docs)
+    if more:
+        response.headers['X-Next-Cursor'] = docs[-1]['_id']
+    return (response, 200), len(docs)
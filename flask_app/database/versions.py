@@ -0,0 +1,107 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from flask import request, Response
+from pymongo import ReturnDocument
+from config import Config
+from database.db import versions_db, primary
+
+# Version counters are read right before answering a conditional GET and are
+# bumped right after a write; both must see the primary.
+_versions = primary(versions_db)
+
+# Resources whose version is tracked per tenant
+PRODUCTS = 'products'
+SETTINGS = 'settings'
+PROFILE = 'profile'
+# Sequence numbers stamped on product documents for delta sync
+PRODUCT_CHANGES = 'product_changes'
+# Product names as seen by the search index
+PRODUCT_NAMES = 'product_names'
+# Sequence numbers of order events, the resume tokens of /orders/stream
+ORDER_EVENTS = 'order_events'
+
+
+class VersionCache:
+    """Versions this worker read or bumped recently, with when it learned them.
+
+    Lets a hot conditional GET answer from memory. A bump made in this worker
+    is seen at once; one made in another worker once the entry is older than
+    the caller's ``max_age``. Versions only move forward.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, max_age):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > max_age:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            self._entries[key] = (max(version, entry[0]) if entry else version, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+version_cache = VersionCache(Config.VERSION_CACHE_MAX_ENTRIES)
+
+
+def _version_id(user_id, resource):
+    return f"{user_id}:{resource}"
+
+# Utility function to read a tenant's current version of a resource. With
+# max_age (seconds) a version this worker learned that recently is used
+# without a round trip.
+def current_version(user_id, resource, max_age=0):
+    key = _version_id(user_id, resource)
+    if max_age > 0:
+        version = version_cache.get(key, max_age)
+        if version is not None:
+            return version
+    doc = _versions.find_one({"_id": key}, {"version": 1})
+    version = doc["version"] if doc else 0
+    version_cache.put(key, version)
+    return version
+
+# Utility function to record that a tenant's resource changed. Call it after the
+# write has been made, never before, so a version is never paired with older data.
+def bump_version(user_id, resource):
+    doc = _versions.find_one_and_update(
+        {"_id": _version_id(user_id, resource)},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    version_cache.put(_version_id(user_id, resource), doc["version"])
+    return doc["version"]
+
+# Utility function to allocate the change sequence number for a product write.
+# Taken before the write so the number can be stored in the same update.
+def next_change_seq(user_id):
+    return bump_version(user_id, PRODUCT_CHANGES)
+
+# Strong ETag for one version of a resource as returned for the current query string
+def make_etag(user_id, resource, version):
+    key = f"{user_id}:{resource}:{version}:{request.query_string.decode('latin-1')}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+# Utility function for conditional GETs. Returns (etag, version, response);
+# response is a ready 304 when the client already holds this version, else None.
+def conditional_get(user_id, resource, max_age=0):
+    version = current_version(user_id, resource, max_age)
+    etag = make_etag(user_id, resource, version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return etag, version, response
+    return etag, version, None
@@ -0,0 +1,187 @@
+import datetime
+import threading
+import time
+from collections import deque
+from pymongo import ASCENDING
+from config import Config
+from database.versions import bump_version, current_version, ORDER_EVENTS
+
+# Order event types pushed to /orders/stream
+ORDER_CREATED = 'order_created'
+ORDER_STATUS_CHANGED = 'order_status_changed'
+ORDER_NOTE_ADDED = 'order_note_added'
+ORDER_FINALIZED = 'order_finalized'
+ORDER_DELETED = 'order_deleted'
+
+
+class MemoryEventBackend:
+    """Keeps the last ``buffer_size`` events per tenant in this process.
+
+    Only subscribers connected to the same process see an event, so this
+    suits a single worker; use MongoEventBackend with several.
+    """
+
+    # Subscribers are woken directly by publish(); no polling needed
+    poll_interval = None
+
+    def __init__(self, buffer_size=500):
+        self.buffer_size = buffer_size
+        self._events = {}
+        self._seqs = {}
+        self._lock = threading.Lock()
+
+    def append(self, user_id, event_type, data):
+        with self._lock:
+            seq = self._seqs.get(user_id, 0) + 1
+            self._seqs[user_id] = seq
+            event = {"seq": seq, "type": event_type, "data": data, "at": datetime.datetime.utcnow()}
+            self._events.setdefault(user_id, deque(maxlen=self.buffer_size)).append(event)
+        return event
+
+    def current_seq(self, user_id):
+        with self._lock:
+            return self._seqs.get(user_id, 0)
+
+    def read(self, user_id, after, limit):
+        with self._lock:
+            return [event for event in self._events.get(user_id, ()) if event["seq"] > after][:limit]
+
+    # False when events after this sequence number are no longer held
+    def can_resume(self, user_id, after):
+        with self._lock:
+            events = self._events.get(user_id)
+            current = self._seqs.get(user_id, 0)
+            if after > current:
+                return False  # Sequence numbers restarted with the process
+            return not events or after >= events[0]["seq"] - 1
+
+    def start(self, wake):
+        pass
+
+
+class MongoEventBackend:
+    """Stores events in a collection shared by every worker.
+
+    Sequence numbers are allocated per tenant with the versions counter, and
+    history expires through a TTL index. A change stream on the collection
+    wakes local subscribers as soon as any worker publishes; where change
+    streams are unavailable (a standalone server) subscribers fall back to
+    re-reading every ``poll_interval`` seconds.
+    """
+
+    def __init__(self, collection, poll_interval=2.0):
+        self.collection = collection
+        self.poll_interval = poll_interval
+
+    def append(self, user_id, event_type, data):
+        event = {
+            "user_id": user_id,
+            "seq": bump_version(user_id, ORDER_EVENTS),
+            "type": event_type,
+            "data": data,
+            "at": datetime.datetime.utcnow(),
+        }
+        self.collection.insert_one(event)
+        return _public(event)
+
+    def current_seq(self, user_id):
+        return current_version(user_id, ORDER_EVENTS)
+
+    def read(self, user_id, after, limit):
+        cursor = self.collection.find({"user_id": user_id, "seq": {"$gt": after}}).sort('seq', ASCENDING).limit(limit)
+        return [_public(event) for event in cursor]
+
+    def can_resume(self, user_id, after):
+        oldest = self.collection.find_one({"user_id": user_id}, {"seq": 1}, sort=[('seq', ASCENDING)])
+        if oldest is None:
+            return after <= self.current_seq(user_id)
+        return after >= oldest["seq"] - 1
+
+    def start(self, wake):
+        def watch():
+            try:
+                with self.collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                    # Change streams deliver promptly; keep polling only as a safety net
+                    self.poll_interval = max(self.poll_interval, Config.ORDER_STREAM_HEARTBEAT)
+                    for change in stream:
+                        wake(change["fullDocument"]["user_id"])
+            except Exception as e:
+                self.poll_interval = Config.ORDER_EVENTS_POLL_INTERVAL
+                print(f"Order event change stream unavailable, polling instead: {str(e)}")  # Debug statement
+        threading.Thread(target=watch, name='order-events-watch', daemon=True).start()
+
+
+def _public(event):
+    return {"seq": event["seq"], "type": event["type"], "data": event["data"], "at": event["at"]}
+
+
+class OrderEventHub:
+    """In-process pub/sub for order events, one channel per tenant.
+
+    Routes publish; stream subscribers block in ``wait`` on a per-tenant
+    condition, so an idle screen holds no resources beyond its waiting
+    request. Storage and cross-process delivery are left to the backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._conditions = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _condition(self, user_id):
+        with self._lock:
+            if not self._started:
+                self.backend.start(self._wake)
+                self._started = True
+            condition = self._conditions.get(user_id)
+            if condition is None:
+                condition = self._conditions[user_id] = threading.Condition()
+            return condition
+
+    def _wake(self, user_id):
+        condition = self._condition(user_id)
+        with condition:
+            condition.notify_all()
+
+    # Publish an event; failures are logged, never raised into the request
+    def publish(self, user_id, event_type, data):
+        try:
+            event = self.backend.append(user_id, event_type, data)
+            self._wake(user_id)
+            return event
+        except Exception as e:
+            print(f"Error publishing order event {event_type}: {str(e)}")  # Debug statement
+            return None
+
+    def current_seq(self, user_id):
+        return self.backend.current_seq(user_id)
+
+    def can_resume(self, user_id, after):
+        return self.backend.can_resume(user_id, after)
+
+    # Events after a sequence number, waiting up to timeout seconds for one to arrive
+    def wait(self, user_id, after, timeout, limit=100):
+        deadline = time.monotonic() + timeout
+        condition = self._condition(user_id)
+        while True:
+            # Read under the condition so a publish between the read and the wait still wakes us
+            with condition:
+                events = self.backend.read(user_id, after, limit)
+                if events:
+                    return events
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                if self.backend.poll_interval:
+                    remaining = min(remaining, self.backend.poll_interval)
+                condition.wait(remaining)
+
+
+def _build_hub():
+    if Config.ORDER_EVENTS_BACKEND == 'mongo':
+        from database.db import order_events_db
+        return OrderEventHub(MongoEventBackend(order_events_db, Config.ORDER_EVENTS_POLL_INTERVAL))
+    return OrderEventHub(MemoryEventBackend(Config.ORDER_EVENTS_BUFFER))
+
+order_events = _build_hub()
@@ -0,0 +1,175 @@
+import datetime
+import threading
+import time
+import uuid
+import click
+from flask.cli import AppGroup
+from config import Config
+from database.db import orders_db, products_db, primary
+from database.audit import log_action
+from database.inventory import stock_change, apply_unchecked, set_reserved
+from orders.events import order_events, ORDER_STATUS_CHANGED
+
+# Orders in this status hold reserved stock
+RESERVED_STATUS = 'In Progress'
+
+_orders = primary(orders_db)
+
+
+# Fields to $set when an order starts holding stock
+def reservation_fields(now=None):
+    now = now or datetime.datetime.utcnow()
+    return {
+        "reserved_at": now,
+        "reservation_expires_at": now + datetime.timedelta(seconds=Config.RESERVATION_TTL),
+    }
+
+# Fields to $unset when an order stops holding stock
+RESERVATION_UNSET = {"reserved_at": "", "reservation_expires_at": ""}
+
+
+def _release_changes(orders):
+    return [
+        stock_change(item['id'], reserved=-item['quantity'])
+        for order in orders for item in order.get('cart') or []
+    ]
+
+# Release the stock held by In Progress orders whose reservation has expired,
+# moving them back to Pending. Orders are claimed with one update_many tagged
+# with a sweep id, so a sweeper in another worker, or a request finalizing the
+# same order, cannot release them twice; each tenant's stock is then released
+# with one unordered bulk write in which every line stands alone, so a product
+# deleted since it was reserved is skipped without holding back the others.
+# Returns a report of what was actually freed.
+def sweep_expired_reservations(now=None, batch_size=None):
+    now = now or datetime.datetime.utcnow()
+    batch_size = batch_size or Config.RESERVATION_SWEEP_BATCH_SIZE
+    sweep_id = uuid.uuid4().hex
+
+    # Orders reserved before reservations were timestamped get a full TTL from now
+    _orders.update_many(
+        {"status": RESERVED_STATUS, "reservation_expires_at": {"$exists": False}},
+        {"$set": reservation_fields(now)}
+    )
+
+    expired = {"status": RESERVED_STATUS, "reservation_expires_at": {"$lte": now}}
+    ids = [order['_id'] for order in _orders.find(expired, {"_id": 1}).sort('reservation_expires_at', 1).limit(batch_size)]
+    report = {"sweep_id": sweep_id, "orders": 0, "tenants": {}}
+    if not ids:
+        return report
+
+    _orders.update_many(
+        dict(expired, _id={"$in": ids}),
+        {"$set": {"status": "Pending", "sweep_id": sweep_id, "reservation_expired_at": now}, "$unset": RESERVATION_UNSET}
+    )
+    claimed = list(_orders.find({"sweep_id": sweep_id}, {"user_id": 1, "invoiceNumber": 1, "cart": 1}))
+
+    by_tenant = {}
+    for order in claimed:
+        by_tenant.setdefault(order.get('user_id'), []).append(order)
+    for user_id, orders in by_tenant.items():
+        changes = _release_changes(orders)
+        applied, missing = apply_unchecked(user_id, changes)
+        applied = set(applied)
+        released = {}  # product id (as a string, for BSON) -> quantity released
+        for change in changes:
+            if change["id"] in applied:
+                released[str(change["id"])] = released.get(str(change["id"]), 0) - change["reserved"]
+        report["tenants"][user_id] = {
+            "invoices": [order.get('invoiceNumber') for order in orders],
+            "released": released,
+            "missing_product_ids": missing,
+        }
+        log_action(user_id, "reservations_expired", report["tenants"][user_id])
+        for order in orders:
+            order_events.publish(user_id, ORDER_STATUS_CHANGED, {
+                "invoiceNumber": order.get('invoiceNumber'), "status": "Pending", "previous_status": RESERVED_STATUS, "reason": "reservation_expired"
+            })
+
+    _orders.update_many({"sweep_id": sweep_id}, {"$unset": {"sweep_id": ""}})
+    report["orders"] = len(claimed)
+    return report
+
+# Compare each product's reserved_quantity with the sum of its open (In
+# Progress) order lines. Returns the drifted products as
+# {"user_id", "id", "stored", "expected"}; with apply the stored values are
+# overwritten. Reservations changing while this runs can be misjudged, so
+# apply it when the tills are quiet.
+def reconcile_reservations(apply=False, user_id=None):
+    match = {"status": RESERVED_STATUS}
+    if user_id:
+        match["user_id"] = user_id
+    expected = {}
+    for row in _orders.aggregate([
+        {"$match": match},
+        {"$unwind": "$cart"},
+        {"$group": {"_id": {"user_id": "$user_id", "id": {"$toInt": "$cart.id"}}, "reserved": {"$sum": "$cart.quantity"}}},
+    ]):
+        expected[(row["_id"]["user_id"], row["_id"]["id"])] = row["reserved"]
+
+    stored = {}
+    product_query = {"reserved_quantity": {"$gt": 0}}
+    if user_id:
+        product_query["user_id"] = user_id
+    for product in primary(products_db).find(product_query, {"user_id": 1, "id": 1, "reserved_quantity": 1}):
+        stored[(product.get("user_id"), product.get("id"))] = product["reserved_quantity"]
+    missing = [key for key in expected if key not in stored]
+    for tenant, ids in _group_ids(missing).items():
+        for product in primary(products_db).find({"user_id": tenant, "id": {"$in": ids}}, {"user_id": 1, "id": 1, "reserved_quantity": 1}):
+            stored[(tenant, product["id"])] = product.get("reserved_quantity", 0)
+
+    drift = [
+        {"user_id": tenant, "id": product_id, "stored": reserved, "expected": expected.get((tenant, product_id), 0)}
+        for (tenant, product_id), reserved in sorted(stored.items(), key=str)
+        if reserved != expected.get((tenant, product_id), 0)
+    ]
+    if apply:
+        by_tenant = {}
+        for row in drift:
+            by_tenant.setdefault(row["user_id"], {})[row["id"]] = row["expected"]
+        for tenant, reserved_by_id in by_tenant.items():
+            set_reserved(tenant, reserved_by_id)
+            log_action(tenant, "reservations_reconciled", {"products": len(reserved_by_id)})
+    return drift
+
+def _group_ids(keys):
+    grouped = {}
+    for tenant, product_id in keys:
+        grouped.setdefault(tenant, []).append(product_id)
+    return grouped
+
+# Sweep expired reservations periodically in the background
+def start_reservation_sweeper(interval):
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                report = sweep_expired_reservations()
+                if report["orders"]:
+                    print(f"Released reservations of {report['orders']} expired orders")  # Debug statement
+            except Exception as e:
+                print(f"Error sweeping reservations: {str(e)}")  # Debug statement
+    thread = threading.Thread(target=run, name='reservation-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+
+orders_cli = AppGroup('orders', help="Order maintenance.")
+
+@orders_cli.command('sweep-reservations')
+def sweep_reservations_command():
+    """Release stock held by expired In Progress orders."""
+    report = sweep_expired_reservations()
+    for user_id, tenant in report["tenants"].items():
+        click.echo(f"{user_id}: {len(tenant['invoices'])} orders, released {tenant['released']}")
+    click.echo(f"{report['orders']} expired orders released.")
+
+@orders_cli.command('reconcile-reservations')
+@click.option('--apply', 'apply_fix', is_flag=True, help="Overwrite drifted reserved_quantity values.")
+@click.option('--user-id', default=None, help="Only this tenant.")
+def reconcile_reservations_command(apply_fix, user_id):
+    """Recompute reserved_quantity from open orders and report drift."""
+    drift = reconcile_reservations(apply=apply_fix, user_id=user_id)
+    for row in drift:
+        click.echo(f"{row['user_id']} product {row['id']}: stored {row['stored']}, expected {row['expected']}")
+    click.echo(f"{len(drift)} products {'fixed' if apply_fix else 'drifted'}.")
@@ -1,104 +1,47 @@
-from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
+from flask import Blueprint, request, jsonify, Response, current_app, stream_with_context
+from pymongo import MongoClient, ReturnDocument
 from bson.objectid import ObjectId
 import uuid
-from auth.utils import login_required
-import threading
+import time
+from auth.utils import login_required, verify_jwt
 from config import Config
 from datetime import datetime
-from database.db import profile_db, transactions_db, products_db, orders_db, settings_db, pending_transactions_db, logs_db
-
-# Lock to handle MongoDB operations safely in a multi-threaded environment
-db_lock = threading.Lock()
+from database.db import profile_db, transactions_db, products_db, orders_db, settings_db, pending_transactions_db, primary
+from database.audit import log_action
+from database.pagination import list_documents
+from database.export import export_documents, ExportError
+from database.dates import date_range, timestamp_fields, date_timestamp, DateParseError
+from database.locks import locked_by
+from database.idempotency import idempotent
+from orders.events import order_events, ORDER_CREATED, ORDER_STATUS_CHANGED, ORDER_NOTE_ADDED, ORDER_FINALIZED, ORDER_DELETED
+from orders.reservations import reservation_fields, RESERVATION_UNSET, RESERVED_STATUS
+from reports.rollups import record_transaction
+from profile.sessions import active_session_id, record_session_transactions
+from database.inventory import stock_change, inverse_change, apply_unchecked, apply_cart_checked, cart_errors_response, cart_errors_status, CHECK_STOCK, CHECK_AVAILABLE
 
 orders_bp = Blueprint('orders', __name__)
 
-# Utility function to log actions
-def log_action(user_id, action, details):
-    log_entry = {
-        "user_id": user_id,
-        "action": action,
-        "details": details,
-        "timestamp": datetime.utcnow()
-    }
-    with db_lock:
-        logs_db.insert_one(log_entry)
-    print(f"Logged action: {action}, details: {details}")  # Debug statement
-
 # Utility function to find order by invoice number
 def find_order_by_invoice(invoice_number):
     print(f"Finding order with invoice number: {invoice_number}")  # Debug statement
-    with db_lock:
-        order = orders_db.find_one({"invoiceNumber": invoice_number})
+    order = primary(orders_db).find_one({"invoiceNumber": invoice_number})
     print(f"Order found: {order}")  # Debug statement
     return order
 
 # Utility function to check if the user owns the order
 def check_ownership(user_id, order_id):
     print(f"Checking ownership for user_id: {user_id} and order_id: {order_id}")  # Debug statement
-    with db_lock:
-        order = orders_db.find_one({"id": order_id})
+    order = orders_db.find_one({"id": order_id})
     ownership = order and order.get('user_id') == user_id
     print(f"Ownership check result: {ownership}")  # Debug statement
     return ownership
 
-# Utility function to get a product by its ID
-def get_product_by_id(product_id):
-    print(f"Getting product with ID: {product_id}")  # Debug statement
-    with db_lock:
-        product = products_db.find_one({"id": int(product_id)})
-    print(f"Product found: {product}")  # Debug statement
-    return product
-
-# Utility function to update a product
-def update_product(product):
-    print(f"Updating product with ID: {product['id']}")  # Debug statement
-    with db_lock:
-        products_db.update_one({"id": int(product['id'])}, {"$set": product})
-    print("Product updated successfully")  # Debug statement
-
-# Utility function to validate and reserve product availability
-def validate_and_reserve_product_availability(product_id, requested_quantity):
-    print(f"Validating availability for product_id: {product_id}, requested_quantity: {requested_quantity}")  # Debug statement
-    product = get_product_by_id(product_id)
-    if not product:
-        print("Product not found")  # Debug statement
-        return False, "Product not found"
-
-    available_quantity = product['quantity'] - product.get('reserved_quantity', 0)
-    if requested_quantity > available_quantity:
-        print(f"Not enough stock for {product['name']}. Available: {available_quantity}, Requested: {requested_quantity}")  # Debug statement
-        return False, f"Not enough stock for {product['name']}. Available: {available_quantity}, Requested: {requested_quantity}"
-
-    print("Product availability validated successfully")  # Debug statement
-    return True, None
-
-def reserve_product_quantity(product_id, quantity):
-    print(f"Reserving quantity: {quantity} for product_id: {product_id}")  # Debug statement
-    product = get_product_by_id(product_id)
-    if product:
-        new_reserved_quantity = product.get('reserved_quantity', 0) + quantity
-        products_db.update_one({"id": int(product_id)}, {"$set": {"reserved_quantity": new_reserved_quantity}})
-    print("Product quantity reserved successfully")  # Debug statement
-    return product
-
-def release_product_quantity(product_id, quantity):
-    print(f"Releasing reserved quantity: {quantity} for product_id: {product_id}")  # Debug statement
-    product = get_product_by_id(product_id)
-    if product:
-        new_reserved_quantity = product.get('reserved_quantity', 0) - quantity
-        products_db.update_one({"id": int(product_id)}, {"$set": {"reserved_quantity": new_reserved_quantity}})
-    print("Product quantity released successfully")  # Debug statement
-    return product
-
-def adjust_product_quantity(product_id, quantity):
-    print(f"Adjusting quantity: {quantity} for product_id: {product_id}")  # Debug statement
-    product = get_product_by_id(product_id)
-    if product:
-        new_quantity = product['quantity'] + quantity
-        products_db.update_one({"id": int(product_id)}, {"$set": {"quantity": new_quantity}})
-    print("Product quantity adjusted successfully")  # Debug statement
-    return product
+# Utility function to build the stock changes for every line of an order's cart
+def cart_stock_changes(cart, quantity_sign=0, reserved_sign=0, check=None):
+    return [
+        stock_change(item['id'], quantity=quantity_sign * item['quantity'], reserved=reserved_sign * item['quantity'], check=check)
+        for item in cart
+    ]
 
 # API to get all orders
 @orders_bp.route('/orders', methods=['GET'])
@@ -108,22 +51,46 @@ def get_orders(user_data):
         user_id = user_data.get('user_id')
         print(f"Getting orders for user_id: {user_id}")  # Debug statement
         
-        orders = list(orders_db.find({"user_id": user_id}))
-        
-        for order in orders:
-            if '_id' in order:
-                order['_id'] = str(order['_id'])
-        
-        print(f"Orders retrieved: {orders}")  # Debug statement
-        log_action(user_id, "retrieve_orders", {"order_count": len(orders)})
-        return jsonify(orders), 200
+        response, order_count = list_documents(orders_db, {"user_id": user_id})
+
+        print(f"Orders retrieved: {order_count}")  # Debug statement
+        log_action(user_id, "retrieve_orders", {"order_count": order_count})
+        return response
     except Exception as e:
         print(f"Error retrieving orders: {str(e)}")  # Debug statement
         log_action(user_id, "retrieve_orders_error", {"error": str(e)})
         return jsonify({"message": "Error retrieving orders", "error": str(e)}), 500
 
+# Utility function to build the order query from the status, startDate and endDate parameters
+def order_filters(user_id, query_params):
+    filters = {"user_id": user_id}
+    if query_params.get('status'):
+        filters["status"] = query_params['status']
+    date_ts = date_range(query_params)
+    if date_ts:
+        filters["date_ts"] = date_ts
+    return filters
+
+# API to download orders as CSV or NDJSON
+@orders_bp.route('/orders/export', methods=['GET'])
+@login_required
+def export_orders(user_data):
+    try:
+        user_id = user_data.get('user_id')
+        filters = order_filters(user_id, request.args)
+        print(f"Exporting orders with filters: {filters}")  # Debug statement
+        response = export_documents(orders_db, filters, 'orders')
+        log_action(user_id, "export_orders", {"filters": filters, "params": request.args.to_dict()})
+        return response
+    except (ExportError, DateParseError) as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        print(f"Error exporting orders: {str(e)}")  # Debug statement
+        return jsonify({"message": "Error exporting orders", "error": str(e)}), 500
+
 # API to create a new order
 @orders_bp.route('/orders/<string:user_id>', methods=['POST'])
+@idempotent('create_order')
 def create_order(user_id):
     try:
         order_data = request.json
@@ -136,13 +103,14 @@ def create_order(user_id):
         order_data['id'] = str(uuid.uuid4())
         order_data['user_id'] = user_id
         order_data['status'] = 'Pending'
+        order_data.update(timestamp_fields(order_data))
 
-        with db_lock:
-            orders_db.insert_one(order_data)
+        orders_db.insert_one(order_data)
         print("Order created successfully")  # Debug statement
         log_action(user_id, "create_order", order_data)
         if '_id' in order_data:
             order_data['_id'] = str(order_data['_id'])
+        order_events.publish(user_id, ORDER_CREATED, order_data)
         return jsonify(order_data), 200
     except Exception as e:
         print(f"Error creating order: {str(e)}")  # Debug statement
@@ -161,8 +129,9 @@ def delete_order(user_data, order_id):
             log_action(user_id, "delete_order_unauthorized", {"order_id": order_id})
             return jsonify({"message": "Unauthorized to delete this order"}), 403
 
-        with db_lock:
-            orders_db.delete_one({"id": order_id})
+        order = orders_db.find_one_and_delete({"id": order_id}, {"invoiceNumber": 1})
+        if order:
+            order_events.publish(user_id, ORDER_DELETED, {"id": order_id, "invoiceNumber": order.get('invoiceNumber')})
         print("Order deleted successfully")  # Debug statement
         log_action(user_id, "delete_order", {"order_id": order_id})
         return jsonify({"message": "Order deleted successfully"}), 200
@@ -174,6 +143,7 @@ def delete_order(user_data, order_id):
 # API to update the status of an order
 @orders_bp.route('/orders/<string:invoice_number>/status', methods=['PATCH'])
 @login_required
+@locked_by('order', 'invoice_number')
 def update_order_status(user_data, invoice_number):
     try:
         user_id = user_data.get('user_id')
@@ -189,32 +159,39 @@ def update_order_status(user_data, invoice_number):
             print("Status is required")  # Debug statement
             return jsonify({"message": "Status is required"}), 400
 
-        if order['status'] == 'Pending' and new_status == 'In Progress':
-            for item in order['cart']:
-                valid, message = validate_and_reserve_product_availability(item['id'], item['quantity'])
-                if not valid:
-                    print(f"Validation failed: {message}")  # Debug statement
-                    log_action(user_id, "update_order_status_failed", {"invoice_number": invoice_number, "message": message})
-                    return jsonify({"message": message}), 400
-
-            for item in order['cart']:
-                reserve_product_quantity(item['id'], item['quantity'])
-
-        elif order['status'] == 'In Progress' and new_status == 'Pending':
-            for item in order['cart']:
-                release_product_quantity(item['id'], item['quantity'])
-
-        elif new_status == 'Cancelled':
-            if order['status'] == 'In Progress':
-                for item in order['cart']:
-                    release_product_quantity(item['id'], item['quantity'])
+        # Claim the transition first, conditioned on the status we read, so a
+        # request in another worker cannot move the same order concurrently.
+        update = {"$set": {"status": new_status}}
+        if order['status'] == 'Pending' and new_status == RESERVED_STATUS:
+            # The reservation expires unless the order moves on in time
+            update["$set"].update(reservation_fields())
+        elif order['status'] == RESERVED_STATUS and new_status != RESERVED_STATUS:
+            update["$unset"] = RESERVATION_UNSET
+        claimed = orders_db.update_one({"invoiceNumber": invoice_number, "status": order['status']}, update)
+        if claimed.matched_count == 0:
+            print("Order status changed concurrently")  # Debug statement
+            return jsonify({"message": "Order was modified by another request, please retry"}), 409
 
+        if order['status'] == 'Pending' and new_status == 'In Progress':
+            ok, errors = apply_cart_checked(user_id, cart_stock_changes(order['cart'], reserved_sign=1, check=CHECK_AVAILABLE))
+            if not ok:
+                orders_db.update_one({"invoiceNumber": invoice_number, "status": new_status}, {"$set": {"status": order['status']}, "$unset": RESERVATION_UNSET})
+                body = cart_errors_response(errors)
+                print(f"Validation failed: {body['message']}")  # Debug statement
+                log_action(user_id, "update_order_status_failed", {"invoice_number": invoice_number, "errors": errors})
+                return jsonify(body), cart_errors_status(errors)
+
+        elif order['status'] == 'In Progress' and new_status in ('Pending', 'Cancelled'):
+            # Release per line; a product deleted since it was reserved has nothing to release
+            _, missing = apply_unchecked(user_id, cart_stock_changes(order['cart'], reserved_sign=-1))
+            if missing:
+                log_action(user_id, "release_reservation_missing_products", {"invoice_number": invoice_number, "missing_product_ids": missing})
+
+        previous_status = order['status']
         order['status'] = new_status
-        with db_lock:
-            orders_db.update_one({"invoiceNumber": invoice_number}, {"$set": {"status": new_status}})
-        
         if '_id' in order:
             order['_id'] = str(order['_id'])
+        order_events.publish(user_id, ORDER_STATUS_CHANGED, {"invoiceNumber": invoice_number, "status": new_status, "previous_status": previous_status})
         
         print(f"Order status updated to {new_status}")  # Debug statement
         log_action(user_id, "update_order_status", {"invoice_number": invoice_number, "new_status": new_status})
@@ -232,31 +209,30 @@ def add_order_note(user_data, invoice_number):
     try:
         user_id = user_data.get('user_id')
         print(f"Adding note to order with invoice_number: {invoice_number}, user_id: {user_id}")  # Debug statement
-        order = find_order_by_invoice(invoice_number)
-        
-        if not order or order['user_id'] != user_id:
-            print("Unauthorized to add note to this order")  # Debug statement
-            log_action(user_id, "add_order_note_unauthorized", {"invoice_number": invoice_number})
-            return jsonify({"message": "Unauthorized to add note to this order"}), 403
-
         note = request.json.get('note')
         if not note:
             print("Note is required")  # Debug statement
             return jsonify({"message": "Note is required"}), 400
 
-        with db_lock:
-            # Ensure the notes field is a list
-            if isinstance(order.get('notes'), str):
-                order['notes'] = [order['notes']]
-            elif not order.get('notes'):
-                order['notes'] = []
-
-            # Append the new note
-            order['notes'].append(note)
-            
-            # Update the order in the database
-            orders_db.update_one({"invoiceNumber": invoice_number}, {"$set": {"notes": order['notes']}})
-        
+        # Append atomically; a legacy string note is turned into a list first
+        order = orders_db.find_one_and_update(
+            {"invoiceNumber": invoice_number, "user_id": user_id},
+            [{"$set": {"notes": {"$concatArrays": [
+                {"$cond": [
+                    {"$isArray": "$notes"}, "$notes",
+                    {"$cond": [{"$and": [{"$eq": [{"$type": "$notes"}, "string"]}, {"$ne": ["$notes", ""]}]}, ["$notes"], []]}
+                ]},
+                [{"$literal": note}]
+            ]}}}],
+            return_document=ReturnDocument.AFTER
+        )
+
+        if not order:
+            print("Unauthorized to add note to this order")  # Debug statement
+            log_action(user_id, "add_order_note_unauthorized", {"invoice_number": invoice_number})
+            return jsonify({"message": "Unauthorized to add note to this order"}), 403
+
+        order_events.publish(user_id, ORDER_NOTE_ADDED, {"invoiceNumber": invoice_number, "note": note})
         print("Note added to order successfully")  # Debug statement
         log_action(user_id, "add_order_note", {"invoice_number": invoice_number, "note": note})
 
@@ -273,6 +249,7 @@ def add_order_note(user_data, invoice_number):
 # API to finalize an order, move it to transactions, and remove it from orders
 @orders_bp.route('/orders/<string:invoice_number>/finalize', methods=['POST'])
 @login_required
+@locked_by('order', 'invoice_number')
 def finalize_order(user_data, invoice_number):
     try:
         user_id = user_data.get('user_id')
@@ -284,24 +261,42 @@ def finalize_order(user_data, invoice_number):
             log_action(user_id, "finalize_order_unauthorized", {"invoice_number": invoice_number})
             return jsonify({"message": "Unauthorized to finalize this order"}), 403
 
+        previous_status = order['status']
         order['id'] = str(uuid.uuid4())
         order['txn_type'] = 'online sale'
         order['status'] = 'Completed'
-
-        for item in order['cart']:
-            product = get_product_by_id(item['id'])
-            if product['quantity'] < item['quantity']:
-                print(f"Insufficient stock for {product['name']}")  # Debug statement
-                log_action(user_id, "finalize_order_insufficient_stock", {"invoice_number": invoice_number, "product_id": item['id']})
-                return jsonify({"message": f"Insufficient stock for {product['name']}"}), 400
-
-        for item in order['cart']:
-            adjust_product_quantity(item['id'], -item['quantity'])
-            release_product_quantity(item['id'], item['quantity'])
-
-        with db_lock:
-            transactions_db.insert_one(order)
-            orders_db.delete_one({"invoiceNumber": invoice_number})
+        # The sale is recorded now; its business date stays the order's
+        order['created_at'] = datetime.utcnow()
+        if not order.get('date_ts'):
+            order['date_ts'] = date_timestamp(order.get('date'), order['created_at'])
+
+        # An order that is In Progress already holds its stock, so finalizing
+        # turns the reservation into a sale; otherwise the sale may only use
+        # stock nobody else has reserved.
+        if previous_status == 'In Progress':
+            changes = cart_stock_changes(order['cart'], quantity_sign=-1, reserved_sign=-1, check=CHECK_STOCK)
+        else:
+            changes = cart_stock_changes(order['cart'], quantity_sign=-1, check=CHECK_AVAILABLE)
+        ok, errors = apply_cart_checked(user_id, changes)
+        if not ok:
+            body = cart_errors_response(errors)
+            print(f"Insufficient stock: {body['message']}")  # Debug statement
+            log_action(user_id, "finalize_order_insufficient_stock", {"invoice_number": invoice_number, "errors": errors})
+            return jsonify(body), cart_errors_status(errors)
+
+        # Only the request that removes the order may record the sale
+        removed = orders_db.delete_one({"invoiceNumber": invoice_number, "status": previous_status})
+        if removed.deleted_count == 0:
+            apply_unchecked(user_id, [inverse_change(change) for change in changes])
+            print("Order finalized concurrently")  # Debug statement
+            return jsonify({"message": "Order was modified by another request, please retry"}), 409
+        session_id = active_session_id(user_id)
+        if session_id:
+            order['session_id'] = session_id
+        transactions_db.insert_one(order)
+        record_transaction(order)
+        record_session_transactions(session_id, [order])
+        order_events.publish(user_id, ORDER_FINALIZED, {"invoiceNumber": invoice_number, "transaction_id": order['id']})
 
         print("Order finalized successfully")  # Debug statement
         log_action(user_id, "finalize_order", {"invoice_number": invoice_number})
@@ -320,17 +315,78 @@ def get_orders_by_phone(user_id, phone):
             print("Phone number is required")  # Debug statement
             return jsonify({"message": "Phone number is required"}), 400
 
-        orders = list(orders_db.find({"customerPhone": phone, "user_id": user_id}))
-
-        for order in orders:
-            if '_id' in order:
-                order['_id'] = str(order['_id'])
+        # Newest first
+        response, order_count = list_documents(orders_db, {"customerPhone": phone, "user_id": user_id}, descending=True)
 
-        orders.reverse()
-        print(f"Orders retrieved by phone: {orders}")  # Debug statement
-        log_action(user_id, "get_orders_by_phone", {"phone": phone, "order_count": len(orders)})
-        return jsonify(orders), 200
+        print(f"Orders retrieved by phone: {order_count}")  # Debug statement
+        log_action(user_id, "get_orders_by_phone", {"phone": phone, "order_count": order_count})
+        return response
     except Exception as e:
         print(f"Error retrieving orders by phone number: {str(e)}")  # Debug statement
         log_action(user_id, "get_orders_by_phone_error", {"error": str(e)})
         return jsonify({"message": "Error retrieving orders by phone number", "error": str(e)}), 500
+
+# Push order events to kitchen and counter screens instead of polling GET /orders.
+#   Server-sent events by default; mode=poll answers once as a long-poll with {"events", "next", "resync"}
+#   Resume after a sequence number with Last-Event-ID (SSE reconnects send it) or after=<seq>
+#   EventSource cannot set headers, so the token may also be passed as ?token=
+# A "resync" event (or resync: true) means events were missed and GET /orders should be reloaded.
+# Every open stream holds a sync worker thread for its whole lifetime, so streams are closed after
+#   ORDER_STREAM_MAX_DURATION and EventSource reconnects on its own, resuming from Last-Event-ID.
+#   Deployments with many screens should run a gevent (or other async) worker class, or use mode=poll.
+@orders_bp.route('/orders/stream', methods=['GET'])
+def stream_orders():
+    auth_header = request.headers.get('Authorization')
+    if auth_header:
+        token = auth_header.split(" ")[1] if " " in auth_header else auth_header
+    else:
+        token = request.args.get('token')
+    user_data = verify_jwt(token) if token else None
+    if not user_data:
+        return jsonify({"message": "Invalid or expired token!"}), 401
+    user_id = user_data.get('user_id')
+
+    resume_token = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        after = int(resume_token) if resume_token else None
+    except ValueError:
+        return jsonify({"message": "after must be an event sequence number"}), 400
+
+    if after is None:
+        after, resync = order_events.current_seq(user_id), False
+    elif order_events.can_resume(user_id, after):
+        resync = False
+    else:
+        after, resync = order_events.current_seq(user_id), True
+
+    if request.args.get('mode') == 'poll':
+        events = [] if resync else order_events.wait(user_id, after, Config.ORDER_LONG_POLL_TIMEOUT)
+        next_seq = events[-1]['seq'] if events else after
+        return jsonify({"events": events, "next": next_seq, "resync": resync}), 200
+
+    def generate(cursor):
+        dumps = current_app.json.dumps
+        yield "retry: 3000\n\n"
+        yield f"id: {cursor}\nevent: {'resync' if resync else 'ready'}\ndata: {dumps({'seq': cursor})}\n\n"
+        max_duration = Config.ORDER_STREAM_MAX_DURATION
+        deadline = time.monotonic() + max_duration if max_duration > 0 else None
+        while True:
+            timeout = Config.ORDER_STREAM_HEARTBEAT
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return  # Frees the worker; the client reconnects after the retry delay
+                timeout = min(timeout, remaining)
+            events = order_events.wait(user_id, cursor, timeout)
+            if not events:
+                yield ": keepalive\n\n"  # Lets proxies and clients notice a dead connection
+                continue
+            for event in events:
+                cursor = event['seq']
+                yield f"id: {cursor}\nevent: {event['type']}\ndata: {dumps(event)}\n\n"
+
+    print(f"Order stream opened for user_id: {user_id} after {after}")  # Debug statement
+    response = Response(stream_with_context(generate(after)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
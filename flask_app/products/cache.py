@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CatalogCache:
+    """Per-tenant cache of serialized product listings.
+
+    Entries are bounded by count (least recently used go first) and by age,
+    and carry the data version they were built from. Every write path
+    invalidates the tenant's entry. A listing built from a
+    read that started before an invalidation is discarded rather than stored,
+    so a slow reader can never put stale data back into the cache.
+    """
+
+    def __init__(self, max_entries=1000, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    # An entry stored with a data version is only returned for that version
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self._counters["misses"] += 1
+            return None
+
+    # Token to pass to put(); taken before reading the data to be cached
+    def generation(self, key):
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def put(self, key, generation, value, version=None):
+        with self._lock:
+            if (self._epoch, self._generations.get(key, 0)) != generation:
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.pop(key, None)
+            self._counters["invalidations"] += 1
+            # Generations only matter while a read may be in flight; keep the
+            # map bounded and start a new epoch so no in-flight read survives.
+            if len(self._generations) > self.max_entries * 10:
+                self._generations = {}
+                self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        return stats
@@ -0,0 +1,106 @@
+import mimetypes
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class ImageDiskCache:
+    """Bounded LRU of image files on local disk, keyed by GridFS file id.
+
+    Stored images never change, so a cached copy never goes stale; the only
+    concern is size. Files are named ``<file_id><ext>`` so the index, and the
+    content types, can be rebuilt by scanning the directory after a restart.
+    Each process keeps its own index over the shared directory, so the
+    ``max_bytes`` bound is enforced per worker.
+    """
+
+    def __init__(self, directory, max_bytes, max_file_bytes, chunk_size=256 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.chunk_size = chunk_size
+        self._entries = OrderedDict()  # file_id -> (path, size, content_type)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.'):
+                os.remove(path)  # Leftover from an interrupted fill
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_atime, name, path, stat.st_size))
+        for _, name, path, size in sorted(files):
+            file_id, _ = os.path.splitext(name)
+            content_type, _ = mimetypes.guess_type(name)
+            self._entries[file_id] = (path, size, content_type or 'application/octet-stream')
+            self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, (path, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # Open a cached image. Returns (file, size, content_type) or None on a miss.
+    def open(self, file_id):
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(file_id)
+            self.hits += 1
+        path, size, content_type = entry
+        try:
+            return open(path, 'rb'), size, content_type
+        except FileNotFoundError:
+            # Evicted by another worker sharing the directory
+            with self._lock:
+                if self._entries.pop(file_id, None) is not None:
+                    self._bytes -= size
+            return None
+
+    # Copy a GridFS file into the cache chunk by chunk. Returns False when the
+    # file is too large to cache.
+    def fill(self, file_id, grid_out):
+        if grid_out.length > self.max_file_bytes:
+            return False
+        extension = mimetypes.guess_extension(grid_out.content_type or '') or ''
+        path = os.path.join(self.directory, f"{file_id}{extension}")
+        temp_path = os.path.join(self.directory, f".{file_id}.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, 'wb') as target:
+            for chunk in iter(lambda: grid_out.read(self.chunk_size), b''):
+                target.write(chunk)
+        os.replace(temp_path, path)
+        with self._lock:
+            previous = self._entries.pop(file_id, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[file_id] = (path, grid_out.length, grid_out.content_type or 'application/octet-stream')
+            self._bytes += grid_out.length
+            self._evict()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -0,0 +1,266 @@
+import datetime
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask import request, Response
+from gridfs.errors import NoFile
+from PIL import features
+from werkzeug.wsgi import wrap_file
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from config import Config
+from database.db import primary
+from products.imaging import render_variants, IMAGE_VARIANTS, FORMAT_CONTENT_TYPES
+
+# Image job states
+JOB_PENDING = 'pending'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class ImageQueueFull(Exception):
+    """Raised by ImagePipeline.submit when max_pending uploads are already waiting."""
+
+
+# Utility function naming the formats variants are encoded in
+def image_formats():
+    if Config.IMAGE_WEBP and features.check('webp'):
+        return ('jpeg', 'webp')
+    return ('jpeg',)
+
+
+class ImagePipeline:
+    """Turns uploads into stored image variants off the request thread.
+
+    An upload becomes a job keyed by the sha256 of its bytes, so the same
+    photo uploaded twice is processed and stored once. Rendering runs in a
+    process pool (inline with ``render_workers=0``); a small thread pool
+    drives jobs and writes results to GridFS, where every blob is also keyed
+    by its own content hash. Queued jobs hold their upload in memory, so at
+    most ``max_pending`` are accepted at once.
+    """
+
+    def __init__(self, fs, jobs, workers=2, render_workers=2, job_timeout=300, max_pending=32):
+        self.fs = fs
+        self.jobs = primary(jobs)
+        self.workers = workers
+        self.render_workers = render_workers
+        self.job_timeout = job_timeout
+        self.max_pending = max_pending
+        self._pending = 0
+        self._threads = None
+        self._renderers = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Finished jobs never change, so image requests can skip the job lookup
+        self._done_jobs = OrderedDict()
+        self._done_jobs_max = 1024
+
+    def _executors(self):
+        # Pools do not survive a fork; each worker process builds its own
+        with self._lock:
+            if self._threads is None or self._pid != os.getpid():
+                self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-pipeline')
+                self._renderers = None
+                if self.render_workers > 0:
+                    self._renderers = ProcessPoolExecutor(max_workers=self.render_workers, mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._threads, self._renderers
+
+    def _take_slot(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            return True
+
+    def _release_slot(self):
+        with self._lock:
+            self._pending -= 1
+
+    # Accept an upload. Returns (job, created): created is False when the same
+    # bytes were uploaded before and that job is reused. Raises ImageQueueFull
+    # when the upload would have to wait behind max_pending others.
+    def submit(self, data, filename):
+        source_hash = hashlib.sha256(data).hexdigest()
+        existing = self.get_job(source_hash)
+        if existing is not None and existing["status"] == JOB_DONE:
+            return existing, False
+        if not self._take_slot():
+            raise ImageQueueFull()
+        queued = False
+        try:
+            job, queued = self._claim(source_hash, filename)
+            if queued:
+                threads, _ = self._executors()
+                threads.submit(self._process, source_hash, data)
+            return job, queued
+        finally:
+            if not queued:
+                self._release_slot()
+
+    def _claim(self, source_hash, filename):
+        now = datetime.datetime.utcnow()
+        job = {
+            "_id": source_hash,
+            "status": JOB_PENDING,
+            "filename": filename,
+            "variants": {},
+            "submitted_at": now,
+        }
+        try:
+            self.jobs.insert_one(job)
+        except DuplicateKeyError:
+            job = self.jobs.find_one({"_id": source_hash})
+            if not self._retryable(job, now):
+                return job, False
+            # A failed or abandoned job is claimed again by exactly one request
+            job = self.jobs.find_one_and_update(
+                {"_id": source_hash, "status": job["status"], "submitted_at": job["submitted_at"]},
+                {"$set": {"status": JOB_PENDING, "submitted_at": now}, "$unset": {"error": ""}},
+                return_document=ReturnDocument.AFTER
+            )
+            if job is None:
+                return self.jobs.find_one({"_id": source_hash}), False
+        return job, True
+
+    def _retryable(self, job, now):
+        if job["status"] == JOB_FAILED:
+            return True
+        return job["status"] == JOB_PENDING and (now - job["submitted_at"]).total_seconds() > self.job_timeout
+
+    def _render(self, data):
+        _, renderers = self._executors()
+        formats = image_formats()
+        if renderers is None:
+            return render_variants(data, IMAGE_VARIANTS, formats, Config.IMAGE_QUALITY)
+        return renderers.submit(render_variants, data, IMAGE_VARIANTS, formats, Config.IMAGE_QUALITY).result(timeout=self.job_timeout)
+
+    def _store(self, source_hash, variant, fmt, blob, width, height):
+        content_hash = hashlib.sha256(blob).hexdigest()
+        existing = self.fs.find_one({"metadata.content_hash": content_hash})
+        if existing is not None:
+            return existing._id
+        return self.fs.put(
+            blob,
+            content_type=FORMAT_CONTENT_TYPES[fmt],
+            filename=f"{source_hash}-{variant}.{fmt}",
+            metadata={
+                "content_hash": content_hash,
+                "source_hash": source_hash,
+                "variant": variant,
+                "format": fmt,
+                "width": width,
+                "height": height,
+            }
+        )
+
+    def _process(self, source_hash, data):
+        try:
+            rendered = self._render(data)
+            variants = {}
+            for variant, encodings in rendered.items():
+                variants[variant] = {}
+                for fmt, (blob, width, height) in encodings.items():
+                    variants[variant][fmt] = self._store(source_hash, variant, fmt, blob, width, height)
+            self.jobs.update_one(
+                {"_id": source_hash},
+                {"$set": {"status": JOB_DONE, "variants": variants, "completed_at": datetime.datetime.utcnow()}}
+            )
+        except Exception as e:
+            print(f"Error processing image {source_hash}: {str(e)}")  # Debug statement
+            self.jobs.update_one({"_id": source_hash}, {"$set": {"status": JOB_FAILED, "error": str(e)}})
+        finally:
+            self._release_slot()
+
+    def get_job(self, source_hash):
+        with self._lock:
+            job = self._done_jobs.get(source_hash)
+            if job is not None:
+                self._done_jobs.move_to_end(source_hash)
+                return job
+        job = self.jobs.find_one({"_id": source_hash})
+        if job and job["status"] == JOB_DONE:
+            with self._lock:
+                self._done_jobs[source_hash] = job
+                while len(self._done_jobs) > self._done_jobs_max:
+                    self._done_jobs.popitem(last=False)
+        return job
+
+
+# Utility function to pick the stored file for a variant, preferring WebP when the client accepts it
+def variant_file_id(job, variant, accept_webp=False):
+    encodings = (job.get("variants") or {}).get(variant)
+    if not encodings:
+        return None
+    if accept_webp and 'webp' in encodings:
+        return encodings['webp']
+    return encodings.get('jpeg')
+
+# Utility function to describe a job to clients. file_id and url keep the
+# shape of the old synchronous upload: once the job is done file_id is the
+# detail JPEG's GridFS id; while it is pending it is the image id, which
+# /image/<file_id> also accepts and answers with 202 until the image is ready.
+def job_response(job):
+    image_id = job["_id"]
+    detail = variant_file_id(job, 'detail') if job["status"] == JOB_DONE else None
+    return {
+        "image_id": image_id,
+        "file_id": str(detail) if detail is not None else image_id,
+        "status": job["status"],
+        "url": f"/products/image/{image_id}/detail",
+        "urls": {variant: f"/products/image/{image_id}/{variant}" for variant in IMAGE_VARIANTS},
+        "status_url": f"/products/image/{image_id}/status",
+        "error": job.get("error"),
+    }
+
+# Utility function to tell an image id (sha256 of the upload) from a GridFS file id
+def is_image_id(value):
+    return len(value) == 64 and all(char in '0123456789abcdef' for char in value)
+
+def _file_response(file, length, content_type, etag):
+    # Streamed in chunks; make_conditional answers If-None-Match and Range
+    # requests (206) by seeking within the file.
+    response = Response(wrap_file(request.environ, file, buffer_size=Config.IMAGE_STREAM_CHUNK_SIZE), mimetype=content_type, direct_passthrough=True)
+    response.content_length = length
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = Config.IMAGE_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=length)
+
+# Serve a stored image without buffering it. Stored files never change, so the
+# file id is the ETag and a matching If-None-Match is answered before any read.
+# Hot images come from the local disk cache; others are streamed from GridFS
+# chunk by chunk. Returns None when the file does not exist.
+def image_response(fs, file_id, disk_cache=None):
+    key = str(file_id)
+    if request.if_none_match.contains(key):
+        response = Response(status=304)
+        response.set_etag(key)
+        response.cache_control.public = True
+        response.cache_control.max_age = Config.IMAGE_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+    if disk_cache is not None:
+        cached = disk_cache.open(key)
+        if cached is None:
+            try:
+                if disk_cache.fill(key, fs.get(file_id)):
+                    cached = disk_cache.open(key)
+            except NoFile:
+                return None
+        if cached is not None:
+            file, length, content_type = cached
+            return _file_response(file, length, content_type, key)
+
+    try:
+        grid_out = fs.get(file_id)
+    except NoFile:
+        return None
+    return _file_response(grid_out, grid_out.length, grid_out.content_type or 'application/octet-stream', key)
@@ -0,0 +1,42 @@
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# Pure image rendering, kept free of app and database imports so it can run in
+# worker processes without connecting to Mongo.
+
+# Variant name -> bounding box (width, height)
+IMAGE_VARIANTS = {
+    'thumb': (150, 150),
+    'list': (400, 400),
+    'detail': (800, 800),
+}
+
+FORMAT_CONTENT_TYPES = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+
+
+# Decode an upload once and encode every variant in every requested format.
+# Returns {variant: {format: (bytes, width, height)}}.
+def render_variants(data, variants=IMAGE_VARIANTS, formats=('jpeg',), quality=85):
+    with Image.open(BytesIO(data)) as source:
+        source.load()
+        image = ImageOps.exif_transpose(source)  # Phone photos carry their rotation in EXIF
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    rendered = {}
+    # Largest first, so each smaller variant is resized from the previous one
+    for name, box in sorted(variants.items(), key=lambda item: item[1][0] * item[1][1], reverse=True):
+        image = image.copy()
+        image.thumbnail(box, Image.LANCZOS)
+        rendered[name] = {}
+        for fmt in formats:
+            buffer = BytesIO()
+            if fmt == 'jpeg':
+                image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+            else:
+                image.save(buffer, format=fmt.upper(), quality=quality, method=4)
+            rendered[name][fmt] = (buffer.getvalue(), image.width, image.height)
+    return rendered
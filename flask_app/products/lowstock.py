@@ -0,0 +1,106 @@
+import datetime
+import threading
+import time
+import click
+from flask.cli import AppGroup
+from pymongo import ASCENDING
+from config import Config
+from database.db import products_db, settings_db, reorder_reports_db
+from database.inventory import AVAILABLE_STAGES
+
+# Fields a low-stock listing needs from each product
+LOW_STOCK_FIELDS = {"_id": 0, "id": 1, "name": 1, "barcode": 1, "sku": 1, "quantity": 1, "reserved_quantity": 1,
+                    "available": 1, "reorder_threshold": 1, "reorder_quantity": 1}
+
+
+# Utility function to read a tenant's reorder threshold from its settings
+def tenant_threshold(user_id):
+    settings = settings_db.find_one({"user_id": user_id}, {"lowStockThreshold": 1})
+    threshold = (settings or {}).get('lowStockThreshold')
+    return threshold if isinstance(threshold, (int, float)) else Config.LOW_STOCK_DEFAULT_THRESHOLD
+
+# Products at or below their reorder threshold, lowest availability first.
+# Products with their own reorder_threshold are found through reorder_gap, the
+# rest through available against the tenant threshold; both are index range
+# scans, so the rest of the catalog is never read.
+def low_stock(user_id, threshold=None, limit=None):
+    if threshold is None:
+        threshold = tenant_threshold(user_id)
+    own_threshold = products_db.find({"user_id": user_id, "reorder_gap": {"$lte": 0}}, LOW_STOCK_FIELDS)
+    tenant_default = products_db.find(
+        {"user_id": user_id, "available": {"$lte": threshold}, "reorder_threshold": {"$exists": False}}, LOW_STOCK_FIELDS
+    )
+    products = []
+    for cursor in (own_threshold, tenant_default):
+        if limit:
+            cursor = cursor.limit(limit)
+        for product in cursor.sort('available', ASCENDING):
+            product['threshold'] = product.get('reorder_threshold', threshold)
+            products.append(product)
+    products.sort(key=lambda product: product.get('available', 0))
+    return products[:limit] if limit else products
+
+# Utility function to suggest how much of a low product to order
+def suggested_quantity(product):
+    if isinstance(product.get('reorder_quantity'), (int, float)) and product['reorder_quantity'] > 0:
+        return product['reorder_quantity']
+    return max(product['threshold'] * 2 - product.get('available', 0), 1)
+
+# Build and store a tenant's reorder report; returns the stored document
+def build_reorder_report(user_id):
+    items = []
+    for product in low_stock(user_id):
+        product['suggested_quantity'] = suggested_quantity(product)
+        items.append(product)
+    report = {
+        "user_id": user_id,
+        "generated_at": datetime.datetime.utcnow(),
+        "item_count": len(items),
+        "items": items,
+    }
+    reorder_reports_db.insert_one(report)
+    return report
+
+# Reorder reports for every tenant with products; returns {user_id: item_count}
+def build_all_reorder_reports():
+    counts = {}
+    for user_id in products_db.distinct('user_id'):
+        if user_id:
+            counts[user_id] = build_reorder_report(user_id)["item_count"]
+    return counts
+
+# Periodically write reorder reports in the background. Only one worker should
+# run this; deployments with several workers can use the CLI command from cron.
+def start_reorder_reports(interval):
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                counts = build_all_reorder_reports()
+                print(f"Reorder reports written for {len(counts)} tenants")  # Debug statement
+            except Exception as e:
+                print(f"Error writing reorder reports: {str(e)}")  # Debug statement
+    thread = threading.Thread(target=run, name='reorder-reports', daemon=True)
+    thread.start()
+    return thread
+
+# Recompute available / reorder_gap on products written before they were maintained
+def backfill_available(recompute_all=False):
+    query = {} if recompute_all else {"available": {"$exists": False}}
+    return products_db.update_many(query, AVAILABLE_STAGES).modified_count
+
+
+stock_cli = AppGroup('stock', help="Inventory maintenance and reports.")
+
+@stock_cli.command('backfill-available')
+@click.option('--all', 'recompute_all', is_flag=True, help="Recompute every product, not only those missing the field.")
+def backfill_available_command(recompute_all):
+    """Fill in the available and reorder_gap fields."""
+    click.echo(f"Updated {backfill_available(recompute_all)} products.")
+
+@stock_cli.command('reorder-report')
+def reorder_report_command():
+    """Write a reorder report for every tenant."""
+    counts = build_all_reorder_reports()
+    for user_id, count in counts.items():
+        click.echo(f"{user_id}: {count} products to reorder")
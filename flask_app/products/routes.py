@@ -1,52 +1,105 @@
-from flask import Blueprint, request, jsonify, send_file
-from pymongo import MongoClient
+from flask import Blueprint, request, jsonify, Response
+from pymongo import MongoClient, ASCENDING
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
 from auth.utils import login_required
-import threading
 import uuid
 from datetime import datetime
 from config import Config
-from database.db import profile_db, transactions_db, products_db, orders_db, settings_db, pending_transactions_db, logs_db
+from database.db import profile_db, transactions_db, products_db, orders_db, settings_db, pending_transactions_db, product_tombstones_db, image_jobs_db, reorder_reports_db, primary
+from database.versions import conditional_get, bump_version, current_version, next_change_seq, PRODUCTS, PRODUCT_CHANGES, PRODUCT_NAMES
+from database.audit import log_action
+from database.pagination import list_documents, has_listing_params
+from database.inventory import stock_change, apply_change, on_stock_change, stock_fields, set_product_fields, CHECK_STOCK
+from products.cache import CatalogCache
+from products.search import ProductSearchIndex
+from products.lowstock import low_stock, tenant_threshold
+from products.images import ImagePipeline, ImageQueueFull, variant_file_id, job_response, image_response, is_image_id, JOB_DONE, JOB_PENDING
+from products.imagecache import ImageDiskCache
 from gridfs import GridFS
-from PIL import Image
-from io import BytesIO
-
-# Lock to handle multi-threaded operations
-db_lock = threading.Lock()
 
 products_bp = Blueprint('products', __name__)
 
 # Initialize GridFS for image storage
 fs = GridFS(products_db.database)
 
-# Maximum image size (width, height)
-MAX_IMAGE_SIZE = (800, 800)  # 800x800 pixels
-
-# Utility function to log actions
-def log_action(user_id, action, details):
-    log_entry = {
-        "user_id": user_id,
-        "action": action,
-        "details": details,
-        "timestamp": datetime.utcnow()
-    }
-    with db_lock:
-        logs_db.insert_one(log_entry)
-    print(f"Logged action: {action}, details: {details}")  # Debug statement
+# Uploads are resized and stored in the background
+image_pipeline = ImagePipeline(
+    fs, image_jobs_db,
+    workers=Config.IMAGE_WORKERS,
+    render_workers=Config.IMAGE_RENDER_WORKERS,
+    job_timeout=Config.IMAGE_JOB_TIMEOUT,
+    max_pending=Config.IMAGE_MAX_PENDING_JOBS
+)
+
+# Hot images are kept on local disk; leave IMAGE_DISK_CACHE_DIR empty to always stream from GridFS
+image_disk_cache = None
+if Config.IMAGE_DISK_CACHE_DIR:
+    image_disk_cache = ImageDiskCache(
+        Config.IMAGE_DISK_CACHE_DIR,
+        max_bytes=Config.IMAGE_DISK_CACHE_MAX_BYTES,
+        max_file_bytes=Config.IMAGE_DISK_CACHE_MAX_FILE_BYTES,
+        chunk_size=Config.IMAGE_STREAM_CHUNK_SIZE
+    )
+
+# Bookkeeping fields kept on product documents but never sent to clients
+PRODUCT_INTERNAL_FIELDS = ['inventory_ops', 'reorder_gap']
+
+# Serialized product listings per tenant, served by /products and /online-products
+catalog_cache = CatalogCache(max_entries=Config.CATALOG_CACHE_MAX_TENANTS, ttl=Config.CATALOG_CACHE_TTL)
+
+# Word index over product names for /products/search
+search_index = ProductSearchIndex(max_tenants=Config.SEARCH_INDEX_MAX_TENANTS)
+
+# Utility function to record that a tenant's catalog changed
+def catalog_changed(user_id):
+    bump_version(user_id, PRODUCTS)
+    catalog_cache.invalidate(user_id)
+
+# Stock changes made anywhere (orders, transactions, this blueprint) change the catalog
+@on_stock_change
+def stock_changed(user_id, product_ids):
+    catalog_changed(user_id)
+
+# Utility function to list a tenant's products. The tenant's products version
+# answers If-None-Match with a 304 and keys the cached full listing. The
+# version itself is held in memory for CATALOG_VERSION_MAX_AGE seconds, so a
+# cache hit needs no round trip; writes in other workers show up after that.
+def catalog_response(user_id):
+    etag, version, not_modified = conditional_get(user_id, PRODUCTS, Config.CATALOG_VERSION_MAX_AGE)
+    if not_modified:
+        return (not_modified, 304), None
+
+    # Read from the primary so the listing is never older than the version
+    if has_listing_params(request.args):
+        (response, status), product_count = list_documents(primary(products_db), {"user_id": user_id}, exclude=PRODUCT_INTERNAL_FIELDS)
+    else:
+        cached = catalog_cache.get(user_id, version)
+        if cached is None:
+            generation = catalog_cache.generation(user_id)
+            (response, status), product_count = list_documents(primary(products_db), {"user_id": user_id}, exclude=PRODUCT_INTERNAL_FIELDS)
+            cached = (response.get_data(), product_count)
+            catalog_cache.put(user_id, generation, cached, version)
+        body, product_count = cached
+        response, status = Response(body, mimetype='application/json'), 200
+
+    if status == 200:
+        response.set_etag(etag)
+    return (response, status), product_count
 
 # Utility function to check if the user owns the product
 def check_ownership(user_id, product_id):
     print(f"Checking ownership for product_id: {product_id}, {type(product_id)} and user_id: {user_id}")  # Debug statement
-    product = products_db.find_one({"id": int(product_id)})
-    if not product:
-        print("Product not found")  # Debug statement
-        return False
-    
-    ownership = product.get('user_id') == user_id
+    # Product ids are only unique per tenant, so look the product up within the user's catalog
+    ownership = products_db.find_one({"id": int(product_id), "user_id": user_id}, {"_id": 1}) is not None
     print(f"Ownership check result: {ownership}")  # Debug statement
     return ownership
 
-# New function to handle image upload, resizing, and storage
+# Accept an image upload and queue it for resizing. Thumbnail, list and detail
+# variants (JPEG, plus WebP when enabled) are produced by the image pipeline;
+# the same photo uploaded again reuses the stored variants. The response keeps
+# the old url and file_id keys; until status is done, image requests answer
+# 202 with Retry-After instead of the image.
 @products_bp.route('/upload', methods=['POST'])
 def upload_image():
     if 'file' not in request.files:
@@ -56,29 +109,66 @@ def upload_image():
     if file.filename == '':
         return jsonify({'message': 'No selected file'}), 400
 
-    # Open the image and resize it
-    image = Image.open(file)
-    image.thumbnail(MAX_IMAGE_SIZE)  # Resize image to fit within MAX_IMAGE_SIZE
-
-    # Convert image to binary
-    img_byte_arr = BytesIO()
-    image.save(img_byte_arr, format='JPEG')
-    img_byte_arr = img_byte_arr.getvalue()
+    try:
+        data = file.read(Config.IMAGE_MAX_UPLOAD_BYTES + 1)
+        if len(data) > Config.IMAGE_MAX_UPLOAD_BYTES:
+            return jsonify({'message': 'Image is too large'}), 413
 
-    # Store image in GridFS
-    file_id = fs.put(img_byte_arr, content_type='image/jpeg', filename=file.filename)
+        try:
+            job, created = image_pipeline.submit(data, file.filename)
+        except ImageQueueFull:
+            response = jsonify({"message": "Too many images are being processed, please retry shortly"})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        print(f"Image {job['_id']} {'queued' if created else 'already uploaded'}")  # Debug statement
+        return jsonify(job_response(job)), 200 if job['status'] == JOB_DONE else 202
+    except Exception as e:
+        print('Error uploading image:', str(e))  # Debug statement
+        return jsonify({"message": "Error uploading image", "error": str(e)}), 500
 
-    # Generate the image URL
-    file_url = f"/products/image/{file_id}"
+# Processing state of an uploaded image
+@products_bp.route('/image/<image_id>/status', methods=['GET'])
+def get_image_status(image_id):
+    job = image_pipeline.get_job(image_id)
+    if not job:
+        return jsonify({"message": "Image not found"}), 404
+    return jsonify(job_response(job)), 200
 
-    return jsonify({'url': file_url, 'file_id': str(file_id)}), 200
+# Serve one variant of an uploaded image; 202 while it is still being processed
+@products_bp.route('/image/<image_id>/<variant>', methods=['GET'])
+def get_image_variant(image_id, variant):
+    try:
+        job = image_pipeline.get_job(image_id)
+        if not job:
+            return jsonify({"message": "Image not found"}), 404
+        file_id = variant_file_id(job, variant, accept_webp='image/webp' in request.headers.get('Accept', ''))
+        if file_id is None and job['status'] == JOB_PENDING:
+            response = jsonify({"message": "Image is still being processed", "status": job['status']})
+            response.headers['Retry-After'] = '1'
+            return response, 202
+        if file_id is None:
+            return jsonify({"message": "Image processing failed" if job['status'] != JOB_DONE else "Unknown image variant", "status": job['status']}), 404
+        response = image_response(fs, file_id, image_disk_cache)
+        if response is None:
+            return jsonify({"message": "Image not found"}), 404
+        response.vary.add('Accept')
+        return response
+    except Exception as e:
+        return jsonify({"message": "Error retrieving image", "error": str(e)}), 500
 
 # Endpoint to serve images from GridFS
 @products_bp.route('/image/<file_id>', methods=['GET'])
 def get_image(file_id):
+    # The file_id of an upload still being processed is its image id
+    if is_image_id(file_id):
+        return get_image_variant(file_id, 'detail')
     try:
-        file_data = fs.get(ObjectId(file_id))
-        return send_file(BytesIO(file_data.read()), mimetype=file_data.content_type)
+        response = image_response(fs, ObjectId(file_id), image_disk_cache)
+        if response is None:
+            return jsonify({"message": "Image not found"}), 404
+        return response
+    except InvalidId:
+        return jsonify({"message": "Image not found"}), 404
     except Exception as e:
         return jsonify({"message": "Error retrieving image", "error": str(e)}), 500
 
@@ -89,14 +179,11 @@ def get_online_products(user_id):
         if not user_id:
             return jsonify({"message": "User ID is required"}), 400
         
-        products = list(products_db.find({"user_id": user_id}))
-        
-        for product in products:
-            product['_id'] = str(product['_id'])
-        
-        print('Products retrieved:', products)  # Debug statement
-        log_action(user_id, "get_online_products", {"product_count": len(products)})
-        return jsonify(products), 200
+        response, product_count = catalog_response(user_id)
+
+        print('Products retrieved:', product_count)  # Debug statement
+        log_action(user_id, "get_online_products", {"product_count": product_count})
+        return response
     except Exception as e:
         print('Error retrieving products:', str(e))  # Debug statement
         log_action(user_id, "get_online_products_error", {"error": str(e)})
@@ -111,19 +198,160 @@ def get_products(user_data):
         if not user_id:
             return jsonify({"message": "User ID is required"}), 400
         
-        products = list(products_db.find({"user_id": user_id}))
-        
-        for product in products:
-            product['_id'] = str(product['_id'])
-        
-        print('Products retrieved:', products)  # Debug statement
-        log_action(user_id, "get_products", {"product_count": len(products)})
-        return jsonify(products), 200
+        response, product_count = catalog_response(user_id)
+
+        print('Products retrieved:', product_count)  # Debug statement
+        log_action(user_id, "get_products", {"product_count": product_count})
+        return response
     except Exception as e:
         print('Error retrieving products:', str(e))  # Debug statement
         log_action(user_id, "get_products_error", {"error": str(e)})
         return jsonify({"message": "Error retrieving products"}), 500
 
+# Product lookup for terminals:
+#   code=<barcode or SKU>   exact match, one indexed query (what a scanner sends)
+#   q=<words>               name search; every word matches a word of the name by prefix
+#   fuzzy=0                 turn off matching close misspellings for q
+#   limit=<n>               at most n results
+@products_bp.route('/products/search', methods=['GET'])
+@login_required
+def search_products(user_data):
+    print('GET /products/search called')  # Debug statement
+    try:
+        user_id = user_data.get('user_id')
+        code = request.args.get('code', '').strip()
+        query = request.args.get('q', '').strip()
+        if not code and not query:
+            return jsonify({"message": "code or q is required"}), 400
+        try:
+            limit = min(int(request.args.get('limit', Config.SEARCH_DEFAULT_LIMIT)), Config.SEARCH_MAX_LIMIT)
+        except ValueError:
+            return jsonify({"message": "limit must be an integer"}), 400
+        projection = {field: 0 for field in PRODUCT_INTERNAL_FIELDS}
+
+        if code:
+            # Scanners send digits; match barcodes stored either as strings or numbers
+            codes = [code, int(code)] if code.isdigit() else [code]
+            products = list(products_db.find(
+                {"user_id": user_id, "$or": [{"barcode": {"$in": codes}}, {"sku": {"$in": codes}}]}, projection
+            ).limit(limit))
+        else:
+            ids = search_index.search(user_id, query, limit=limit, fuzzy=request.args.get('fuzzy') != '0')
+            found = {product['id']: product for product in products_db.find({"user_id": user_id, "id": {"$in": ids}}, projection)}
+            products = [found[product_id] for product_id in ids if product_id in found]
+
+        for product in products:
+            product['_id'] = str(product['_id'])
+        print('Products found:', len(products))  # Debug statement
+        return jsonify(products), 200
+    except Exception as e:
+        print('Error searching products:', str(e))  # Debug statement
+        return jsonify({"message": "Error searching products"}), 500
+
+# Products at or below their reorder threshold. A product's own
+# reorder_threshold wins over the tenant's lowStockThreshold setting;
+# threshold=<n> overrides the tenant value for this request.
+@products_bp.route('/products/low-stock', methods=['GET'])
+@login_required
+def get_low_stock(user_data):
+    print('GET /products/low-stock called')  # Debug statement
+    try:
+        user_id = user_data.get('user_id')
+        try:
+            threshold = float(request.args['threshold']) if request.args.get('threshold') else tenant_threshold(user_id)
+            limit = min(int(request.args.get('limit', Config.LIST_MAX_LIMIT)), Config.LIST_MAX_LIMIT)
+        except ValueError:
+            return jsonify({"message": "threshold and limit must be numbers"}), 400
+        products = low_stock(user_id, threshold, limit)
+        print('Low stock products:', len(products))  # Debug statement
+        return jsonify({"threshold": threshold, "products": products}), 200
+    except Exception as e:
+        print('Error retrieving low stock products:', str(e))  # Debug statement
+        return jsonify({"message": "Error retrieving low stock products"}), 500
+
+# Most recent reorder report written by the periodic job or `flask stock reorder-report`
+@products_bp.route('/products/reorder-report', methods=['GET'])
+@login_required
+def get_reorder_report(user_data):
+    try:
+        user_id = user_data.get('user_id')
+        report = reorder_reports_db.find_one({"user_id": user_id}, sort=[('generated_at', -1)])
+        if not report:
+            return jsonify({"message": "No reorder report yet"}), 404
+        report['_id'] = str(report['_id'])
+        return jsonify(report), 200
+    except Exception as e:
+        print('Error retrieving reorder report:', str(e))  # Debug statement
+        return jsonify({"message": "Error retrieving reorder report"}), 500
+
+# Counters of the product name index
+@products_bp.route('/products/search/stats', methods=['GET'])
+@login_required
+def get_search_index_stats(user_data):
+    return jsonify(search_index.stats()), 200
+
+# Hit/miss counters for the local image cache
+@products_bp.route('/image-cache/stats', methods=['GET'])
+@login_required
+def get_image_cache_stats(user_data):
+    if image_disk_cache is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(image_disk_cache.stats(), enabled=True)), 200
+
+# Hit/miss counters for the catalog cache
+@products_bp.route('/products/cache/stats', methods=['GET'])
+@login_required
+def get_catalog_cache_stats(user_data):
+    return jsonify(catalog_cache.stats()), 200
+
+# Delta sync for offline-capable terminals. Returns the products written and the
+# ids deleted since the sequence number the terminal last saw, plus the sequence
+# number to send next time. since=0 (or too many changes) asks for a full resync.
+@products_bp.route('/products/changes', methods=['GET'])
+@login_required
+def get_product_changes(user_data):
+    print('GET /products/changes called')  # Debug statement
+    try:
+        user_id = user_data.get('user_id')
+        try:
+            since = int(request.args.get('since', 0))
+        except ValueError:
+            return jsonify({"message": "since must be an integer"}), 400
+
+        # Read the sequence first; writes allocate theirs before landing, so a
+        # few recent numbers are re-sent to cover writes that were in flight.
+        seq = current_version(user_id, PRODUCT_CHANGES)
+        projection = {field: 0 for field in PRODUCT_INTERNAL_FIELDS}
+        if since > 0:
+            floor = max(0, since - Config.PRODUCT_CHANGES_OVERLAP)
+            changes = list(primary(products_db).find(
+                {"user_id": user_id, "change_seq": {"$gt": floor}}, projection
+            ).sort('change_seq', ASCENDING).limit(Config.PRODUCT_CHANGES_MAX + 1))
+            full_resync = len(changes) > Config.PRODUCT_CHANGES_MAX
+        else:
+            full_resync = True
+
+        if full_resync:
+            changes = list(primary(products_db).find({"user_id": user_id}, projection))
+            deleted = []
+        else:
+            deleted = [
+                {"id": tombstone['id'], "change_seq": tombstone['change_seq']}
+                for tombstone in primary(product_tombstones_db).find(
+                    {"user_id": user_id, "change_seq": {"$gt": floor}}, {"_id": 0, "id": 1, "change_seq": 1}
+                ).sort('change_seq', ASCENDING)
+            ]
+
+        for product in changes:
+            product['_id'] = str(product['_id'])
+
+        log_action(user_id, "get_product_changes", {"since": since, "change_count": len(changes), "deleted_count": len(deleted)})
+        return jsonify({"seq": seq, "full_resync": full_resync, "changes": changes, "deleted": deleted}), 200
+    except Exception as e:
+        print('Error retrieving product changes:', str(e))  # Debug statement
+        log_action(user_id, "get_product_changes_error", {"error": str(e)})
+        return jsonify({"message": "Error retrieving product changes"}), 500
+
 @products_bp.route('/products', methods=['POST'])
 @login_required
 def create_product(user_data):
@@ -138,9 +366,14 @@ def create_product(user_data):
         product_data['product_id'] = str(uuid.uuid4())  # Generate a unique product_id
         product_data['user_id'] = user_id  # Associate product with the user
         product_data['reserved_quantity'] = 0
+        product_data['change_seq'] = next_change_seq(user_id)
+        product_data.update(stock_fields(product_data))
         
         # Insert the product into the database
         insert_result = products_db.insert_one(product_data)
+        catalog_changed(user_id)
+        if 'id' in product_data:
+            search_index.product_written(user_id, product_data['id'], product_data.get('name'), bump_version(user_id, PRODUCT_NAMES))
         
         print('Product created with ID:', product_data['product_id'], "user ID", user_id)  # Debug statement
         log_action(user_id, "create_product", product_data)
@@ -170,7 +403,12 @@ def update_product(user_data, product_id):
         
         if '_id' in product_data:
             del product_data['_id']
-        products_db.update_one({"id": int(product_id)}, {"$set": product_data})
+        product_data['change_seq'] = next_change_seq(user_id)
+        # available / reorder_gap follow a new quantity or threshold
+        set_product_fields({"id": int(product_id), "user_id": user_id}, product_data)
+        catalog_changed(user_id)
+        if 'name' in product_data:
+            search_index.product_written(user_id, int(product_id), product_data['name'], bump_version(user_id, PRODUCT_NAMES))
         print(f'Product with ID {product_id} updated')  # Debug statement
         log_action(user_id, "update_product", product_data)
         return jsonify({"message": "Product updated successfully"}), 200
@@ -192,7 +430,17 @@ def delete_product(user_data, product_id):
             log_action(user_id, "delete_product_unauthorized", {"product_id": product_id})
             return jsonify({"message": "Unauthorized to delete this product"}), 403
 
-        products_db.delete_one({"id": int(product_id)})
+        change_seq = next_change_seq(user_id)
+        products_db.delete_one({"id": int(product_id), "user_id": user_id})
+        # Terminals syncing deltas learn about the deletion from the tombstone
+        product_tombstones_db.insert_one({
+            "user_id": user_id,
+            "id": int(product_id),
+            "change_seq": change_seq,
+            "deleted_at": datetime.utcnow()
+        })
+        catalog_changed(user_id)
+        search_index.product_removed(user_id, int(product_id), bump_version(user_id, PRODUCT_NAMES))
         print(f'Product with ID {product_id} deleted')  # Debug statement
         log_action(user_id, "delete_product", {"product_id": product_id})
         return jsonify({"message": "Product deleted successfully"}), 200
@@ -209,23 +457,23 @@ def increase_product_quantity(user_data, product_id):
         user_id = user_data.get('user_id')
         if not user_id:
             return jsonify({"message": "User ID is required"}), 400
-        
-        if not check_ownership(user_id, product_id):
-            log_action(user_id, "increase_product_quantity_unauthorized", {"product_id": product_id})
-            return jsonify({"message": "Unauthorized to modify this product"}), 403
 
         data = request.json
         amount = data.get('amount', 0)
         print(f'Increase amount: {amount} for product ID {product_id}')  # Debug statement
 
-        product = products_db.find_one({"id": int(product_id)})
-        
+        # The ownership check is part of the update filter, so the common
+        # case is a single round trip.
+        product = apply_change(user_id, stock_change(product_id, quantity=amount), projection={"quantity": 1})
+
         if product:
-            new_quantity = product.get('quantity', 0) + amount
-            products_db.update_one({"product_id": product_id}, {"$set": {"quantity": new_quantity}})
+            new_quantity = product['quantity']
             print(f'Product quantity increased to {new_quantity} for product ID {product_id}')  # Debug statement
             log_action(user_id, "increase_product_quantity", {"product_id": product_id, "new_quantity": new_quantity})
             return jsonify({"message": "Product quantity increased", "new_quantity": new_quantity}), 200
+        elif products_db.find_one({"id": int(product_id)}, {"_id": 1}):
+            log_action(user_id, "increase_product_quantity_unauthorized", {"product_id": product_id})
+            return jsonify({"message": "Unauthorized to modify this product"}), 403
         else:
             print(f'Product with ID {product_id} not found')  # Debug statement
             return jsonify({"message": "Product not found"}), 404
@@ -242,32 +490,31 @@ def decrease_product_quantity(user_data, product_id):
         user_id = user_data.get('user_id')
         if not user_id:
             return jsonify({"message": "User ID is required"}), 400
-        
-        if not check_ownership(user_id, product_id):
-            log_action(user_id, "decrease_product_quantity_unauthorized", {"product_id": product_id})
-            return jsonify({"message": "Unauthorized to modify this product"}), 403
 
         data = request.json
         amount = data.get('amount', 0)
         print(f'Decrease amount: {amount} for product ID {product_id}')  # Debug statement
-        
-        product = products_db.find_one({"product_id": product_id})
-        
+
+        # Ownership and stock are checked by the update filter; only a refused
+        # update needs a second read to say why.
+        product = apply_change(user_id, stock_change(product_id, quantity=-amount, check=CHECK_STOCK), projection={"quantity": 1})
+
         if product:
-            current_quantity = product.get('quantity', 0)
-            if current_quantity < amount:
-                print(f'Insufficient stock for product ID {product_id}')  # Debug statement
-                return jsonify({"message": "Insufficient stock"}), 400
-            
-            new_quantity = current_quantity - amount
-            products_db.update_one({"id": int(product_id)}, {"$set": {"quantity": new_quantity}})
+            new_quantity = product['quantity']
             print(f'Product quantity decreased to {new_quantity} for product ID {product_id}')  # Debug statement
             log_action(user_id, "decrease_product_quantity", {"product_id": product_id, "new_quantity": new_quantity})
             return jsonify({"message": "Product quantity decreased", "new_quantity": new_quantity}), 200
-        else:
+
+        existing = products_db.find_one({"id": int(product_id)}, {"user_id": 1})
+        if not existing:
             print(f'Product with ID {product_id} not found')  # Debug statement
             return jsonify({"message": "Product not found"}), 404
+        if existing.get('user_id') != user_id:
+            log_action(user_id, "decrease_product_quantity_unauthorized", {"product_id": product_id})
+            return jsonify({"message": "Unauthorized to modify this product"}), 403
+        print(f'Insufficient stock for product ID {product_id}')  # Debug statement
+        return jsonify({"message": "Insufficient stock"}), 400
     except Exception as e:
         print(f'Error decreasing quantity for product ID {product_id}:', str(e))  # Debug statement
         log_action(user_id, "decrease_product_quantity_error", {"error": str(e)})
-        return jsonify({"message": "Error decreasing product quantity"}), 500
\ No newline at end of file
+        return jsonify({"message": "Error decreasing product quantity"}), 500
@@ -0,0 +1,167 @@
+import bisect
+import difflib
+import re
+import threading
+from collections import OrderedDict
+from database.db import products_db, primary
+from database.versions import current_version, PRODUCT_NAMES
+
+_products = primary(products_db)
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+# Utility function to split a product name or a query into lowercase words
+def tokenize(text):
+    if not isinstance(text, str):
+        text = '' if text is None else str(text)
+    return _TOKEN_RE.findall(text.casefold())
+
+
+class _TenantIndex:
+    __slots__ = ('version', 'entries', 'names', 'vocabulary', 'lock')
+
+    def __init__(self, version):
+        self.version = version
+        self.lock = threading.Lock()
+        self.entries = []      # sorted (token, product_id) pairs, searched with bisect
+        self.names = {}        # product_id -> casefolded name
+        self.vocabulary = {}   # token -> number of products using it, for fuzzy matching
+
+    def add(self, product_id, name):
+        self.remove(product_id)
+        name = '' if name is None else str(name)
+        self.names[product_id] = name.casefold()
+        for token in set(tokenize(name)):
+            bisect.insort(self.entries, (token, product_id))
+            self.vocabulary[token] = self.vocabulary.get(token, 0) + 1
+
+    def remove(self, product_id):
+        name = self.names.pop(product_id, None)
+        if name is None:
+            return
+        for token in set(tokenize(name)):
+            position = bisect.bisect_left(self.entries, (token, product_id))
+            if position < len(self.entries) and self.entries[position] == (token, product_id):
+                del self.entries[position]
+            self.vocabulary[token] -= 1
+            if not self.vocabulary[token]:
+                del self.vocabulary[token]
+
+    def prefix_ids(self, prefix):
+        ids = set()
+        position = bisect.bisect_left(self.entries, (prefix,))
+        while position < len(self.entries) and self.entries[position][0].startswith(prefix):
+            ids.add(self.entries[position][1])
+            position += 1
+        return ids
+
+    def exact_ids(self, token):
+        ids = set()
+        position = bisect.bisect_left(self.entries, (token,))
+        while position < len(self.entries) and self.entries[position][0] == token:
+            ids.add(self.entries[position][1])
+            position += 1
+        return ids
+
+
+class ProductSearchIndex:
+    """Per-tenant in-memory word index over product names.
+
+    Each tenant's index records the PRODUCT_NAMES version it reflects. Writes
+    in this process update it in place; a version moved by another worker
+    makes the next search rebuild it from one projected query. Tenants are
+    evicted least recently used first.
+    """
+
+    def __init__(self, max_tenants=200, fuzzy_cutoff=0.75):
+        self.max_tenants = max_tenants
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"builds": 0, "updates": 0, "searches": 0}
+
+    def _build(self, user_id, version):
+        index = _TenantIndex(version)
+        for product in _products.find({"user_id": user_id, "id": {"$exists": True}}, {"_id": 0, "id": 1, "name": 1}):
+            index.add(product["id"], product.get("name"))
+        return index
+
+    def _index(self, user_id):
+        version = current_version(user_id, PRODUCT_NAMES)
+        with self._lock:
+            index = self._tenants.get(user_id)
+            if index is not None and index.version == version:
+                self._tenants.move_to_end(user_id)
+                return index
+        # Built outside the lock; the version was read first, so a write that
+        # lands during the build bumps past it and forces another rebuild.
+        index = self._build(user_id, version)
+        with self._lock:
+            self._counters["builds"] += 1
+            current = self._tenants.get(user_id)
+            if current is None or current.version <= version:
+                self._tenants[user_id] = index
+                self._tenants.move_to_end(user_id)
+                while len(self._tenants) > self.max_tenants:
+                    self._tenants.popitem(last=False)
+        return index
+
+    def _apply(self, user_id, version, change):
+        # Only an index exactly one version behind can be patched; otherwise it
+        # missed a write from another worker and is dropped for a rebuild.
+        with self._lock:
+            index = self._tenants.get(user_id)
+            if index is None:
+                return
+            if index.version != version - 1:
+                del self._tenants[user_id]
+                return
+            self._counters["updates"] += 1
+        with index.lock:
+            change(index)
+            index.version = version
+
+    # Record a created or renamed product; version is the bumped PRODUCT_NAMES version
+    def product_written(self, user_id, product_id, name, version):
+        self._apply(user_id, version, lambda index: index.add(product_id, name))
+
+    def product_removed(self, user_id, product_id, version):
+        self._apply(user_id, version, lambda index: index.remove(product_id))
+
+    # Product ids whose names match every word of the query, best first. Words
+    # match by prefix; with fuzzy set, close misspellings fill up the results.
+    def search(self, user_id, query, limit=20, fuzzy=True):
+        words = tokenize(query)
+        if not words:
+            return []
+        index = self._index(user_id)
+        with self._lock:
+            self._counters["searches"] += 1
+        with index.lock:
+            matched = None
+            for word in words:
+                ids = index.prefix_ids(word)
+                matched = ids if matched is None else matched & ids
+            ranked = self._rank(index, matched, query)
+
+            if fuzzy and len(ranked) < limit:
+                fuzzy_matched = None
+                for word in words:
+                    ids = index.prefix_ids(word)
+                    for close in difflib.get_close_matches(word, index.vocabulary.keys(), n=5, cutoff=self.fuzzy_cutoff):
+                        ids |= index.exact_ids(close)
+                    fuzzy_matched = ids if fuzzy_matched is None else fuzzy_matched & ids
+                ranked += self._rank(index, fuzzy_matched - matched, query)
+        return ranked[:limit]
+
+    def _rank(self, index, ids, query):
+        query = query.casefold().strip()
+        # Names starting with the query first, then shorter names, then alphabetical
+        return sorted(ids, key=lambda product_id: (not index.names[product_id].startswith(query), len(index.names[product_id]), index.names[product_id]))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["tenants"] = len(self._tenants)
+        return stats
@@ -1,16 +1,20 @@
 from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from bson.objectid import ObjectId
 from auth.utils import login_required
-import threading
 from config import Config
-from database.db import profile_db, transactions_db, products_db, orders_db, settings_db, pending_transactions_db, sessions_db
-
-# Lock to handle MongoDB operations safely in a multi-threaded environment
-db_lock = threading.Lock()
+from database.db import profile_db, transactions_db, products_db, orders_db, settings_db, pending_transactions_db, sessions_db, primary
+from database.versions import conditional_get, bump_version, PROFILE, SETTINGS
+from database.locks import resource_lock
+from database.idempotency import idempotent
+from database.pagination import list_documents
+from profile.sessions import session_summary
 
 profile_bp = Blueprint('profile', __name__)
 
+# Shift figures clients used to submit when ending a session; now only recorded for comparison
+CLIENT_SESSION_FIGURES = ('transactions', 'total_sales', 'total_refunds', 'net_sales', 'expected_cash', 'discrepancy')
+
 # Utility function to check if the user owns the profile/settings/pending transactions
 def check_ownership(user_id, data):
     return data.get('user_id') == user_id
@@ -22,12 +26,16 @@ def get_profile(user_data):
     print('GET /profile called')  # Debug statement
     try:
         user_id = user_data.get('user_id')
-        with db_lock:
-            profile = profile_db.find_one({"user_id": user_id})
+        etag, _, not_modified = conditional_get(user_id, PROFILE)
+        if not_modified:
+            return not_modified
+        profile = primary(profile_db).find_one({"user_id": user_id})
         if profile:
             profile['_id'] = str(profile['_id'])  # Convert ObjectId to string
             print('Profile data retrieved:', profile)  # Debug statement
-            return jsonify(profile)
+            response = jsonify(profile)
+            response.set_etag(etag)
+            return response
         else:
             print('No profile found')  # Debug statement
             return jsonify({"message": "No profile found"}), 404
@@ -44,8 +52,8 @@ def update_profile(user_data):
         profile_data = request.json
         profile_data['user_id'] = user_id  # Associate profile with the user
         print('Profile data received:', profile_data)  # Debug statement
-        with db_lock:
-            profile_db.update_one({"user_id": user_id}, {"$set": profile_data}, upsert=True)
+        profile_db.update_one({"user_id": user_id}, {"$set": profile_data}, upsert=True)
+        bump_version(user_id, PROFILE)
         print('Profile updated successfully')  # Debug statement
         return jsonify({"message": "Profile updated successfully"}), 200
     except Exception as e:
@@ -59,12 +67,16 @@ def get_settings(user_data):
     print('GET /settings called')  # Debug statement
     try:
         user_id = user_data.get('user_id')
-        with db_lock:
-            settings = settings_db.find_one({"user_id": user_id})
+        etag, _, not_modified = conditional_get(user_id, SETTINGS)
+        if not_modified:
+            return not_modified
+        settings = primary(settings_db).find_one({"user_id": user_id})
         if settings:
             settings['_id'] = str(settings['_id'])  # Convert ObjectId to string
             print('Settings data retrieved:', settings)  # Debug statement
-            return jsonify(settings)
+            response = jsonify(settings)
+            response.set_etag(etag)
+            return response
         else:
             # Define the default settings
             default_settings = {
@@ -75,7 +87,9 @@ def get_settings(user_data):
                 "paymentEftposEnabled": False,
             }
             print('No settings found, returning default settings:', default_settings)  # Debug statement
-            return jsonify(default_settings)
+            response = jsonify(default_settings)
+            response.set_etag(etag)
+            return response
     except Exception as e:
         print('Error retrieving settings:', str(e))  # Debug statement
         return jsonify({"message": "Error retrieving settings"}), 500
@@ -92,8 +106,8 @@ def update_settings(user_data):
 
         if '_id' in settings_data:
             del settings_data['_id']
-        with db_lock:
-            settings_db.update_one({"user_id": user_id}, {"$set": settings_data}, upsert=True)
+        settings_db.update_one({"user_id": user_id}, {"$set": settings_data}, upsert=True)
+        bump_version(user_id, SETTINGS)
         print('Settings updated successfully')  # Debug statement
         return jsonify({"message": "Settings updated successfully"}), 200
     except Exception as e:
@@ -107,18 +121,16 @@ def get_pending_transactions(user_data):
     print('GET /pendingTransactions called')  # Debug statement
     try:
         user_id = user_data.get('user_id')
-        with db_lock:
-            pending_transactions = list(pending_transactions_db.find({"user_id": user_id}))
-        for transaction in pending_transactions:
-            transaction['_id'] = str(transaction['_id'])  # Convert ObjectId to string
-        print('Pending transactions retrieved:', pending_transactions)  # Debug statement
-        return jsonify(pending_transactions), 200
+        response, transaction_count = list_documents(pending_transactions_db, {"user_id": user_id})
+        print('Pending transactions retrieved:', transaction_count)  # Debug statement
+        return response
     except Exception as e:
         print('Error retrieving pending transactions:', str(e))  # Debug statement
         return jsonify({"message": "Error retrieving pending transactions"}), 500
 
 @profile_bp.route('/pendingTransactions', methods=['POST'], endpoint='add_pending_transaction')
 @login_required
+@idempotent('add_pending_transaction')
 def add_pending_transaction(user_data):
     print('POST /pendingTransactions called')  # Debug statement
     try:
@@ -126,9 +138,8 @@ def add_pending_transaction(user_data):
         transaction_data = request.json
         transaction_data['user_id'] = user_id  # Associate transaction with the user
         print('Pending transaction data received:', transaction_data)  # Debug statement
-        with db_lock:
-            result = pending_transactions_db.insert_one(transaction_data)
-            transaction_data['_id'] = str(result.inserted_id)
+        result = pending_transactions_db.insert_one(transaction_data)
+        transaction_data['_id'] = str(result.inserted_id)
         print('Pending transaction added successfully')  # Debug statement
         return jsonify(transaction_data), 200
     except Exception as e:
@@ -141,13 +152,10 @@ def delete_pending_transaction(user_data, transaction_id):
     print(f'DELETE /pendingTransactions/{transaction_id} called')  # Debug statement
     try:
         user_id = user_data.get('user_id')
-        with db_lock:
-            transaction = pending_transactions_db.find_one({"_id": ObjectId(transaction_id)})
-            print(transaction)
-        
-        if transaction and transaction.get('user_id') == user_id:
-            with db_lock:
-                pending_transactions_db.delete_one({"id": int(transaction_id)})
+        # Ownership is part of the delete filter, so this is one atomic operation
+        result = pending_transactions_db.delete_one({"_id": ObjectId(transaction_id), "user_id": user_id})
+
+        if result.deleted_count:
             print(f'Pending transaction with ID {transaction_id} deleted')  # Debug statement
             return jsonify({"message": "Pending transaction deleted successfully"}), 200
         else:
@@ -159,6 +167,7 @@ def delete_pending_transaction(user_data, transaction_id):
 # Save or update a pending transaction
 @profile_bp.route('/pendingTransactions/save', methods=['POST'], endpoint='save_pending_transaction')
 @login_required
+@idempotent('save_pending_transaction')
 def save_pending_transaction(user_data):
     print('POST /pendingTransactions/save called')  # Debug statement
     try:
@@ -167,23 +176,21 @@ def save_pending_transaction(user_data):
         transaction_data['user_id'] = user_id  # Associate transaction with the user
         print('Pending transaction data received:', transaction_data)  # Debug statement
         
-        with db_lock:
+        with resource_lock('pending_transaction', transaction_data.get('id')):
             existing_transaction = pending_transactions_db.find_one({"_id": ObjectId(transaction_data.get('id'))})
 
-        if existing_transaction:
-            with db_lock:
+            if existing_transaction:
                 pending_transactions_db.update_one(
                     {"_id": ObjectId(transaction_data.get('id'))},
                     {"$set": transaction_data}
                 )
-            print('Pending transaction updated successfully')  # Debug statement
-            return jsonify({"message": "Pending transaction updated successfully"}), 200
-        else:
-            with db_lock:
+                print('Pending transaction updated successfully')  # Debug statement
+                return jsonify({"message": "Pending transaction updated successfully"}), 200
+            else:
                 result = pending_transactions_db.insert_one(transaction_data)
                 transaction_data['_id'] = str(result.inserted_id)
-            print('Pending transaction added successfully')  # Debug statement
-            return jsonify(transaction_data), 201
+                print('Pending transaction added successfully')  # Debug statement
+                return jsonify(transaction_data), 201
         
     except Exception as e:
         print('Error saving pending transaction:', str(e))  # Debug statement
@@ -202,7 +209,7 @@ def start_session(user_data):
         session_data['cashier_name'] = session_data.get('cashier_name')
         session_data['status'] = 'active'
 
-        with db_lock:
+        with resource_lock('session', session_data['user_id']):
             # End any active session for the user before starting a new one
             sessions_db.update_many({"user_id": session_data['user_id'], "status": "active"}, {"$set": {"status": "ended"}})
             result = sessions_db.insert_one(session_data)
@@ -218,11 +225,11 @@ def start_session(user_data):
 def load_current_session(user_data):
     try:
         user_id = user_data.get('user_id')
-        with db_lock:
-            session = sessions_db.find_one({"user_id": user_id, "status": "active"})
-        
+        session = sessions_db.find_one({"user_id": user_id, "status": "active"})
+
         if session:
             session['_id'] = str(session['_id'])
+            session.update(session_summary(session))
             return jsonify(session), 200
         else:
             return jsonify({"message": "No active session found"}), 404
@@ -235,12 +242,8 @@ def load_current_session(user_data):
 def load_previous_sessions(user_data):
     try:
         user_id = user_data.get('user_id')
-        with db_lock:
-            sessions = list(sessions_db.find({"user_id": user_id, "status": "ended"}))
-            for session in sessions:
-                session['_id'] = str(session['_id'])
-        
-        return jsonify(sessions), 200
+        response, _ = list_documents(sessions_db, {"user_id": user_id, "status": "ended"})
+        return response
     except Exception as e:
         return jsonify({"message": f"Error loading previous sessions: {str(e)}"}), 500
 
@@ -253,25 +256,26 @@ def end_session(user_data):
         user_id = user_data.get('user_id')
         final_cash = session_data.get('final_cash')
         
-        with db_lock:
-            session = sessions_db.find_one({"user_id": user_id, "status": "active"})
-            if session:
-                sessions_db.update_one(
-                    {"_id": session["_id"]},
-                    {"$set": {
-                        "end_time": session_data.get('end_time'),
-                        "final_cash": final_cash,
-                        "status": "ended",
-                        "transactions": session_data.get('transactions'),
-                        "total_sales": session_data.get('total_sales'),
-                        "total_refunds": session_data.get('total_refunds'),
-                        "net_sales": session_data.get('net_sales'),
-                        "expected_cash": session_data.get('expected_cash'),
-                        "discrepancy": session_data.get('discrepancy'),
-                    }}
-                )
-                return jsonify({"message": "Session ended successfully"}), 200
-            else:
-                return jsonify({"message": "No active session found to end"}), 404
+        # Closing is a single conditional update, so two terminals ending the
+        # same shift cannot both succeed. Sales only add to an active session,
+        # so the counters read back here are final.
+        session = sessions_db.find_one_and_update(
+            {"user_id": user_id, "status": "active"},
+            {"$set": {
+                "end_time": session_data.get('end_time'),
+                "final_cash": final_cash,
+                "status": "ended",
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if session:
+            # The figures come from the server-held counters; what the client
+            # worked out is kept alongside for reconciliation.
+            summary = session_summary(session)
+            reported = {name: session_data[name] for name in CLIENT_SESSION_FIGURES if session_data.get(name) is not None}
+            sessions_db.update_one({"_id": session['_id']}, {"$set": dict(summary, client_reported=reported)})
+            return jsonify({"message": "Session ended successfully", **summary}), 200
+        else:
+            return jsonify({"message": "No active session found to end"}), 404
     except Exception as e:
         return jsonify({"message": f"Error ending session: {str(e)}"}), 500
\ No newline at end of file
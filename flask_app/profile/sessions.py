@@ -0,0 +1,90 @@
+import datetime
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from database.db import sessions_db, primary
+from reports.rollups import transaction_figures
+
+# Running counters kept on the active session document. Every sale and refund
+# adds to them with $inc, so the shift totals are always current and several
+# terminals can sell into the same session.
+SESSION_COUNTERS = (
+    'transaction_count',
+    'sales_count', 'sales_total', 'sales_items',
+    'refund_count', 'refund_total', 'refund_items',
+    'cash_sales_total', 'cash_refund_total',
+)
+
+
+def _number(value):
+    try:
+        return float(value) if value not in (None, '') else 0
+    except (TypeError, ValueError):
+        return 0
+
+# Utility function to tell whether a transaction moved cash through the till.
+# Transactions without a payment method are taken as cash, except online sales.
+def is_cash(transaction):
+    method = transaction.get('paymentMethod') or transaction.get('payment_method')
+    if method:
+        return str(method).lower() == 'cash'
+    return transaction.get('txn_type') != 'online sale'
+
+# Utility function to find the id of the user's active session, if any
+def active_session_id(user_id):
+    session = primary(sessions_db).find_one({"user_id": user_id, "status": "active"}, {"_id": 1})
+    return str(session['_id']) if session else None
+
+def _increments(transactions, sign):
+    increments = {}
+    for transaction in transactions:
+        figures = transaction_figures(transaction)
+        if not figures:
+            continue
+        prefix = figures["prefix"]
+        for name, value in (
+            ('transaction_count', 1),
+            (f"{prefix}_count", 1),
+            (f"{prefix}_total", figures["amount"]),
+            (f"{prefix}_items", figures["items"]),
+        ):
+            increments[name] = increments.get(name, 0) + sign * value
+        if is_cash(transaction):
+            name = f"cash_{prefix}_total"
+            increments[name] = increments.get(name, 0) + sign * figures["amount"]
+    return increments
+
+# Add (sign=1) or remove (sign=-1) transactions from the counters of the
+# session they were made in. Only an active session changes; once a shift is
+# closed its figures are final. Failures are logged, never raised.
+def record_session_transactions(session_id, transactions, sign=1):
+    if not session_id:
+        return
+    try:
+        increments = _increments(transactions, sign)
+        if increments:
+            sessions_db.update_one(
+                {"_id": ObjectId(session_id), "status": "active"},
+                {"$inc": increments, "$set": {"last_transaction_at": datetime.datetime.utcnow()}}
+            )
+    except (InvalidId, TypeError) as e:
+        print(f"Invalid session id {session_id}: {str(e)}")  # Debug statement
+    except Exception as e:
+        print(f"Error updating session totals: {str(e)}")  # Debug statement
+
+# An edited transaction moves its session from the old figures to the new ones
+def record_session_change(before, after):
+    record_session_transactions(before.get('session_id'), [before], -1)
+    record_session_transactions(after.get('session_id'), [after], 1)
+
+# Figures derived from a session's counters
+def session_summary(session):
+    counters = {name: session.get(name, 0) for name in SESSION_COUNTERS}
+    expected_cash = _number(session.get('initial_cash')) + counters['cash_sales_total'] - counters['cash_refund_total']
+    summary = dict(counters)
+    summary['total_sales'] = counters['sales_total']
+    summary['total_refunds'] = counters['refund_total']
+    summary['net_sales'] = counters['sales_total'] - counters['refund_total']
+    summary['expected_cash'] = expected_cash
+    if session.get('final_cash') not in (None, ''):
+        summary['discrepancy'] = _number(session['final_cash']) - expected_cash
+    return summary
@@ -0,0 +1,150 @@
+import datetime
+import click
+from flask.cli import AppGroup
+from pymongo import UpdateOne
+from database.db import sales_rollups_db, transactions_db
+from database.dates import date_timestamp
+
+# Rollup kinds kept in sales_rollups
+HOUR = 'hour'
+DAY = 'day'
+PRODUCT_DAY = 'product_day'
+
+SALE_TYPES = ('sale', 'online sale')
+REFUND_TYPES = ('refund',)
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+# Utility function to pick the moment a transaction is counted at: its parsed
+# business date, else when the server accepted it, else its raw client date.
+def transaction_time(transaction):
+    for field in ('date_ts', 'created_at'):
+        if isinstance(transaction.get(field), datetime.datetime):
+            return transaction[field]
+    return date_timestamp(transaction.get('date'), datetime.datetime.utcnow())
+
+def _line_amount(item):
+    if 'total' in item:
+        return _number(item['total'])
+    return _number(item.get('price')) * _number(item.get('quantity'))
+
+# Utility function to work out what a transaction adds to the rollups
+def transaction_figures(transaction):
+    txn_type = transaction.get('txn_type')
+    if txn_type in SALE_TYPES:
+        prefix = 'sales'
+    elif txn_type in REFUND_TYPES:
+        prefix = 'refund'
+    else:
+        return None
+    cart = transaction.get('cart') or []
+    total = transaction.get('total')
+    amount = abs(_number(total)) if total is not None else abs(sum(_line_amount(item) for item in cart))
+    lines = {}
+    for item in cart:
+        if 'id' not in item:
+            continue
+        product_id = str(item['id'])
+        line = lines.setdefault(product_id, {"name": item.get('name'), "quantity": 0, "amount": 0})
+        line["quantity"] += abs(_number(item.get('quantity')))
+        line["amount"] += abs(_line_amount(item))
+    return {"prefix": prefix, "amount": amount, "items": sum(line["quantity"] for line in lines.values()), "lines": lines}
+
+def _bucket_updates(user_id, at, figures, sign):
+    prefix = figures["prefix"]
+    totals = {
+        f"{prefix}_count": sign,
+        f"{prefix}_total": sign * figures["amount"],
+        f"{prefix}_items": sign * figures["items"],
+    }
+    hour = at.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    updates = []
+    for kind, bucket, key in ((HOUR, hour, hour.strftime('%Y-%m-%dT%H')), (DAY, day, day.strftime('%Y-%m-%d'))):
+        updates.append(UpdateOne(
+            {"_id": f"{user_id}:{kind}:{key}"},
+            {"$inc": totals, "$setOnInsert": {"user_id": user_id, "kind": kind, "bucket": bucket}},
+            upsert=True
+        ))
+    for product_id, line in figures["lines"].items():
+        update = {
+            "$inc": {f"{prefix}_quantity": sign * line["quantity"], f"{prefix}_total": sign * line["amount"]},
+            "$setOnInsert": {"user_id": user_id, "kind": PRODUCT_DAY, "bucket": day, "product_id": product_id},
+        }
+        if line["name"]:
+            update["$set"] = {"name": line["name"]}
+        updates.append(UpdateOne({"_id": f"{user_id}:{PRODUCT_DAY}:{day.strftime('%Y-%m-%d')}:{product_id}"}, update, upsert=True))
+    return updates
+
+# Add (sign=1) or remove (sign=-1) transactions from the hourly, daily and
+# per-product daily rollups with one unordered bulk of $inc upserts.
+def record_transactions(transactions, sign=1):
+    updates = []
+    for transaction in transactions:
+        figures = transaction_figures(transaction)
+        if figures and transaction.get('user_id'):
+            updates += _bucket_updates(transaction['user_id'], transaction_time(transaction), figures, sign)
+    if updates:
+        sales_rollups_db.bulk_write(updates, ordered=False)
+
+# Rollups follow sales; a failure is logged rather than failing the sale.
+# `flask reports rebuild` repairs any drift.
+def record_transaction(transaction, sign=1):
+    try:
+        record_transactions([transaction], sign)
+    except Exception as e:
+        print(f"Error updating sales rollups: {str(e)}")  # Debug statement
+
+# Rollups for a batch of new transactions, in one bulk write
+def record_transaction_batch(transactions):
+    try:
+        record_transactions(transactions)
+    except Exception as e:
+        print(f"Error updating sales rollups: {str(e)}")  # Debug statement
+
+# An edited transaction moves from its old figures to its new ones
+def record_transaction_change(before, after):
+    try:
+        record_transactions([before], -1)
+        record_transactions([after], 1)
+    except Exception as e:
+        print(f"Error updating sales rollups: {str(e)}")  # Debug statement
+
+# Recompute a tenant's rollups (or everyone's) from the raw transactions
+def rebuild_rollups(user_id=None, batch_size=1000):
+    query = {"user_id": user_id} if user_id else {}
+    sales_rollups_db.delete_many(query)
+    count = 0
+    batch = []
+    for transaction in transactions_db.find(query).batch_size(batch_size):
+        batch.append(transaction)
+        if len(batch) >= batch_size:
+            record_transactions(batch)
+            count += len(batch)
+            batch = []
+    record_transactions(batch)
+    return count + len(batch)
+
+# Rebuild every tenant's rollups one tenant at a time, so only one tenant's
+# reports are briefly incomplete while its buckets are recomputed
+def rebuild_all_rollups(batch_size=1000):
+    return sum(rebuild_rollups(user_id, batch_size) for user_id in transactions_db.distinct('user_id') if user_id)
+
+
+reports_cli = AppGroup('reports', help="Sales rollup maintenance.")
+
+@reports_cli.command('rebuild')
+@click.option('--user-id', default=None, help="Only this tenant.")
+def rebuild_command(user_id):
+    """Recompute sales rollups from the transactions."""
+    count = rebuild_rollups(user_id) if user_id else rebuild_all_rollups()
+    click.echo(f"Rebuilt rollups from {count} transactions.")
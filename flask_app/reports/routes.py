@@ -0,0 +1,132 @@
+import datetime
+from flask import Blueprint, request, jsonify
+from auth.utils import login_required
+from config import Config
+from database.db import sales_rollups_db
+from database.dates import parse_iso, is_date_only, DateParseError
+from reports.rollups import HOUR, DAY, PRODUCT_DAY
+
+reports_bp = Blueprint('reports', __name__)
+
+COUNTERS = ('sales_count', 'sales_total', 'sales_items', 'refund_count', 'refund_total', 'refund_items')
+
+
+class ReportError(ValueError):
+    pass
+
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else 0
+
+# Utility function to add the derived figures to a set of counters
+def _summarise(counters):
+    summary = {name: counters.get(name, 0) for name in COUNTERS}
+    summary['net_total'] = summary['sales_total'] - summary['refund_total']
+    summary['refund_rate'] = _rate(summary['refund_total'], summary['sales_total'])
+    summary['refund_count_rate'] = _rate(summary['refund_count'], summary['sales_count'])
+    return summary
+
+# Utility function to read the report range. from/to are local times in the
+# tenant's tz_offset (minutes east of UTC); a date-only `to` includes that day.
+# Returns (start, end, offset) with start/end as UTC and end exclusive.
+def report_range(args):
+    try:
+        offset = datetime.timedelta(minutes=int(args.get('tz_offset', 0)))
+    except ValueError:
+        raise ReportError("tz_offset must be a whole number of minutes")
+    now = datetime.datetime.utcnow() + offset
+    try:
+        start = parse_iso(args['from'], 'from') if args.get('from') else now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if args.get('to'):
+            end = parse_iso(args['to'], 'to')
+            if is_date_only(args['to']):
+                end += datetime.timedelta(days=1)
+        else:
+            end = start + datetime.timedelta(days=1)
+    except DateParseError as e:
+        raise ReportError(str(e))
+    if end <= start:
+        raise ReportError("to must be after from")
+    if end - start > datetime.timedelta(days=Config.REPORT_MAX_DAYS):
+        raise ReportError(f"A report may cover at most {Config.REPORT_MAX_DAYS} days")
+    return start - offset, end - offset, offset
+
+def _bucket_docs(user_id, kind, start, end):
+    return sales_rollups_db.find(
+        {"user_id": user_id, "kind": kind, "bucket": {"$gte": start, "$lt": end}},
+        {"_id": 0, "bucket": 1, **{name: 1 for name in COUNTERS}}
+    ).sort('bucket', 1)
+
+# Sum rollup buckets into report buckets. Day buckets are only usable when the
+# range and offset fall on UTC midnights; otherwise local days are built from
+# hourly buckets, so the cost is one document per hour at most.
+def report_buckets(user_id, start, end, offset, granularity):
+    whole_days = offset.total_seconds() % 86400 == 0 and start.hour == 0 and end.hour == 0 \
+        and start.minute == 0 and end.minute == 0
+    kind = DAY if granularity == DAY and whole_days else HOUR
+    buckets = {}
+    for doc in _bucket_docs(user_id, kind, start, end):
+        local = doc['bucket'] + offset
+        if granularity == DAY:
+            local = local.replace(hour=0)
+        bucket = buckets.setdefault(local, dict.fromkeys(COUNTERS, 0))
+        for name in COUNTERS:
+            bucket[name] += doc.get(name, 0)
+    return [dict(_summarise(counters), bucket=local.isoformat()) for local, counters in sorted(buckets.items())]
+
+# Top sellers come from the per-product daily rollups, which are kept per UTC
+# day; with a tz_offset the product figures cover the UTC days the range touches.
+def top_products(user_id, start, end, limit):
+    first_day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = sales_rollups_db.aggregate([
+        {"$match": {"user_id": user_id, "kind": PRODUCT_DAY, "bucket": {"$gte": first_day, "$lt": end}}},
+        {"$group": {
+            "_id": "$product_id",
+            "name": {"$last": "$name"},
+            "quantity_sold": {"$sum": "$sales_quantity"},
+            "sales_total": {"$sum": "$sales_total"},
+            "quantity_refunded": {"$sum": "$refund_quantity"},
+            "refund_total": {"$sum": "$refund_total"},
+        }},
+        {"$sort": {"quantity_sold": -1, "sales_total": -1}},
+        {"$limit": limit},
+    ])
+    products = []
+    for row in rows:
+        row['product_id'] = row.pop('_id')
+        row['refund_rate'] = _rate(row['quantity_refunded'], row['quantity_sold'])
+        products.append(row)
+    return products
+
+@reports_bp.route('/reports/sales', methods=['GET'])
+@login_required
+def sales_report(user_data):
+    print('GET /reports/sales called')  # Debug statement
+    try:
+        user_id = user_data.get('user_id')
+        granularity = request.args.get('granularity', DAY)
+        if granularity not in (DAY, HOUR):
+            return jsonify({"message": "granularity must be day or hour"}), 400
+        try:
+            start, end, offset = report_range(request.args)
+            limit = int(request.args.get('top', Config.REPORT_TOP_PRODUCTS))
+        except (ReportError, ValueError) as e:
+            return jsonify({"message": str(e)}), 400
+
+        buckets = report_buckets(user_id, start, end, offset, granularity)
+        totals = dict.fromkeys(COUNTERS, 0)
+        for bucket in buckets:
+            for name in COUNTERS:
+                totals[name] += bucket[name]
+        return jsonify({
+            "from": (start + offset).isoformat(),
+            "to": (end + offset).isoformat(),
+            "tz_offset": int(offset.total_seconds() // 60),
+            "granularity": granularity,
+            "totals": _summarise(totals),
+            "buckets": buckets,
+            "top_products": top_products(user_id, start, end, min(limit, Config.LIST_MAX_LIMIT)) if limit > 0 else [],
+        }), 200
+    except Exception as e:
+        print('Error building sales report:', str(e))  # Debug statement
+        return jsonify({"message": "Error building sales report"}), 500
@@ -1,29 +1,28 @@
 from flask import Blueprint, request, jsonify
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 from bson.objectid import ObjectId
 import uuid
 from auth.utils import login_required
-import threading
 from datetime import datetime
 from config import Config
-from database.db import profile_db, transactions_db, products_db, orders_db, settings_db, pending_transactions_db, logs_db
-
-# Lock to handle MongoDB operations safely in a multi-threaded environment
-db_lock = threading.Lock()
+from database.db import profile_db, transactions_db, products_db, orders_db, settings_db, pending_transactions_db
+from database.audit import log_action
+from database.pagination import list_documents
+from database.export import export_documents, ExportError
+from database.dates import date_range, timestamp_fields, date_timestamp, DateParseError
+from database.locks import locked_by
+from database.idempotency import idempotent
+from database.inventory import stock_change, inverse_change, apply_cart, apply_unchecked, apply_cart_checked, allocate_carts, cart_errors_response, cart_errors_status, CHECK_STOCK
+from reports.rollups import record_transaction, record_transaction_batch, record_transaction_change
+from profile.sessions import active_session_id, record_session_transactions, record_session_change
 
 transactions_bp = Blueprint('transactions', __name__)
 
-# Utility function to log actions
-def log_action(user_id, action, details):
-    log_entry = {
-        "user_id": user_id,
-        "action": action,
-        "details": details,
-        "timestamp": datetime.utcnow()
-    }
-    with db_lock:
-        logs_db.insert_one(log_entry)
-    print(f"Logged action: {action}, details: {details}")  # Debug statement
+# Per-transaction outcomes of a batch upload
+BATCH_CREATED = 'created'
+BATCH_DUPLICATE = 'duplicate'
+BATCH_REJECTED = 'rejected'
 
 # Utility function to check if the user owns the transaction
 def check_ownership(user_id, transaction_id):
@@ -32,46 +31,34 @@ def check_ownership(user_id, transaction_id):
     log_action(user_id, "check_ownership", {"transaction_id": transaction_id, "ownership": ownership})
     return ownership
 
-# Utility function to get a product by its ID
-def get_product_by_id(product_id):
-    product = products_db.find_one({"id": int(product_id)})
-    log_action(None, "get_product_by_id", {"product_id": product_id, "product": product})
-    return product
-
-# Utility function to update a product
-def update_product(product):
-    products_db.update_one({"id": int(product['id'])}, {"$set": product})
-    log_action(None, "update_product", {"product": product})
-
-# Utility function to adjust product quantity
-def adjust_product_quantity(product_id, quantity):
-    product = get_product_by_id(product_id)
-    if product:
-        new_quantity = product['quantity'] + quantity
-        products_db.update_one({"id": int(product_id)}, {"$set": {"quantity": new_quantity}})
-        log_action(None, "adjust_product_quantity", {"product_id": product_id, "adjustment": quantity, "new_quantity": new_quantity})
-    return product
-
-# Utility function to validate product availability
-def validate_product_availability(product_id, requested_quantity):
-    product = get_product_by_id(product_id)
-    if not product:
-        log_action(None, "validate_product_availability", {"product_id": product_id, "status": "Product not found"})
-        return False, "Product not found"
-    
-    available_quantity = product['quantity']
-    if requested_quantity > available_quantity:
-        log_action(None, "validate_product_availability", {"product_id": product_id, "status": "Not enough stock"})
-        return False, f"Not enough stock for {product['name']}. Available: {available_quantity}, Requested: {requested_quantity}"
-    
-    log_action(None, "validate_product_availability", {"product_id": product_id, "status": "Validated"})
-    return True, None
+# Utility function to build the stock changes for every line of a cart
+def cart_stock_changes(cart, sign, check=None):
+    return [stock_change(item['id'], quantity=sign * item['quantity'], check=check) for item in cart]
+
+# Utility function to build the stock changes a new transaction makes
+def transaction_stock_changes(transaction_data):
+    if transaction_data['txn_type'] == 'sale':
+        return cart_stock_changes(transaction_data['cart'], -1, check=CHECK_STOCK)
+    elif transaction_data['txn_type'] == 'refund':
+        return cart_stock_changes(transaction_data['cart'], 1)
+    return []
 
 # Rollback changes made to product quantities in case of failure
-def rollback_quantities(adjusted_items):
-    for item in adjusted_items:
-        adjust_product_quantity(item['id'], item['quantity'])
-    log_action(None, "rollback_quantities", {"adjusted_items": adjusted_items})
+def rollback_quantities(user_id, changes):
+    _, missing = apply_unchecked(user_id, [inverse_change(change) for change in changes])
+    log_action(user_id, "rollback_quantities", {"changes": changes, "missing_product_ids": missing})
+
+# Utility function to build the transaction query from the startDate, endDate and type parameters.
+# Dates are ISO 8601 and compared as datetimes on the indexed date_ts field.
+def transaction_filters(user_id, query_params):
+    filters = {"user_id": user_id}
+    txn_type = query_params.get('type')
+    if txn_type:
+        filters["txn_type"] = txn_type
+    date_ts = date_range(query_params)
+    if date_ts:
+        filters["date_ts"] = date_ts
+    return filters
 
 @transactions_bp.route('/transactions', methods=['GET'])
 @login_required
@@ -82,38 +69,42 @@ def get_transactions(user_data):
         query_params = request.args
         print('Query parameters:', query_params)  # Debug statement
 
-        start_date = query_params.get('startDate')
-        end_date = query_params.get('endDate')
-        txn_type = query_params.get('type')
-
-        print(f'Filters - start_date: {start_date}, end_date: {end_date}, txn_type: {txn_type}')  # Debug statement
-
-        filters = {"user_id": user_id}
-        if start_date:
-            filters["date"] = {"$gte": start_date}
-        if end_date:
-            if "date" in filters:
-                filters["date"]["$lte"] = end_date
-            else:
-                filters["date"] = {"$lte": end_date}
-        if txn_type:
-            filters["txn_type"] = txn_type
-
-        transactions = list(transactions_db.find(filters))
-        print(f'{len(transactions)} transactions found with filters')  # Debug statement
+        try:
+            filters = transaction_filters(user_id, query_params)
+        except DateParseError as e:
+            return jsonify({"message": str(e)}), 400
+        print(f'Filters: {filters}')  # Debug statement
 
-        for transaction in transactions:
-            transaction['_id'] = str(transaction['_id'])  # Convert ObjectId to string for JSON serialization
+        response, transaction_count = list_documents(transactions_db, filters)
+        print(f'{transaction_count} transactions found with filters')  # Debug statement
 
-        log_action(user_id, "get_transactions", {"filters": filters, "transaction_count": len(transactions)})
-        return jsonify(transactions), 200
+        log_action(user_id, "get_transactions", {"filters": filters, "transaction_count": transaction_count})
+        return response
     except Exception as e:
         print('Error retrieving transactions:', str(e))  # Debug statement
         log_action(user_id, "get_transactions_error", {"error": str(e)})
         return jsonify({"message": "Error retrieving transactions"}), 500
 
+# Download transactions as CSV or NDJSON; takes the same filters as the list
+@transactions_bp.route('/transactions/export', methods=['GET'])
+@login_required
+def export_transactions(user_data):
+    print('GET /transactions/export called')  # Debug statement
+    try:
+        user_id = user_data.get('user_id')
+        filters = transaction_filters(user_id, request.args)
+        response = export_documents(transactions_db, filters, 'transactions')
+        log_action(user_id, "export_transactions", {"filters": filters, "params": request.args.to_dict()})
+        return response
+    except (ExportError, DateParseError) as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        print('Error exporting transactions:', str(e))  # Debug statement
+        return jsonify({"message": "Error exporting transactions"}), 500
+
 @transactions_bp.route('/transactions', methods=['POST'])
 @login_required
+@idempotent('create_transaction')
 def create_transaction(user_data):
     print('POST /transactions called')  # Debug statement
     try:
@@ -122,28 +113,26 @@ def create_transaction(user_data):
         user_id = user_data.get('user_id')
         transaction_data['id'] = str(uuid.uuid4())
         transaction_data['user_id'] = user_id  # Associate transaction with the user
+        transaction_data.update(timestamp_fields(transaction_data))
 
-        adjusted_items = []
+        applied_changes = []
 
         try:
-            if transaction_data['txn_type'] == 'sale':
-                for item in transaction_data['cart']:
-                    valid, message = validate_product_availability(item['id'], item['quantity'])
-                    if not valid:
-                        rollback_quantities(adjusted_items)
-                        log_action(user_id, "create_transaction_validation_failed", {"transaction_data": transaction_data, "message": message})
-                        return jsonify({"message": message}), 400
-                    
-                    adjust_product_quantity(item['id'], -item['quantity'])
-                    adjusted_items.append(item)
-
-            elif transaction_data['txn_type'] == 'refund':
-                for item in transaction_data['cart']:
-                    adjust_product_quantity(item['id'], item['quantity'])
-
-            with db_lock:
-                result = transactions_db.insert_one(transaction_data)
-                transaction_data['_id'] = str(result.inserted_id)
+            changes = transaction_stock_changes(transaction_data)
+            ok, errors = apply_cart_checked(user_id, changes)
+            if not ok:
+                log_action(user_id, "create_transaction_validation_failed", {"transaction_data": transaction_data, "errors": errors})
+                return jsonify(cart_errors_response(errors)), cart_errors_status(errors)
+            applied_changes = changes
+
+            session_id = active_session_id(user_id)
+            transaction_data.pop('session_id', None)
+            if session_id:
+                transaction_data['session_id'] = session_id
+            result = transactions_db.insert_one(transaction_data)
+            record_transaction(transaction_data)
+            record_session_transactions(session_id, [transaction_data])
+            transaction_data['_id'] = str(result.inserted_id)
 
             print('Transaction created with ID:', transaction_data['id'])  # Debug statement
             log_action(user_id, "create_transaction", transaction_data)
@@ -151,7 +140,7 @@ def create_transaction(user_data):
 
         except Exception as e:
             print('Error during transaction creation, rolling back changes:', str(e))  # Debug statement
-            rollback_quantities(adjusted_items)
+            rollback_quantities(user_id, applied_changes)
             log_action(user_id, "create_transaction_error", {"error": str(e)})
             return jsonify({"message": "Error creating transaction, changes rolled back"}), 500
 
@@ -160,9 +149,127 @@ def create_transaction(user_data):
         log_action(user_id, "create_transaction_error", {"error": str(e)})
         return jsonify({"message": "Error creating transaction"}), 500
 
+# Upload a terminal's queued offline transactions in one request. All of them
+# are checked against one read of the products, the stock changes of every
+# accepted one go out as one bulk write, and they are stored with one
+# insert_many. A transaction with a client_id is stored at most once, so a
+# terminal can resend its whole queue after a dropped connection.
+@transactions_bp.route('/transactions/batch', methods=['POST'])
+@login_required
+@idempotent('create_transaction_batch')
+def create_transaction_batch(user_data):
+    print('POST /transactions/batch called')  # Debug statement
+    try:
+        user_id = user_data.get('user_id')
+        body = request.json
+        items = body.get('transactions') if isinstance(body, dict) else body
+        if not isinstance(items, list) or not items:
+            return jsonify({"message": "transactions must be a non-empty list"}), 400
+        if len(items) > Config.TRANSACTION_BATCH_MAX_SIZE:
+            return jsonify({"message": f"A batch may hold at most {Config.TRANSACTION_BATCH_MAX_SIZE} transactions"}), 400
+
+        results = []
+        client_ids = []
+        for index, item in enumerate(items):
+            client_id = item.get('client_id') if isinstance(item, dict) else None
+            if isinstance(item, dict) and not client_id:
+                item.pop('client_id', None)
+            results.append({"index": index, "client_id": client_id})
+            if client_id:
+                client_ids.append(client_id)
+        existing = {}
+        if client_ids:
+            for doc in transactions_db.find({"user_id": user_id, "client_id": {"$in": client_ids}}, {"client_id": 1, "id": 1}):
+                existing[doc['client_id']] = doc.get('id')
+
+        # Duplicates and malformed entries are settled before any stock is read
+        pending = []
+        seen = set()
+        for index, item in enumerate(items):
+            result = results[index]
+            client_id = result["client_id"]
+            if client_id in existing:
+                result.update(status=BATCH_DUPLICATE, id=existing[client_id])
+                continue
+            if client_id and client_id in seen:
+                result.update(status=BATCH_DUPLICATE, message="client_id repeated in this batch")
+                continue
+            try:
+                changes = transaction_stock_changes(item)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                result.update(status=BATCH_REJECTED, message="Invalid transaction")
+                continue
+            if client_id:
+                seen.add(client_id)
+            pending.append((index, item, changes))
+
+        accepted = []
+        for (index, item, changes), errors in zip(pending, allocate_carts(user_id, [changes for _, _, changes in pending])):
+            if errors:
+                results[index].update(status=BATCH_REJECTED, **cart_errors_response(errors))
+            else:
+                accepted.append((index, item, changes))
+
+        ok, failed_ids = apply_cart(user_id, [change for _, _, changes in accepted for change in changes])
+        if not ok:
+            # Another till changed the stock between the read and the write; nothing was kept
+            log_action(user_id, "create_transaction_batch_conflict", {"product_ids": failed_ids})
+            # 409 is not stored under the Idempotency-Key, so the till can resend the same batch
+            response = jsonify({"message": "Stock changed while the batch was processed, please retry", "product_ids": failed_ids})
+            response.headers['Retry-After'] = '1'
+            return response, 409
+
+        now = datetime.utcnow()
+        session_id = active_session_id(user_id)
+        docs = []
+        for index, item, changes in accepted:
+            item.pop('_id', None)
+            item['id'] = str(uuid.uuid4())
+            item['user_id'] = user_id  # Associate transaction with the user
+            item.update(timestamp_fields(item, now))
+            item.pop('session_id', None)
+            if session_id:
+                item['session_id'] = session_id
+            docs.append(item)
+
+        # ordered=False stores everything it can; a duplicate client_id from a
+        # concurrent upload only fails its own document
+        failed = {}
+        if docs:
+            try:
+                transactions_db.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                failed = {error['index']: error for error in e.details.get('writeErrors', [])}
+        if failed:
+            rollback_quantities(user_id, [change for position, (_, _, changes) in enumerate(accepted) if position in failed for change in changes])
+            raced = [docs[position].get('client_id') for position, error in failed.items() if error.get('code') == 11000]
+            existing = {doc['client_id']: doc.get('id') for doc in transactions_db.find({"user_id": user_id, "client_id": {"$in": raced}}, {"client_id": 1, "id": 1})} if raced else {}
+
+        created = []
+        for position, (index, item, changes) in enumerate(accepted):
+            result = results[index]
+            if position not in failed:
+                result.update(status=BATCH_CREATED, id=item['id'], _id=str(item['_id']))
+                created.append(item)
+            elif failed[position].get('code') == 11000:
+                result.update(status=BATCH_DUPLICATE, id=existing.get(item.get('client_id')))
+            else:
+                result.update(status=BATCH_REJECTED, message="Error saving transaction")
+        record_transaction_batch(created)
+        record_session_transactions(session_id, created)
+
+        counts = {status: sum(1 for result in results if result["status"] == status) for status in (BATCH_CREATED, BATCH_DUPLICATE, BATCH_REJECTED)}
+        print(f'Transaction batch processed: {counts}')  # Debug statement
+        log_action(user_id, "create_transaction_batch", {"counts": counts, "transaction_ids": [item['id'] for item in created]})
+        return jsonify({"results": results, **counts}), 200
+    except Exception as e:
+        print('Error processing transaction batch:', str(e))  # Debug statement
+        log_action(user_id, "create_transaction_batch_error", {"error": str(e)})
+        return jsonify({"message": "Error processing transaction batch"}), 500
 
 @transactions_bp.route('/transactions/<string:transaction_id>', methods=['PUT'])
 @login_required
+@locked_by('transaction', 'transaction_id')
 def update_transaction(user_data, transaction_id):
     print(f'PUT /transactions/{transaction_id} called')  # Debug statement
     try:
@@ -174,8 +281,16 @@ def update_transaction(user_data, transaction_id):
         transaction_data = request.json
         print('Transaction data to update:', transaction_data)  # Debug statement
 
-        with db_lock:
-            transactions_db.update_one({"invoiceNumber": transaction_id}, {"$set": transaction_data})
+        transaction_data.pop('_id', None)
+        transaction_data.pop('created_at', None)
+        transaction_data.pop('session_id', None)
+        if 'date' in transaction_data:
+            transaction_data['date_ts'] = date_timestamp(transaction_data['date'], datetime.utcnow())
+        before = transactions_db.find_one_and_update({"invoiceNumber": transaction_id}, {"$set": transaction_data})
+        if before:
+            after = dict(before, **transaction_data)
+            record_transaction_change(before, after)
+            record_session_change(before, after)
         print(f'Transaction with ID {transaction_id} updated')  # Debug statement
         log_action(user_id, "update_transaction", {"transaction_id": transaction_id, "transaction_data": transaction_data})
         return jsonify({"message": "Transaction updated successfully"}), 200
@@ -190,24 +305,26 @@ def delete_transaction(user_data, transaction_id):
     print(f'DELETE /transactions/{transaction_id} called')  # Debug statement
     try:
         user_id = user_data.get('user_id')
-        if not check_ownership(user_id, transaction_id):
+        # Removing the document is the atomic claim: only the request that
+        # deletes it puts the stock back, even across workers.
+        transaction = transactions_db.find_one_and_delete({"invoiceNumber": transaction_id, "user_id": user_id})
+        if not transaction:
             log_action(user_id, "delete_transaction_unauthorized", {"transaction_id": transaction_id})
             return jsonify({"message": "Unauthorized to delete this transaction"}), 403
 
-        with db_lock:
-            transaction = transactions_db.find_one({"invoiceNumber": transaction_id})
-            if transaction:
-                if transaction['txn_type'] == 'sale':
-                    for item in transaction['cart']:
-                        adjust_product_quantity(item['id'], item['quantity'])
-                elif transaction['txn_type'] == 'refund':
-                    for item in transaction['cart']:
-                        adjust_product_quantity(item['id'], -item['quantity'])
-
-                transactions_db.delete_one({"invoiceNumber": transaction_id})
+        # Lines whose product has since been deleted are skipped; the rest are restocked
+        missing = []
+        if transaction['txn_type'] == 'sale':
+            _, missing = apply_unchecked(user_id, cart_stock_changes(transaction['cart'], 1))
+        elif transaction['txn_type'] == 'refund':
+            _, missing = apply_unchecked(user_id, cart_stock_changes(transaction['cart'], -1))
+        record_transaction(transaction, -1)
+        record_session_transactions(transaction.get('session_id'), [transaction], -1)
 
         print(f'Transaction with ID {transaction_id} deleted')  # Debug statement
-        log_action(user_id, "delete_transaction", {"transaction_id": transaction_id})
+        log_action(user_id, "delete_transaction", {"transaction_id": transaction_id, "missing_product_ids": missing})
+        if missing:
+            return jsonify({"message": "Transaction deleted; stock not adjusted for missing products", "missing_product_ids": missing}), 200
         return jsonify({"message": "Transaction deleted successfully"}), 200
     except Exception as e:
         print(f'Error deleting transaction with ID {transaction_id}:', str(e))  # Debug statement